@@ -3,3 +3,4 @@
 
 import api.auth
 import api.games
+import api.media
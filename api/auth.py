@@ -6,16 +6,23 @@ import logging
 import re
 from time import time
 
-from arango import ArangoClient
 from connexion import NoContent
 from flask import session
-from jose import jwt, ExpiredSignatureError
+from jose import jwt, ExpiredSignatureError, JWTError
 
-from database.player import authenticate, add_token, remove_token, validate, get_all_player_emails, create, delete
+from database.connection import get_db
+from database.player import authenticate, add_token, remove_token, validate, create, delete, token_key, \
+    PlayerExistsException
 from model.player import PlayerStateException, Player
+from util.cache import LRUCache
+from util.executor import ExecutorBusyException
 
 logger = logging.getLogger('api.auth')
 
+# known valid and revoked tokens by token key, entries expire to pick up revocations from other processes
+token_cache = LRUCache(int(os.getenv('TOKEN_CACHE_SIZE', 10000)), float(os.getenv('TOKEN_CACHE_TTL', 60)))
+REVOKED = 'revoked'
+
 
 def generate_token(identifier):
     """
@@ -32,9 +39,8 @@ def generate_token(identifier):
         "sub": str(identifier),
     }
     token = jwt.encode(payload, os.getenv('SECRET_KEY'), algorithm=os.getenv('TOKEN_ALGO'))
-    client = ArangoClient(hosts=os.getenv('DB_URI'))
-    db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
-    add_token(db, identifier, token)
+    db = get_db()
+    add_token(db, identifier, token, payload['exp'])
     return token
 
 
@@ -47,25 +53,79 @@ def user_by_token(token, required_scopes=None):
 
 def validate_token(token):
     """
-    validate if token is valid and not expired
+    validate if token is valid and not expired, the signature and expiry are checked locally and the
+    database is only consulted if the token is not in the token cache (unless TOKEN_VALIDATION is 'database')
     :param token: JWT token
-    :return: nothing or dict(mail, uid), 500, 401 or 200
+    :return: nothing or dict(mail, uid), 401 or 200
     """
     logger.debug(f'validate token request for {token}')
-    client = ArangoClient(hosts=os.getenv('DB_URI'))
-    db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
-    player = validate(db, token)
+    try:
+        claims = jwt.decode(token, os.getenv('SECRET_KEY'), algorithms=[os.getenv('TOKEN_ALGO')])
+    except ExpiredSignatureError:
+        logger.info(f'token {token} expired')
+        token_cache.pop(token_key(token))
+        return NoContent, 401
+    except JWTError as e:
+        logger.warning(f'invalid token {token}: {e}')
+        return NoContent, 401
+    key = token_key(token)
+    cached = token_cache.get(key) if os.getenv('TOKEN_VALIDATION', 'cache') == 'cache' else None
+    if cached == REVOKED:
+        logger.info(f'token {token} has been revoked')
+        return NoContent, 401
+    if cached:
+        return dict(cached), 200
+    player = validate(get_db(), token)
     if player:
-        try:
-            jwt.decode(token, os.getenv('SECRET_KEY'), algorithms=[os.getenv('TOKEN_ALGO')])
-        except ExpiredSignatureError:
-            logger.info(f'token {token} expired for {player.email}')
-            remove_token(db, player.email, token)
+        if claims['sub'] != player.email:
+            logger.warning(f"token {token} issued for {claims['sub']} but registered for {player.email}")
             return NoContent, 401
-        return dict(sub=player.email, uid=player.id), 200
+        result = dict(sub=player.email, uid=player.id)
+        # tokens without an expiry are cached as long as any other token
+        ttl = token_cache.ttl
+        if claims.get('exp') is not None:
+            ttl = claims['exp'] - time() if ttl is None else min(ttl, claims['exp'] - time())
+        token_cache.put(key, result, ttl)
+        return dict(result), 200
     else:
-        logger.warning(f'unable to validate {token}')
-        return NoContent, 500
+        # a validly signed token the store does not know was removed, or issued before tokens had their own collection
+        logger.warning(f'unknown token {token}')
+        return NoContent, 401
+
+
+def revoke_token(email, token):
+    """
+    remove a token from the database and remember it as revoked until it expires
+    :param email: mail of the token owner
+    :param token: JWT token
+    """
+    try:
+        claims = jwt.get_unverified_claims(token)
+        lifetime = claims['exp'] - time()
+    except (JWTError, KeyError):
+        lifetime = None
+    if lifetime and lifetime > 0:
+        token_cache.put(token_key(token), REVOKED, lifetime)
+    else:
+        token_cache.pop(token_key(token))
+    try:
+        remove_token(get_db(), email, token)
+    except PlayerStateException as e:
+        logger.info(f'could not remove token for {email}: {e}')
+
+
+def revoke_tokens(tokens: [dict]):
+    """
+    remember tokens removed from the database as revoked until they expire
+    :param tokens: token documents
+    """
+    for db_token in tokens:
+        expires_at = db_token.get('expires_at')
+        lifetime = expires_at - time() if expires_at is not None else None
+        if lifetime is None or lifetime > 0:
+            token_cache.put(db_token['_key'], REVOKED, lifetime)
+        else:
+            token_cache.pop(db_token['_key'])
 
 
 def login(player):
@@ -82,9 +142,10 @@ def login(player):
     if 'username' in session:
         return f'You are already logged in {mail}', 500
     else:
-        client = ArangoClient(hosts=os.getenv('DB_URI'))
-        db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
-        player = authenticate(db, mail, password, os.getenv('SECRET_KEY'))
+        try:
+            player = authenticate(get_db(), mail, password, os.getenv('SECRET_KEY'))
+        except ExecutorBusyException:
+            return 'too many login requests, try again later', 503
         if player:
             token = generate_token(mail)
             session['username'] = mail
@@ -100,6 +161,8 @@ def logout():
     :return: 200
     """
     logger.debug('logout request')
+    if 'token' in session:
+        revoke_token(session.get('username'), session['token'])
     if 'username' in session:
         del(session['username'])
     if 'uid' in session:
@@ -123,14 +186,6 @@ def register(player):
     if 'username' in session:
         return f'You are already logged in {mail}', 500
     else:
-        client = ArangoClient(hosts=os.getenv('DB_URI'))
-        db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
-        try:
-            if next(iter([e for e in get_all_player_emails(db) if e == mail])):
-                logger.warning(f'player already registered under {mail}')
-                return f'player already registered under {mail}', 500
-        except PlayerStateException:
-            logger.info('players collection not initialized')
         if os.getenv('PASSWORD_COMPLEXITY') == 'simple':
             if len(password) < 6:
                 return f'password needs to be at least 6 characters', 422
@@ -145,7 +200,12 @@ def register(player):
                 return f'password needs at least 1 lower case character', 422
             if not re.search(r'\W', password):
                 return f"password needs at least one special symbol", 422
-        player = create(db, mail, password, os.getenv('SECRET_KEY'))
+        try:
+            player = create(get_db(), mail, password, os.getenv('SECRET_KEY'))
+        except PlayerExistsException:
+            return f'player already registered under {mail}', 500
+        except ExecutorBusyException:
+            return 'too many registration requests, try again later', 503
         session['username'] = mail
         session['uid'] = player.id
         token = generate_token(mail)
@@ -164,12 +224,12 @@ def remove():
     if code != 200:
         return f'problem removing player', code
     try:
-        client = ArangoClient(hosts=os.getenv('DB_URI'))
-        db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+        db = get_db()
         player = Player(p['sub'], '')
         player.id = p['uid']
         logger.info(f"deleting player {p['sub']} ({p['uid']})")
-        delete(db, player)
+        # every session of the player ends, not only this one
+        revoke_tokens(delete(db, player))
         return logout()
     except PlayerStateException as e:
         return f"error while deleting player {p['sub']}, {e}", 500
@@ -1,30 +1,89 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
-import json
-import os
+from urllib.parse import quote
+from uuid import UUID
 
-from arango import ArangoClient
 from connexion import NoContent
-from flask import session
+from flask import session, request, Response
 
-from database.game import get_all_games, read, create, GameStateException, delete
-from util.coder import MarugotoEncoder
-from util.converter import convert_api_game, ConverterException
+from api.media import media_response, get_variant
+from database.connection import get_db
+from database.game import list_games, read_cached, read_image, create, GameStateException, delete
+from database.media import media_store
+from model.media import Media
+from util.coder import SERIALIZERS
+from util.converter import convert_api_game, generate_api_game, ConverterException
 
 
-def all_games():
-    client = ArangoClient(hosts=os.getenv('DB_URI'))
-    db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
-    result = []
-    for name in get_all_games(db):
-        result.append(json.dumps(read(db, name), cls=MarugotoEncoder))
-    return result, 200
+def all_games(limit=20, cursor=None):
+    db = get_db()
+    summaries, next_cursor = list_games(db, limit, cursor)
+    for summary in summaries:
+        media = Media.parse(summary['image'])
+        inline = summary.pop('inline_image')
+        if media:
+            summary['image'] = f"media/{media.key}/thumbnail"
+        elif inline:
+            summary['image'] = f"games/{quote(summary['title'])}/image?variant=thumbnail"
+    return {'games': summaries, 'cursor': next_cursor}, 200
+
+
+def get_game(title):
+    db = get_db()
+    try:
+        game = read_cached(db, title)
+    except GameStateException as e:
+        return f"error while loading game {title}: {e}", 404
+    msgpack = SERIALIZERS['msgpack'].content_type
+    if request.accept_mimetypes.best_match([SERIALIZERS['json'].content_type, msgpack]) == msgpack:
+        return Response(SERIALIZERS['msgpack'].dumps(generate_api_game(game, binary=True)), 200, mimetype=msgpack)
+    return generate_api_game(game), 200
+
+
+def get_game_image(title, variant=None, format='webp'):
+    db = get_db()
+    try:
+        image = read_image(db, title)
+    except GameStateException as e:
+        return f"error while loading game {title}: {e}", 404
+    if not image:
+        return f"game {title} has no image", 404
+    if isinstance(image, Media):
+        if variant:
+            return get_variant(image.key, variant, format)
+        store = media_store()
+        media = store.stat(image.key)
+        if not media:
+            return f"image of game {title} not found", 404
+        return media_response(store, media)
+    return image, 200
+
+
+def get_route(title, waypoint=None, energy=None):
+    db = get_db()
+    try:
+        game = read_cached(db, title)
+    except GameStateException as e:
+        return f"error while loading game {title}: {e}", 404
+    try:
+        position = game.moves().waypoint(UUID(waypoint)) if waypoint else game.start
+    except ValueError:
+        position = None
+    if not position:
+        return f"waypoint {waypoint} not found in game {title}", 404
+    energy = game.energy if energy is None else energy
+    analysis = game.reachability()
+    return {
+        'waypoint': position.id.hex,
+        'min_energy': analysis.min_energy[analysis.index[position.id]],
+        'route': [w.id.hex for w in analysis.route(position)],
+        'safe': [w.id.hex for w in analysis.safe_moves(position, energy)]
+    }, 200
 
 
 def add_game(game):
     title = game['title']
-    client = ArangoClient(hosts=os.getenv('DB_URI'))
-    db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    db = get_db()
     try:
         game = convert_api_game(game)
         create(db, game, session['uid'])
@@ -36,10 +95,9 @@ def add_game(game):
 
 
 def remove_game(title):
-    client = ArangoClient(hosts=os.getenv('DB_URI'))
-    db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    db = get_db()
     try:
-        game = read(db, title)
+        game = read_cached(db, title)
         delete(db, game, session['uid'])
     except GameStateException as e:
         return f"error while deleting game {title}: {e}", 500
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import logging
+
+from flask import request, Response
+from werkzeug.wsgi import wrap_file
+
+from database.derivative import derivative_cache, DerivativeException
+from database.media import media_store, MediaStateException, CHUNK_SIZE
+from model.media import Media
+
+logger = logging.getLogger('api.media')
+
+# lookups of a variant before giving up, a variant evicted between lookup and open is rendered again
+VARIANT_ATTEMPTS = 3
+# media never changes under its content hash, it is only served to authorized players so shared caches keep no copy
+CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+def media_response(store, media: Media) -> Response:
+    """
+    stream stored media, with a strong ETag, immutable caching and a single byte range when requested
+    :param store: media store
+    :param media: stored media with its size
+    :return: 200, 206 with the requested range, 304 if the client has it or 416 for an unsatisfiable range
+    """
+    headers = {'Cache-Control': CACHE_CONTROL, 'Accept-Ranges': 'bytes'}
+    if request.if_none_match.contains(media.key):
+        response = Response(status=304, headers=headers)
+        response.set_etag(media.key)
+        return response
+    start, stop, status = 0, media.size, 200
+    ranges = request.range
+    if_range = request.if_range
+    # a range is only honoured if the client still has this version, multiple ranges are served in full
+    current = (if_range.etag is None and if_range.date is None) or if_range.etag == media.key
+    if ranges and len(ranges.ranges) == 1 and current:
+        selected = ranges.range_for_length(media.size)
+        if selected is None:
+            headers['Content-Range'] = f'bytes */{media.size}'
+            response = Response(status=416, headers=headers)
+            response.set_etag(media.key)
+            return response
+        start, stop = selected
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{media.size}'
+    headers['Content-Length'] = str(stop - start)
+    if status == 200 and hasattr(store, 'open'):
+        # lets servers with a file wrapper (gunicorn, uwsgi) use sendfile
+        body = wrap_file(request.environ, store.open(media.key), CHUNK_SIZE)
+    else:
+        body = store.read(media.key, start, stop)
+    response = Response(body, status=status, headers=headers, mimetype=media.content_type, direct_passthrough=True)
+    response.set_etag(media.key)
+    return response
+
+
+def get_media(digest):
+    store = media_store()
+    try:
+        media = store.stat(digest)
+    except MediaStateException as e:
+        logger.warning(f'could not read media {digest}: {e}')
+        return f'could not read media {digest}', 500
+    if not media:
+        return f'media {digest} not found', 404
+    return media_response(store, media)
+
+
+def get_variant(digest, variant, format='webp'):
+    cache = derivative_cache()
+    for _ in range(VARIANT_ATTEMPTS):
+        try:
+            media = cache.get(media_store(), digest, variant, format)
+        except DerivativeException as e:
+            logger.info(f'could not render {variant} of media {digest}: {e}')
+            return f'media {digest} has no {variant} {format} variant', 415
+        except MediaStateException as e:
+            logger.warning(f'could not read media {digest}: {e}')
+            return f'could not read media {digest}', 500
+        if not media:
+            return f'media {digest} not found', 404
+        try:
+            # the variant is opened or mapped here, once it is it can be streamed even if it is evicted meanwhile
+            return media_response(cache, media)
+        except FileNotFoundError:
+            logger.info(f'variant {media.key} was evicted before it was opened, rendering it again')
+    logger.warning(f'could not open {variant} {format} variant of media {digest}')
+    return f'could not read media {digest}', 500
@@ -7,6 +7,18 @@ import connexion
 
 from dotenv import load_dotenv
 
+# module level settings (pool and cache sizes) are read on import
+load_dotenv()
+
+from database.connection import shutdown as db_shutdown, pool_stats
+from database.buffer import write_buffer
+from database.game import cache_stats
+from database.player import password_executor
+from util.coder import SERIALIZERS
+
+# content types of binary formats that are served as is
+BINARY_CONTENT_TYPES = [s.content_type for s in SERIALIZERS.values() if s.name != 'json']
+
 
 class Server:
     application = None
@@ -23,11 +35,11 @@ class Server:
         self.port = int(os.getenv('PORT', 8080))
         self.debug = bool(os.getenv('DEBUG', True))
 
-        # orm_handler.db_init()
-
         @self.connexion_app.app.after_request
         def apply_cors(response):
-            response.headers["Content-Type"] = "application/json"
+            # streamed media keeps its own content type
+            if response.mimetype not in BINARY_CONTENT_TYPES and not response.direct_passthrough:
+                response.headers["Content-Type"] = "application/json"
             response.headers["Access-Control-Allow-Origin"] = "*"
             response.headers["Access-Control-Allow-Headers"] = "x-api-key, Origin, Accept, Content-Type, X-Requested-With, X-CSRF-Token"
             response.headers["Access-Control-Request-Headers"] = "*"
@@ -40,11 +52,25 @@ class Server:
         #     orm_handler.db_session.remove()
 
     def run(self):
-        if self.debug:
-            print("Running in Debug Mode")
-            self.connexion_app.run(port=self.port, debug=True, threaded=True)
-        else:
-            self.connexion_app.run(port=self.port, debug=self.debug, server="gevent")
+        try:
+            if self.debug:
+                print("Running in Debug Mode")
+                self.connexion_app.run(port=self.port, debug=True, threaded=True)
+            else:
+                self.connexion_app.run(port=self.port, debug=self.debug, server="gevent")
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+        write queued game instance changes, and release the shared database connection pool and password hashing workers
+        """
+        write_buffer().shutdown()
+        logging.info(f'shutting down, database pool stats: {pool_stats()}, '
+                     f'password hashing stats: {password_executor().stats()}, game cache stats: {cache_stats()}, '
+                     f'write-behind stats: {write_buffer().stats()}')
+        password_executor().shutdown()
+        db_shutdown()
 
 
 s = None
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+"""
+Token validation latency for a growing number of players.
+
+    docker-compose up -d
+    python -m benchmark.auth [--sizes 1000,10000,100000,1000000] [--lookups 1000]
+
+prints one JSON line per player count
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+from time import time, perf_counter
+from uuid import uuid4
+
+from arango import ArangoClient
+from dotenv import load_dotenv
+
+from database.player import validate, token_key
+from database.schema import initialize
+
+
+def populate(db, start, end, batch=10000):
+    """
+    bulk import players and a token per player
+    :param db: connection
+    :param start: first player number
+    :param end: last player number (exclusive)
+    :param batch: import batch size
+    :return: list of the generated tokens
+    """
+    tokens = []
+    expires_at = int(time()) + 3600
+    for offset in range(start, end, batch):
+        players = []
+        player_tokens = []
+        for n in range(offset, min(offset + batch, end)):
+            key = uuid4().hex
+            token = f'benchmark-token-{n}-{key}'
+            players.append({'_key': key, 'mail': f'player{n}@benchmark.com', 'password': ''})
+            player_tokens.append({'_key': token_key(token), 'player': key, 'expires_at': expires_at})
+            tokens.append(token)
+        db.collection('players').import_bulk(players)
+        db.collection('tokens').import_bulk(player_tokens)
+    return tokens
+
+
+def run(sizes, lookups):
+    load_dotenv()
+    client = ArangoClient(hosts=os.getenv('DB_URI'))
+    sys_db = client.db('_system', username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    name = f"{os.getenv('DB_NAME')}_benchmark"
+    if sys_db.has_database(name):
+        sys_db.delete_database(name)
+    sys_db.create_database(name)
+    db = client.db(name, username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    initialize(db)
+    tokens = []
+    try:
+        for size in sorted(sizes):
+            tokens += populate(db, len(tokens), size)
+            samples = []
+            for token in random.choices(tokens, k=lookups):
+                started = perf_counter()
+                assert validate(db, token)
+                samples.append((perf_counter() - started) * 1000)
+            samples.sort()
+            print(json.dumps({
+                'benchmark': 'validate_token',
+                'players': size,
+                'lookups': lookups,
+                'mean_ms': statistics.mean(samples),
+                'p50_ms': samples[len(samples) // 2],
+                'p99_ms': samples[int(len(samples) * 0.99) - 1]
+            }))
+    finally:
+        sys_db.delete_database(name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='token validation latency benchmark')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(',')], args.lookups)
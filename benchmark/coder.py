@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+"""
+Game instance encode and decode time and document size per serialization format for a growing number of players.
+
+    python -m benchmark.coder [--players 10,100,1000] [--steps 50] [--image 65536] [--repeat 5]
+
+prints JSON lines for encoding and decoding each instance size, no database is needed
+"""
+
+import argparse
+import json
+import os
+import statistics
+from time import perf_counter
+
+from benchmark import generator
+from benchmark.generator import generate_game
+from util.coder import SERIALIZERS, CODEC_VERSION
+
+
+def generate_instance(players, steps, image=0, seed=1):
+    """
+    generate a game instance where every player walked a random path through a generated game
+    :param players: number of players
+    :param steps: number of steps on each path
+    :param image: size of the game image in bytes
+    :param seed: random seed
+    :return: game instance
+    """
+    game = generate_game('benchmark', 1000)
+    game.image = os.urandom(image) if image else None
+    return generator.generate_instance(game, players, steps, seed)
+
+
+def measure(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = perf_counter()
+        result = fn()
+        samples.append(perf_counter() - started)
+    return result, samples
+
+
+def run(players, steps, image, repeat):
+    for count in players:
+        instance = generate_instance(count, steps, image)
+        for serializer in SERIALIZERS.values():
+            data, samples = measure(lambda: serializer.dumps(instance), repeat)
+            print(json.dumps({
+                'benchmark': 'instance_encode',
+                'format': serializer.name,
+                'codec': CODEC_VERSION,
+                'players': count,
+                'steps': steps,
+                'image': image,
+                'bytes': len(data),
+                'median': statistics.median(samples),
+                'min': min(samples)
+            }))
+            loaded, samples = measure(lambda: serializer.loads(data), repeat)
+            assert len(loaded.player_states) == count
+            print(json.dumps({
+                'benchmark': 'instance_decode',
+                'format': serializer.name,
+                'codec': CODEC_VERSION,
+                'players': count,
+                'steps': steps,
+                'image': image,
+                'median': statistics.median(samples),
+                'min': min(samples)
+            }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark game instance encoding')
+    parser.add_argument('--players', default='10,100,1000', help='comma separated numbers of players')
+    parser.add_argument('--steps', type=int, default=50, help='steps on the path of each player')
+    parser.add_argument('--image', type=int, default=65536, help='size of the game image in bytes')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions per measurement')
+    args = parser.parse_args()
+    run([int(p) for p in args.players.split(',')], args.steps, args.image, args.repeat)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+"""
+Game publish and load time for a growing number of waypoints.
+
+    docker-compose up -d
+    python -m benchmark.game [--sizes 500,1000,2000,5000] [--repeat 3]
+
+prints JSON lines for publishing and loading each game size
+"""
+
+import argparse
+import json
+import os
+import statistics
+from time import perf_counter
+
+from arango import ArangoClient
+from dotenv import load_dotenv
+
+from benchmark.generator import generate_game
+from database.game import create, read
+from database.schema import initialize
+
+
+def run(sizes, repeat):
+    load_dotenv()
+    client = ArangoClient(hosts=os.getenv('DB_URI'))
+    sys_db = client.db('_system', username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    name = f"{os.getenv('DB_NAME')}_benchmark"
+    if sys_db.has_database(name):
+        sys_db.delete_database(name)
+    sys_db.create_database(name)
+    db = client.db(name, username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    initialize(db)
+    try:
+        for size in sizes:
+            game = generate_game(f'benchmark_{size}', size)
+            started = perf_counter()
+            stats = create(db, game)
+            print(json.dumps({
+                'benchmark': 'game_create',
+                'waypoints': size,
+                'seconds': perf_counter() - started,
+                'collections': stats
+            }))
+            samples = []
+            for _ in range(repeat):
+                started = perf_counter()
+                loaded = read(db, game.title)
+                samples.append(perf_counter() - started)
+                assert len(loaded.graph.nodes) == size
+            print(json.dumps({
+                'benchmark': 'game_read',
+                'waypoints': size,
+                'repeat': repeat,
+                'mean_seconds': statistics.mean(samples),
+                'min_seconds': min(samples),
+                'seconds_per_waypoint': min(samples) / size
+            }))
+    finally:
+        sys_db.delete_database(name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='game publish and load benchmark')
+    parser.add_argument('--sizes', default='500,1000,2000,5000')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(',')], args.repeat)
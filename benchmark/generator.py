@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+"""
+Synthetic games for benchmarks, every generated game is a valid DAG with a start and is reproducible from its seed.
+
+    python -m benchmark.generator [--size 1000] [--npcs 2]
+
+prints a JSON line describing the generated game
+"""
+
+import argparse
+import json
+import random
+from datetime import datetime
+
+import networkx as nx
+
+from model.dialog import Dialog, Mail
+from model.game import Game, Waypoint
+from model.player import NonPlayableCharacter, Player
+from model.task import Task
+
+SOLUTION = 'answer'
+
+
+def generate_dialog(rnd, name, waypoints, depth, task_density):
+    """
+    generate a dialog of two interactions per level that all follow up on both interactions of the level before,
+    every follow up is bound to a random waypoint
+    :param rnd: random generator
+    :param name: name of the NPC
+    :param waypoints: waypoints of the game
+    :param depth: number of levels after the start
+    :param task_density: fraction of follow ups that need a task solved
+    :return: dialog
+    """
+    dialog = Dialog()
+    start = Mail(dialog.graph, f'{name} start', 'hello')
+    dialog.set_start(start)
+    previous = [start]
+    for level in range(depth):
+        current = []
+        for n in range(2):
+            task = Task(None, f'{name} task {level}.{n}', 'some task', SOLUTION) if rnd.random() < task_density else None
+            interaction = Mail(dialog.graph, f'{name} {level}.{n}', 'some mail', task=task)
+            interaction.waypoints.append(rnd.choice(waypoints))
+            current.append(interaction)
+        for interaction in previous:
+            for follow_up in current:
+                interaction.add_follow_up(follow_up)
+        previous = current
+    return dialog
+
+
+def generate_game(title, size, branching=3, task_density=0.2, npcs=0, dialog_depth=3, seed=1):
+    """
+    generate a game where every waypoint is reached from a random earlier waypoint in the last part of the graph,
+    which keeps the longest path logarithmic in size, links are blocked by a task at the task density
+    :param title: game title
+    :param size: number of waypoints
+    :param branching: average number of destinations per waypoint
+    :param task_density: fraction of links blocked by a task (every n-th link)
+    :param npcs: number of NPCs
+    :param dialog_depth: number of levels in the dialog of each NPC
+    :param seed: random seed
+    :return: game
+    """
+    rnd = random.Random(seed)
+    interval = round(1 / task_density) if task_density else 0
+    game = Game(title)
+    waypoints = [Waypoint(game.graph, f'w{n}') for n in range(size)]
+    for n in range(1, size):
+        source = waypoints[rnd.randrange((n - 1) // branching, n)]
+        if interval and n % interval == 0:
+            source.add_task(Task(waypoints[n], f'task {n}', 'some task', SOLUTION))
+        else:
+            source.add_destination(waypoints[n], rnd.choice([None, 1.0]))
+    game.set_start(waypoints[0])
+    for n in range(npcs):
+        name = f'npc{n}'
+        game.add_non_playable_character(NonPlayableCharacter(name, 'generated',
+                                                             generate_dialog(rnd, name, waypoints, dialog_depth,
+                                                                             task_density)))
+    return game
+
+
+def generate_instance(game, players, steps, seed=1):
+    """
+    generate a game instance where every player walked a random path through a game, without checking moves
+    :param game: game
+    :param players: number of players
+    :param steps: maximum number of steps on each path
+    :param seed: random seed
+    :return: game instance
+    """
+    rnd = random.Random(seed)
+    instance = game.create_new_game()
+    for n in range(players):
+        instance.add_player(Player(f'player{n}@example.com', 'password'), f'first{n}', f'last{n}')
+        state = instance.player_states[-1]
+        for _ in range(steps):
+            successors = list(game.graph.successors(state.current_position()))
+            if not successors:
+                break
+            state.path.append((datetime.utcnow(), rnd.choice(successors)))
+    return instance
+
+
+def describe(game) -> dict:
+    """
+    describe the shape of a game
+    :param game: game
+    :return: dict with node, edge, task, NPC and interaction counts and the longest path
+    """
+    return {
+        'waypoints': game.graph.number_of_nodes(),
+        'edges': game.graph.number_of_edges(),
+        'tasks': sum(len(w.tasks) for w in game.graph.nodes),
+        'npcs': len(game.npcs),
+        'interactions': sum(n.dialog.graph.number_of_nodes() for n in game.npcs),
+        'longest_path': nx.dag_longest_path_length(game.graph, weight=None)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='generate a synthetic game')
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--branching', type=int, default=3)
+    parser.add_argument('--tasks', type=float, default=0.2, help='fraction of links blocked by a task')
+    parser.add_argument('--npcs', type=int, default=2)
+    parser.add_argument('--depth', type=int, default=3, help='levels in each NPC dialog')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps(describe(generate_game('generated', args.size, args.branching, args.tasks, args.npcs,
+                                            args.depth, args.seed))))
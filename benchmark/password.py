@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+"""
+Login password verification throughput, inline double hashing (as authenticate used to do) versus
+a single hash on the password executor, with a number of concurrent clients.
+
+    python -m benchmark.password [--clients 8] [--logins 64]
+
+prints one JSON line per mode
+"""
+
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from database.player import hash_password, verify_password, password_executor
+
+SALT = 'benchmark'
+PASSWORD = 'SuperComplexPassword1!'
+
+
+def inline_login(stored):
+    # authenticate before: hash the provided password, then hash that again while verifying
+    return verify_password(stored, hash_password(PASSWORD, SALT))
+
+
+def executor_login(stored):
+    return password_executor().run(verify_password, stored, PASSWORD)
+
+
+def run(clients, logins):
+    stored = hash_password(PASSWORD, SALT)
+    for mode, login in [('inline', inline_login), ('executor', executor_login)]:
+        with ThreadPoolExecutor(clients) as pool:
+            started = perf_counter()
+            list(pool.map(login, [stored] * logins))
+            elapsed = perf_counter() - started
+        print(json.dumps({
+            'benchmark': 'login',
+            'mode': mode,
+            'clients': clients,
+            'logins': logins,
+            'seconds': elapsed,
+            'logins_per_second': logins / elapsed
+        }))
+    password_executor().shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='login throughput benchmark')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=64)
+    args = parser.parse_args()
+    run(args.clients, args.logins)
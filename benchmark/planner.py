@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+"""
+Energy planning over generated games, no database needed.
+
+    python -m benchmark.planner [--sizes 1000,100000] [--repeat 3] [--players 100] [--energy 2.5]
+
+prints JSON lines for analysing a game, planning the cheapest route from the start, checking the safe moves of
+waypoints, and for players walking a game at random with all available moves and with safe moves only, counting the
+players that got stuck without energy before reaching a finish
+"""
+
+import argparse
+import json
+import random
+import statistics
+from time import perf_counter
+
+from benchmark.generator import generate_game, generate_instance, SOLUTION
+
+
+def measure(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = perf_counter()
+        result = fn()
+        samples.append(perf_counter() - started)
+    return result, {'repeat': repeat, 'mean_seconds': statistics.mean(samples), 'min_seconds': min(samples)}
+
+
+def walk(game, players, safe, seed=1):
+    """
+    let players move to random available waypoints until no move is left
+    :return: seconds per move, number of moves and number of players stuck before a finish
+    """
+    rnd = random.Random(seed)
+    instance = generate_instance(game, players, 0, seed)
+    seconds = 0.0
+    moves = stuck = 0
+    for state in instance.player_states:
+        while True:
+            started = perf_counter()
+            available = state.available_moves(SOLUTION, safe=safe)
+            seconds += perf_counter() - started
+            if not available:
+                break
+            state.move_to(rnd.choice(sorted(available, key=lambda w: w.title)), SOLUTION)
+            moves += 1
+        stuck += not state.is_finished()
+    return seconds / max(moves, 1), moves, stuck
+
+
+def run(sizes, repeat, players, energy):
+    for size in sizes:
+        game = generate_game(f'planner_{size}', size)
+        game.energy = energy
+
+        def analyse():
+            game.invalidate()
+            return game.reachability()
+        analysis, result = measure(analyse, repeat)
+        print(json.dumps({'benchmark': 'analyse', 'waypoints': size, **result}))
+        route, result = measure(lambda: analysis.route(game.start), repeat)
+        print(json.dumps({'benchmark': 'route', 'waypoints': size, 'moves': len(route) - 1,
+                          'min_energy': analysis.min_energy[analysis.index[game.start.id]], **result}))
+        waypoints = random.Random(1).sample(list(game.graph.nodes), min(size, 1000))
+        _, result = measure(lambda: [analysis.safe_moves(w, energy) for w in waypoints], repeat)
+        print(json.dumps({'benchmark': 'safe_moves', 'waypoints': size, 'queries': len(waypoints), **result}))
+        game.moves()
+        for safe in (False, True):
+            seconds, moves, stuck = walk(game, players, safe)
+            print(json.dumps({'benchmark': 'walk_safe' if safe else 'walk', 'waypoints': size, 'players': players,
+                              'energy': energy, 'moves': moves, 'stuck': stuck, 'seconds_per_move': seconds}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='energy planning benchmark')
+    parser.add_argument('--sizes', default='1000,100000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--energy', type=float, default=2.5, help='starting energy of the players')
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(',')], args.repeat, args.players, args.energy)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+"""
+Answer evaluation time for growing sets of tasks, no database needed.
+
+    python -m benchmark.solver [--sizes 10,100,1000] [--repeat 200]
+
+prints JSON lines for solving one answer against each task set task by task, in a single batch, and again from the
+memoized results as happens when a move asks for the same task more than once
+"""
+
+import argparse
+import json
+import random
+import statistics
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from model.task import Task, Answer
+
+WORDS = ['amsterdam', 'river', 'bridge', 'museum', 'painting', 'the', 'old', 'tower', 'market', 'canal', 'church',
+         'station', 'harbour', 'windmill', 'square', 'library', 'garden', 'palace', 'north', 'south']
+
+
+def generate_tasks(size, seed=1):
+    """
+    generate tasks like the ones found in games, mostly short text solutions with some numbers and dates
+    :param size: number of tasks
+    :param seed: random seed
+    :return: list of tasks
+    """
+    rnd = random.Random(seed)
+    tasks = []
+    for n in range(size):
+        kind = rnd.random()
+        if kind < 0.8:
+            solution = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 6)))
+        elif kind < 0.9:
+            solution = rnd.randint(1, 2000)
+        else:
+            solution = datetime(2000, 1, 1) + timedelta(days=rnd.randint(0, 9000))
+        tasks.append(Task(None, f'task {n}', 'some task', solution, ratio=rnd.choice([80, 85, 90])))
+    return tasks
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = perf_counter()
+        fn()
+        samples.append(perf_counter() - started)
+    return {'repeat': repeat, 'mean_seconds': statistics.mean(samples), 'min_seconds': min(samples)}
+
+
+def run(sizes, repeat):
+    answer = 'the old canal'
+    for size in sizes:
+        tasks = generate_tasks(size)
+        expected = [t.solve(answer) for t in tasks]
+        assert Answer(answer).solve(tasks) == expected
+        memoized = Answer(answer)
+        memoized.solve(tasks)
+        for name, fn in [('solve_each', lambda: [t.solve(answer) for t in tasks]),
+                         ('solve_batch', lambda: Answer(answer).solve(tasks)),
+                         ('solve_memoized', lambda: memoized.solve(tasks))]:
+            print(json.dumps({'benchmark': name, 'tasks': size, 'solved': sum(expected), **measure(fn, repeat)}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='answer evaluation benchmark')
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(',')], args.repeat)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+"""
+End to end benchmark suite over generated games, from publishing and loading a game to evaluating moves and saving
+and loading instances.
+
+    docker-compose up -d
+    python -m benchmark.suite [--sizes 10,1000,100000] [--repeat 3] [--players 100] [--skip-db]
+                              [--output results.json] [--compare previous.json]
+
+prints a JSON line per measurement, --output writes all measurements together with the commit and machine they were
+taken on, --compare prints the change of every measurement against such an earlier output
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+from datetime import datetime
+from time import perf_counter
+
+from arango import ArangoClient
+from dotenv import load_dotenv
+
+from benchmark.generator import generate_game, generate_instance, describe, SOLUTION
+from database.game import serialize, create, read
+from database.instance import save, load
+from database.schema import initialize
+from util.coder import SERIALIZERS
+from util.converter import generate_api_game
+
+
+def stats(name, size, samples, **extra) -> dict:
+    """
+    summarize the samples of a measurement
+    :param name: name of the benchmark
+    :param size: number of waypoints
+    :param samples: seconds per round
+    :param extra: other values to report
+    :return: dict
+    """
+    return {
+        'benchmark': name,
+        'waypoints': size,
+        'rounds': len(samples),
+        'min': min(samples),
+        'max': max(samples),
+        'mean': statistics.mean(samples),
+        'stddev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        **extra
+    }
+
+
+def measure(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = perf_counter()
+        result = fn()
+        samples.append(perf_counter() - started)
+    return result, samples
+
+
+def walk(instance, seed=1):
+    """
+    let every player of an instance move to a random available waypoint until they finish, answering every task
+    :param instance: game instance
+    :param seed: random seed
+    :return: seconds spent evaluating moves and the number of moves
+    """
+    rnd = random.Random(seed)
+    seconds = 0.0
+    moves = 0
+    for state in instance.player_states:
+        while True:
+            started = perf_counter()
+            available = state.available_moves(SOLUTION)
+            seconds += perf_counter() - started
+            if not available:
+                break
+            waypoint = rnd.choice(sorted(available, key=lambda w: w.title))
+            started = perf_counter()
+            state.move_to(waypoint, SOLUTION)
+            seconds += perf_counter() - started
+            moves += 1
+    return seconds, moves
+
+
+def run_memory(size, repeat, players, npcs):
+    """
+    benchmarks that need no database
+    :return: generated game and list of results
+    """
+    results = []
+    game, samples = measure(lambda: generate_game(f'benchmark_{size}', size, npcs=npcs), 1)
+    results.append(stats('game_generate', size, samples, **describe(game)))
+    _, samples = measure(lambda: serialize(game), repeat)
+    results.append(stats('game_serialize', size, samples))
+    data, samples = measure(lambda: json.dumps(generate_api_game(game)), repeat)
+    results.append(stats('game_api_encode', size, samples, bytes=len(data)))
+    samples = []
+    for _ in range(repeat):
+        game.invalidate()
+        _, sample = measure(game.moves, 1)
+        samples += sample
+    results.append(stats('move_table_compile', size, samples))
+    samples = []
+    for _ in range(repeat):
+        game.invalidate()
+        _, sample = measure(game.reachability, 1)
+        samples += sample
+    results.append(stats('reachability_compile', size, samples, **game.reachability().summary(game.start)))
+    samples = []
+    moves = 0
+    for n in range(repeat):
+        seconds, moves = walk(generate_instance(game, players, 0, seed=n), seed=n)
+        samples.append(seconds / max(moves, 1))
+    results.append(stats('move', size, samples, players=players, moves=moves))
+    instance = generate_instance(game, players, 50)
+    for serializer in SERIALIZERS.values():
+        data, samples = measure(lambda: serializer.dumps(instance), repeat)
+        results.append(stats('instance_encode', size, samples, format=serializer.name, players=players,
+                             bytes=len(data)))
+        _, samples = measure(lambda: serializer.loads(data), repeat)
+        results.append(stats('instance_decode', size, samples, format=serializer.name, players=players))
+    return game, results
+
+
+def run_database(db, game, size, repeat, players):
+    """
+    benchmarks against a database, the game is published once
+    :return: list of results
+    """
+    results = []
+    _, samples = measure(lambda: create(db, game), 1)
+    results.append(stats('game_publish', size, samples))
+    _, samples = measure(lambda: read(db, game.title), repeat)
+    results.append(stats('game_load', size, samples))
+    instance = generate_instance(game, players, 50)
+    _, samples = measure(lambda: save(db, instance), repeat)
+    results.append(stats('instance_save', size, samples, players=players))
+    _, samples = measure(lambda: load(db, instance.id.hex), repeat)
+    results.append(stats('instance_load', size, samples, players=players))
+    return results
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, results):
+    """
+    print the change of every measurement against an earlier output of the suite
+    :param previous: path of the earlier output
+    :param results: current results
+    """
+    with open(previous) as f:
+        earlier = json.load(f)
+    key = (lambda r: (r['benchmark'], r['waypoints'], r.get('format')))
+    baseline = {key(r): r for r in earlier['benchmarks']}
+    for result in results:
+        before = baseline.get(key(result))
+        if before:
+            print(json.dumps({
+                'compare': result['benchmark'],
+                'waypoints': result['waypoints'],
+                'format': result.get('format'),
+                'commit': earlier.get('commit'),
+                'previous': before['min'],
+                'current': result['min'],
+                'ratio': result['min'] / before['min'] if before['min'] else None
+            }))
+
+
+def run(sizes, repeat, players, npcs, skip_db, output, previous):
+    db = sys_db = name = None
+    if not skip_db:
+        load_dotenv()
+        client = ArangoClient(hosts=os.getenv('DB_URI'))
+        sys_db = client.db('_system', username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+        name = f"{os.getenv('DB_NAME')}_benchmark"
+        if sys_db.has_database(name):
+            sys_db.delete_database(name)
+        sys_db.create_database(name)
+        db = client.db(name, username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+        initialize(db)
+    results = []
+    try:
+        for size in sizes:
+            game, measured = run_memory(size, repeat, players, npcs)
+            if db:
+                measured += run_database(db, game, size, repeat, players)
+            for result in measured:
+                print(json.dumps(result))
+            results += measured
+    finally:
+        if sys_db:
+            sys_db.delete_database(name)
+    if output:
+        with open(output, 'w') as f:
+            json.dump({
+                'commit': commit(),
+                'datetime': datetime.utcnow().isoformat(),
+                'machine': {'python': platform.python_version(), 'system': platform.platform(),
+                            'processor': platform.processor(), 'cpus': os.cpu_count()},
+                'benchmarks': results
+            }, f, indent=2)
+    if previous:
+        compare(previous, results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='end to end benchmark suite over generated games')
+    parser.add_argument('--sizes', default='10,1000,100000', help='comma separated numbers of waypoints')
+    parser.add_argument('--repeat', type=int, default=3, help='rounds per measurement')
+    parser.add_argument('--players', type=int, default=100, help='players per game instance')
+    parser.add_argument('--npcs', type=int, default=5, help='NPCs per game')
+    parser.add_argument('--skip-db', action='store_true', help='only run the benchmarks that need no database')
+    parser.add_argument('--output', help='write all results as JSON to this file')
+    parser.add_argument('--compare', help='compare with the JSON results of an earlier run')
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(',')], args.repeat, args.players, args.npcs, args.skip_db, args.output,
+        args.compare)
@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
 
+import database.buffer
+import database.connection
+import database.derivative
 import database.game
 import database.instance
+import database.media
 import database.player
+import database.schema
+import database.storage
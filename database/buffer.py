@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import logging
+import os
+from threading import RLock, Thread, Event
+from time import perf_counter
+from uuid import UUID
+
+from arango.exceptions import ArangoError
+
+from database.connection import get_db
+from database.instance import append, drain, snapshots, SNAPSHOT_INTERVAL, InstanceStateException
+from database.player import UNIQUE_CONSTRAINT_VIOLATED
+from model.instance import GameInstance
+
+logger = logging.getLogger('database.buffer')
+
+SYNC = 'sync'
+BATCHED = 'batched'
+
+buffer = None
+buffer_lock = RLock()
+
+
+class WriteBehindBuffer(object):
+    """
+    Collects the changes of game instances and appends them to the event log in bulk, either when enough
+    changes are queued or after an interval, instead of writing every move on its own
+    """
+    def __init__(self, durability: str = BATCHED, max_events: int = 500, interval: float = 1.0, db=None,
+                 max_retry: int = None):
+        """
+        the flush thread is started on first use
+        :param durability: sync appends every change before submit returns, batched queues them
+        :param max_events: number of queued changes that triggers a flush
+        :param interval: seconds between flushes of whatever is queued
+        :param db: connection, the process wide connection if not set
+        :param max_retry: number of events kept for another attempt after failed flushes, ten times max_events
+            if not set, the newest events beyond it are dropped
+        """
+        if durability not in [SYNC, BATCHED]:
+            raise ValueError(f'unknown durability {durability}, expected {SYNC} or {BATCHED}')
+        self.durability = durability
+        self.max_events = max_events
+        self.interval = interval
+        self.max_retry = max_retry if max_retry is not None else 10 * max_events
+        self.flushes = 0
+        self.flushed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.flush_time = 0.0
+        self.last_flush = 0.0
+        self.max_flush = 0.0
+        self._db = db
+        self._lock = RLock()
+        self._flush_lock = RLock()
+        # instances with queued changes by id, and events that could not be written yet
+        self._instances = {}
+        self._retry = []
+        self._snapshots = set()
+        # ids of instances with events stored by another writer under the same keys
+        self._conflicts = set()
+        self._stopped = Event()
+        self._thread = None
+
+    def db(self):
+        return self._db or get_db()
+
+    def queued(self) -> int:
+        """
+        number of changes waiting to be written
+        :return: queue depth
+        """
+        with self._lock:
+            instances = list(self._instances.values())
+            return len(self._retry) + sum(len(s.deltas) for i in instances for s in i.player_states)
+
+    def submit(self, instance: GameInstance, db=None):
+        """
+        queue the changes recorded by the player states of an instance
+        :param instance: saved game instance
+        :param db: connection for sync appends, batched changes are written with the connection of the buffer
+        """
+        if self.durability == SYNC:
+            append(db or self.db(), instance)
+            return
+        if instance.sequence is None:
+            logger.warning(f'game instance {instance.id} has not been saved')
+            raise InstanceStateException(f'game instance {instance.id} has not been saved')
+        with self._lock:
+            if instance.id.hex in self._conflicts:
+                logger.warning(f'game instance {instance.id} was changed by another writer')
+                raise InstanceStateException(f'game instance {instance.id} was changed by another writer, '
+                                             f'it needs to be loaded again')
+            self._instances[instance.id] = instance
+            if not self._thread:
+                logger.info(f'starting write-behind flush every {self.interval}s or {self.max_events} changes')
+                self._stopped.clear()
+                self._thread = Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+        if self.queued() >= self.max_events:
+            self.flush()
+
+    def checkpoint(self, instance: GameInstance = None, db=None):
+        """
+        write queued changes now
+        :param instance: instance to write, everything queued if not set
+        :param db: connection for sync appends
+        """
+        if instance and self.durability == SYNC:
+            append(db or self.db(), instance)
+        else:
+            self.flush(instance)
+
+    def settle(self, game_id: str) -> bool:
+        """
+        write the queued changes of an instance and its events waiting for another attempt, before the instance
+        is saved in full or loaded again
+        :param game_id: game instance id
+        :return: True if nothing of the instance is left in the buffer
+        """
+        with self._lock:
+            queued = self._instances.get(UUID(game_id))
+            waiting = any(e['instance'] == game_id for e in self._retry)
+        if queued or waiting:
+            self.flush(queued)
+        with self._lock:
+            return UUID(game_id) not in self._instances and not any(e['instance'] == game_id for e in self._retry)
+
+    def release(self, game_id: str):
+        """
+        write what is queued for an instance before it is loaded again, events held back because another
+        writer numbered the same events are dropped as the loaded instance continues from the stored log
+        :param game_id: game instance id
+        """
+        if game_id not in self._conflicts:
+            self.settle(game_id)
+            return
+        with self._lock:
+            dropped = [e for e in self._retry if e['instance'] == game_id]
+            self._retry = [e for e in self._retry if e['instance'] != game_id]
+            self._conflicts.discard(game_id)
+            self.dropped += len(dropped)
+        if dropped:
+            logger.error(f"dropping {len(dropped)} events of {game_id} from {dropped[0]['_key']} to "
+                         f"{dropped[-1]['_key']} that conflict with events of another writer")
+
+    def flush(self, instance: GameInstance = None) -> int:
+        """
+        append the queued changes of all (or one) instances to the event log with a single bulk insert,
+        and snapshot the instances that passed a snapshot interval; whatever fails, events that were not
+        written are queued again
+        :param instance: instance to flush, all queued instances if not set
+        :return: number of written events
+        """
+        with self._flush_lock:
+            started = perf_counter()
+            with self._lock:
+                if instance:
+                    instances = [self._instances.pop(instance.id, instance)]
+                else:
+                    instances, self._instances = list(self._instances.values()), {}
+                retry, self._retry = self._retry, []
+            events = []
+            failed = None
+            try:
+                while instances:
+                    queued = instances[0]
+                    previous = queued.sequence
+                    drained = drain(queued)
+                    instances.pop(0)
+                    # snapshots are only taken once every drained event is written, see _snapshot
+                    queued.stale.update(e['player'] for e in drained)
+                    events += drained
+                    if previous // SNAPSHOT_INTERVAL != queued.sequence // SNAPSHOT_INTERVAL:
+                        self._snapshots.add(queued)
+                if not retry and not events and not self._snapshots:
+                    failed = []
+                    return 0
+                # events of an instance are held back while an earlier one is not written, so the log has no gaps,
+                # events of instances changed by another writer are not tried again until the instance is reloaded
+                held = [e for e in retry if e['instance'] in self._conflicts]
+                held += self._write([e for e in retry if e['instance'] not in self._conflicts])
+                blocked = set(e['instance'] for e in held)
+                held += [e for e in events if e['instance'] in blocked]
+                held += self._write([e for e in events if e['instance'] not in blocked])
+                failed = held
+            except ArangoError as e:
+                logger.warning(f'could not flush {len(retry) + len(events)} events: {e}')
+                failed = retry + events
+            finally:
+                if failed is None:
+                    failed = retry + events
+                    logger.error(f'write-behind flush failed, {len(failed)} events and {len(instances)} instances '
+                                 f'are queued again')
+                self._requeue(retry, events, failed, instances, perf_counter() - started)
+            self._snapshot(failed)
+            return len(retry) + len(events) - len(failed)
+
+    def _requeue(self, retry: [dict], events: [dict], failed: [dict], instances: [GameInstance], elapsed: float):
+        if not retry and not events and not instances:
+            return
+        dropped = failed[self.max_retry:]
+        if dropped:
+            # the newest events go first, what is kept stays a gapless continuation of the log
+            logger.error(f'dropping {len(dropped)} events that could not be written, from '
+                         f"{dropped[0]['_key']} to {dropped[-1]['_key']}; "
+                         f"instances {sorted(set(e['instance'] for e in dropped))} need to be reloaded")
+        total = len(retry) + len(events)
+        with self._lock:
+            self._retry = failed[:self.max_retry] + self._retry
+            for queued in instances:
+                self._instances.setdefault(queued.id, queued)
+            self.flushes += 1
+            self.flushed += total - len(failed)
+            self.errors += len(failed)
+            self.dropped += len(dropped)
+            self.flush_time += elapsed
+            self.last_flush = elapsed
+            self.max_flush = max(self.max_flush, elapsed)
+        logger.debug(f'flushed {total - len(failed)} events in {elapsed:.3f}s, {len(failed)} failed')
+
+    def _snapshot(self, failed: [dict]):
+        """
+        snapshot the instances that passed a snapshot interval and have every change in the event log
+        :param failed: events that could not be written
+        """
+        blocked = set(e['instance'] for e in failed)
+        written = [i for i in self._snapshots if not any(s.deltas for s in i.player_states) and
+                   i.id.hex not in blocked]
+        documents = []
+        for queued in written:
+            try:
+                documents += [(queued, d) for d in snapshots(queued)]
+            except InstanceStateException as e:
+                # changes were recorded meanwhile, the snapshot is taken after they are written
+                logger.info(f'postponing snapshot of {queued.id}: {e}')
+        if documents:
+            try:
+                results = self.db().collection('snapshots').insert_many([d for _, d in documents],
+                                                                        overwrite=True, silent=False)
+            except ArangoError as e:
+                logger.warning(f'could not write {len(documents)} snapshots: {e}')
+                return
+            for (snapshot, document), result in zip(documents, results):
+                if isinstance(result, ArangoError):
+                    logger.warning(f"could not snapshot {document['_key']}: {result}")
+                else:
+                    snapshot.stale.discard(document['player_id'])
+        self._snapshots.difference_update(i for i in written if not i.stale)
+
+    def _write(self, events: [dict]) -> [dict]:
+        """
+        insert events into the event log, an event that is already stored counts as written, an event of
+        another writer stored under the same key marks the instance as changed by another writer
+        :param events: event documents
+        :return: events that could not be written
+        """
+        if not events:
+            return []
+        failed = []
+        stored = []
+        col = self.db().collection('events')
+        for document, result in zip(events, col.insert_many(events, silent=False)):
+            if not isinstance(result, ArangoError):
+                continue
+            if getattr(result, 'error_code', None) == UNIQUE_CONSTRAINT_VIOLATED:
+                stored.append(document)
+            else:
+                logger.warning(f"could not write event {document['_key']}: {result}")
+                failed.append(document)
+        if stored:
+            existing = {d['_key']: d for d in col.get_many([d['_key'] for d in stored])}
+            for document in stored:
+                current = existing.get(document['_key'], {})
+                if any(current.get(k) != v for k, v in document.items()):
+                    logger.error(f"event {document['_key']} was stored by another writer, "
+                                 f"game instance {document['instance']} needs to be loaded again")
+                    with self._lock:
+                        self._conflicts.add(document['instance'])
+                    failed.append(document)
+        return failed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f'write-behind flush failed: {e}')
+
+    def stats(self) -> dict:
+        """
+        buffer statistics
+        :return: dict with queue depth, flush counts, dropped events, conflicting instances and flush latency in seconds
+        """
+        queued = self.queued()
+        with self._lock:
+            return {'durability': self.durability, 'instances': len(self._instances), 'queued': queued,
+                    'flushes': self.flushes, 'flushed': self.flushed, 'errors': self.errors, 'dropped': self.dropped,
+                    'conflicts': len(self._conflicts),
+                    'last_flush': self.last_flush, 'max_flush': self.max_flush,
+                    'mean_flush': self.flush_time / self.flushes if self.flushes else 0.0}
+
+    def shutdown(self):
+        """
+        stop the flush thread and write everything that is queued
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self._stopped.set()
+        if thread:
+            thread.join()
+        self.flush()
+        if self._retry:
+            logger.error(f'{len(self._retry)} events could not be written on shutdown')
+
+
+def write_buffer() -> WriteBehindBuffer:
+    """
+    process wide write-behind buffer for game instances, created on first use
+    :return: buffer
+    """
+    global buffer
+    with buffer_lock:
+        if not buffer:
+            buffer = WriteBehindBuffer(os.getenv('INSTANCE_DURABILITY', BATCHED),
+                                       int(os.getenv('INSTANCE_FLUSH_EVENTS', 500)),
+                                       float(os.getenv('INSTANCE_FLUSH_INTERVAL', 1.0)),
+                                       max_retry=int(os.getenv('INSTANCE_RETRY_EVENTS', 5000)))
+        return buffer
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import logging
+import os
+from threading import RLock
+
+from arango import ArangoClient
+from arango.database import StandardDatabase
+from arango.http import DefaultHTTPClient
+
+
+logger = logging.getLogger('database.connection')
+
+
+class PooledHTTPClient(DefaultHTTPClient):
+    """
+    HTTP client with keep-alive connection pooling that keeps track of the sessions it hands out
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = RLock()
+        self.sessions = []
+        self.requests = 0
+
+    def create_session(self, host):
+        """
+        create a pooled session for a host, and remember it so it can be inspected and closed
+        :param host: database host url
+        :return: requests session
+        """
+        session = super().create_session(host)
+        with self._lock:
+            self.sessions.append(session)
+        logger.debug(f'created pooled session for {host}')
+        return session
+
+    def send_request(self, session, method, url, headers=None, params=None, data=None, auth=None):
+        """
+        send a request over a pooled session
+        :param session: requests session
+        :param method: http method
+        :param url: request url
+        :param headers: request headers
+        :param params: url parameters
+        :param data: request payload
+        :param auth: username and password
+        :return: arango response
+        """
+        with self._lock:
+            self.requests += 1
+        return super().send_request(session, method, url, headers, params, data, auth)
+
+    def stats(self) -> dict:
+        """
+        connection pool statistics
+        :return: dict with request count and per host pool usage
+        """
+        pools = {}
+        with self._lock:
+            sessions = list(self.sessions)
+            requests = self.requests
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools.get(key)
+                    if not pool:
+                        continue
+                    pools[f'{key.key_scheme}://{key.key_host}:{key.key_port}'] = {
+                        'connections': pool.num_connections,
+                        'requests': pool.num_requests,
+                        'idle': pool.pool.qsize() if pool.pool else 0,
+                        'maxsize': pool.pool.maxsize if pool.pool else 0
+                    }
+        return {'sessions': len(sessions), 'requests': requests, 'pools': pools}
+
+    def close(self):
+        """
+        close all sessions and their pooled connections
+        """
+        with self._lock:
+            sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            session.close()
+
+
+class ConnectionProvider(object):
+    """
+    Process wide provider of the database connection, initialized lazily on first use
+    """
+    def __init__(self):
+        self._lock = RLock()
+        self._http_client = None
+        self._client = None
+        self._db = None
+
+    def db(self) -> StandardDatabase:
+        """
+        get the shared database connection, creating it on first use
+        :return: connection
+        """
+        db = self._db
+        if db is not None:
+            return db
+        with self._lock:
+            if self._db is None:
+                pool_timeout = os.getenv('DB_POOL_TIMEOUT')
+                self._http_client = PooledHTTPClient(
+                    request_timeout=float(os.getenv('DB_REQUEST_TIMEOUT', 60)),
+                    retry_attempts=int(os.getenv('DB_RETRY_ATTEMPTS', 3)),
+                    pool_connections=int(os.getenv('DB_POOL_CONNECTIONS', 10)),
+                    pool_maxsize=int(os.getenv('DB_POOL_MAXSIZE', 10)),
+                    pool_timeout=float(pool_timeout) if pool_timeout else None
+                )
+                logger.info(f"initializing database connection pool for {os.getenv('DB_URI')}")
+                self._client = ArangoClient(hosts=os.getenv('DB_URI'), http_client=self._http_client)
+                self._db = self._client.db(os.getenv('DB_NAME'),
+                                           username=os.getenv('DB_USER'),
+                                           password=os.getenv('DB_PASSWORD'))
+            return self._db
+
+    def stats(self) -> dict:
+        """
+        connection pool statistics
+        :return: dict with pool usage, empty if not initialized
+        """
+        with self._lock:
+            if not self._http_client:
+                return {}
+            return self._http_client.stats()
+
+    def close(self):
+        """
+        close all pooled connections, the next call to db() will initialize a new pool
+        """
+        with self._lock:
+            if self._http_client:
+                logger.info(f'closing database connection pool {self._http_client.stats()}')
+                self._http_client.close()
+            self._http_client = None
+            self._client = None
+            self._db = None
+
+
+provider = ConnectionProvider()
+
+
+def get_db() -> StandardDatabase:
+    """
+    get the process wide database connection
+    :return: connection
+    """
+    return provider.db()
+
+
+def pool_stats() -> dict:
+    """
+    get the statistics of the process wide connection pool
+    :return: dict with pool usage
+    """
+    return provider.stats()
+
+
+def shutdown():
+    """
+    close the process wide connection pool
+    """
+    provider.close()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import io
+import logging
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from threading import RLock, Event
+
+from PIL import Image, UnidentifiedImageError
+
+from database.media import MediaStateException, read_file, valid
+from model.media import Media
+
+logger = logging.getLogger('database.derivative')
+
+# bounding box of each variant, full keeps the original dimensions
+VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (640, 640),
+    'full': None
+}
+# encoder, content type and encoder options of each output format
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'png': ('PNG', 'image/png', {'optimize': True})
+}
+NAME = re.compile(r'^([0-9a-f]{64})-([a-z]+)\.([a-z]+)$')
+
+derivatives = None
+derivatives_lock = RLock()
+
+
+class DerivativeException(Exception):
+    pass
+
+
+def variant_key(key: str, variant: str, fmt: str) -> str:
+    """
+    name of a derivative, unique per content hash, variant and format
+    :param key: content hash of the original
+    :param variant: name of the variant
+    :param fmt: name of the output format
+    :return: file name of the derivative
+    """
+    return f'{key}-{variant}.{fmt}'
+
+
+def render(data: bytes, variant: str, fmt: str) -> bytes:
+    """
+    resize an image to fit the bounding box of a variant and encode it, images are never enlarged
+    :param data: original image
+    :param variant: name of the variant
+    :param fmt: name of the output format
+    :return: encoded image
+    """
+    encoder, _, options = FORMATS[fmt]
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.seek(0)
+            if VARIANTS[variant]:
+                image.draft('RGB', VARIANTS[variant])
+                image.thumbnail(VARIANTS[variant], Image.LANCZOS)
+            else:
+                image.load()
+            if encoder == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert('RGBA')
+            output = io.BytesIO()
+            image.save(output, encoder, **options)
+            return output.getvalue()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise DerivativeException(f'could not render {variant} {fmt}: {e}')
+
+
+class DerivativeCache(object):
+    """
+    Resized and re-encoded variants of stored images, rendered on first request and kept on disk,
+    the least recently used variants are removed when their total size exceeds the limit
+    """
+    def __init__(self, path: str, maxbytes: int):
+        """
+        variants already on disk are indexed, oldest access first
+        :param path: directory of the cache
+        :param maxbytes: maximum total size of all variants in bytes
+        """
+        self.root = path
+        self.maxbytes = maxbytes
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = RLock()
+        self._entries = OrderedDict()
+        self._rendering = {}
+        os.makedirs(path, exist_ok=True)
+        files = []
+        for name in os.listdir(path):
+            if NAME.match(name):
+                stat = os.stat(os.path.join(path, name))
+                files.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self.weight += size
+        self._evict()
+
+    def path(self, name: str) -> str:
+        if not NAME.match(name):
+            raise DerivativeException(f'invalid variant {name}')
+        return os.path.join(self.root, name)
+
+    def get(self, store, key: str, variant: str, fmt: str) -> Media:
+        """
+        get a variant of a stored image, rendering it if needed; concurrent requests for the same missing variant
+        wait for a single render
+        :param store: media store with the original
+        :param key: content hash of the original
+        :param variant: name of the variant
+        :param fmt: name of the output format
+        :return: Media with the variant name as key, size and content type, or None if the original is not stored
+        """
+        if variant not in VARIANTS or fmt not in FORMATS or not valid(key):
+            raise DerivativeException(f'unknown variant {variant} {fmt} of {key}')
+        name = variant_key(key, variant, fmt)
+        content_type = FORMATS[fmt][1]
+        while True:
+            with self._lock:
+                size = self._entries.get(name)
+                if size is not None:
+                    self._entries.move_to_end(name)
+                    self.hits += 1
+                    return Media(name, size, content_type)
+                rendering = self._rendering.get(name)
+                if rendering is None:
+                    rendering = self._rendering[name] = Event()
+                    self.misses += 1
+                    break
+            # another request is rendering this variant, if it failed the next one tries again
+            rendering.wait()
+        try:
+            if not store.stat(key):
+                return None
+            data = render(b''.join(store.read(key)), variant, fmt)
+            self._write(name, data)
+            with self._lock:
+                self._entries[name] = len(data)
+                self.weight += len(data)
+                self._evict()
+            logger.debug(f'rendered {name} of {len(data)} bytes')
+            return Media(name, len(data), content_type)
+        finally:
+            with self._lock:
+                del self._rendering[name]
+            rendering.set()
+
+    def _write(self, name: str, data: bytes):
+        fd, temporary = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, self.path(name))
+        except OSError as e:
+            os.unlink(temporary)
+            raise MediaStateException(f'could not store variant {name}: {e}')
+
+    def _evict(self):
+        # the most recent variant is kept even if it alone exceeds the limit
+        while self.weight > self.maxbytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self.weight -= size
+            self.evictions += 1
+            try:
+                os.unlink(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+
+    def open(self, name: str):
+        """
+        open a variant for reading
+        :param name: variant name
+        :return: file opened for binary reading
+        """
+        return open(self.path(name), 'rb')
+
+    def read(self, name: str, start: int = 0, stop: int = None):
+        """
+        read a variant in chunks
+        :param name: variant name
+        :param start: first byte
+        :param stop: byte after the last byte, the end of the variant if not set
+        :return: generator of chunks of bytes
+        """
+        return read_file(self.path(name), start, stop)
+
+    def stats(self) -> dict:
+        """
+        cache statistics
+        :return: dict with hits, misses, evictions, size, weight and maxweight
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries), 'weight': self.weight, 'maxweight': self.maxbytes}
+
+
+def derivative_cache() -> DerivativeCache:
+    """
+    the variant cache of the process, configured by DERIVATIVE_PATH and DERIVATIVE_CACHE_BYTES
+    :return: DerivativeCache
+    """
+    global derivatives
+    with derivatives_lock:
+        if not derivatives:
+            path = os.getenv('DERIVATIVE_PATH', os.path.join(os.getenv('MEDIA_PATH', 'media'), 'derivatives'))
+            derivatives = DerivativeCache(path, int(os.getenv('DERIVATIVE_CACHE_BYTES', 256 * 1024 * 1024)))
+        return derivatives
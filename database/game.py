@@ -1,101 +1,244 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
 
-import base64
-import json
 import logging
+import os
+from time import perf_counter
 from uuid import UUID
 
 import networkx as nx
 
 from arango.database import StandardDatabase
+from arango.exceptions import ArangoError
 
+from database.media import media_store, externalize, MediaStateException
 from model.dialog import Dialog
-from model.game import Game
+from model.game import Game, GameGraphException
+from model.media import Media
 from model.player import NonPlayableCharacter
-from util.coder import MarugotoEncoder, MarugotoDecoder
+from util.cache import LRUCache
+from util.coder import encode, decode, decode_blob
 
 
 logger = logging.getLogger('database.game')
 
 
+# collections written when publishing a game
+PUBLISH_COLLECTIONS = ['waypoints', 'path', 'tasks', 'npcs', 'dialogs', 'interactions', 'conversation', 'games']
+
+# traversals are bounded by the depth of the graph, this only needs to be larger than the longest path
+MAX_DEPTH = 1000000
+
+# waypoints reachable from the start, the paths between them and the tasks of those waypoints
+GAME_QUERY = """
+LET waypoints = (
+    FOR v IN 0..@depth OUTBOUND @start path
+        OPTIONS {bfs: true, uniqueVertices: 'global'}
+        RETURN v
+)
+LET edges = (
+    FOR w IN waypoints
+        FOR e IN path
+            FILTER e._from == w._id
+            RETURN e
+)
+LET waypoint_tasks = (
+    FOR t IN tasks
+        FILTER t.for IN waypoints[*]._key
+        RETURN t
+)
+RETURN {waypoints: waypoints, edges: edges, tasks: waypoint_tasks}
+"""
+
+# npcs of a game with their dialog metadata, the interactions reachable from the dialog start,
+# the conversation edges between them and the tasks of those interactions
+NPC_QUERY = """
+FOR n IN npcs
+    FILTER n.game == @game
+    LET dialog = DOCUMENT('dialogs', n.dialog)
+    LET interactions = (
+        FOR v IN 0..@depth OUTBOUND CONCAT('interactions/', dialog.start) conversation
+            OPTIONS {bfs: true, uniqueVertices: 'global'}
+            RETURN v
+    )
+    LET edges = (
+        FOR i IN interactions
+            FOR e IN conversation
+                FILTER e._from == i._id
+                RETURN e
+    )
+    LET interaction_tasks = (
+        FOR t IN tasks
+            FILTER t.for IN interactions[*]._key
+            RETURN t
+    )
+    RETURN {npc: n, dialog: dialog, interactions: interactions, edges: edges, tasks: interaction_tasks}
+"""
+
+
+# page of game summaries ordered by title, starting after the cursor
+# summary of a game, the image is only returned as a media reference, inline images of older games are flagged
+SUMMARY = """
+    RETURN {
+        title: g._key,
+        start: g.start,
+        energy: g.energy,
+        creator: g.creator,
+        waypoints: g.waypoints,
+        analysis: g.analysis,
+        image: LEFT(g.image, 7) == 'sha256:' ? g.image : null,
+        inline_image: g.image != null AND LEFT(g.image, 7) != 'sha256:'
+    }
+"""
+# first page of the game summaries, and the pages after a cursor
+LIST_QUERY = """
+FOR g IN games
+    SORT g._key
+    LIMIT @limit
+""" + SUMMARY
+LIST_AFTER_QUERY = """
+FOR g IN games
+    FILTER g._key > @cursor
+    SORT g._key
+    LIMIT @limit
+""" + SUMMARY
+
+# rough in-memory footprint of graph objects, used to bound the game cache
+NODE_OVERHEAD = 2048
+EDGE_OVERHEAD = 512
+
+
 class GameStateException(Exception):
     pass
 
 
-def create(db: StandardDatabase, game: Game, creator=None):
+def estimate_size(game: Game) -> int:
+    """
+    estimate the memory used by a loaded game
+    :param game: target
+    :return: size in bytes
+    """
+    def blob(o):
+        return len(o) if isinstance(o, (bytes, str)) else 0
+
+    size = blob(game.image)
+    for graph in [game.graph] + [npc.dialog.graph for npc in game.npcs]:
+        size += NODE_OVERHEAD * graph.number_of_nodes() + EDGE_OVERHEAD * graph.number_of_edges()
+    for waypoint in game.graph.nodes:
+        size += blob(waypoint.title) + blob(waypoint.description)
+        size += blob(getattr(waypoint, 'image', None)) + blob(getattr(waypoint, 'fragment', None))
+        size += blob(waypoint.level.icon) if waypoint.level else 0
+        for task in waypoint.tasks:
+            size += NODE_OVERHEAD + blob(task.text) + blob(task.media)
+    for npc in game.npcs:
+        size += blob(npc.image)
+    return size
+
+
+# loaded games by title, entries are (revision, game)
+game_cache = LRUCache(int(os.getenv('GAME_CACHE_SIZE', 128)),
+                      maxweight=int(os.getenv('GAME_CACHE_BYTES', 256 * 1024 * 1024)),
+                      weigher=lambda entry: estimate_size(entry[1]))
+
+
+def serialize(game: Game, creator=None) -> {str: [dict]}:
+    """
+    serialize a game once into the documents for each collection, the graphs are walked iteratively
+    :param game: target
+    :param creator: creator of the game
+    :return: dict of collection name and documents
+    """
+    documents = {collection: [] for collection in PUBLISH_COLLECTIONS}
+
+    waypoints = list(nx.dfs_preorder_nodes(game.graph, game.start))
+    for waypoint in waypoints:
+        logger.debug(f'serializing waypoint {repr(waypoint)}')
+        documents['waypoints'].append(encode(waypoint))
+        for task in waypoint.tasks:
+            task_dump = encode(task)
+            task_dump['for'] = waypoint.id.hex
+            documents['tasks'].append(task_dump)
+    for source, destination, data in game.graph.edges(waypoints, data=True):
+        documents['path'].append({
+            '_key': f'{source.id.hex}-{destination.id.hex}',
+            '_from': f'waypoints/{source.id.hex}',
+            '_to': f'waypoints/{destination.id.hex}',
+            'weight': data['weight'] if 'weight' in data and data['weight'] else None
+        })
+
+    for npc in game.npcs:
+        documents['npcs'].append({
+            '_key': f'{game.title}-{npc.first_name}-{npc.last_name}',
+            'game': f'game_{game.title}',
+            'first_name': npc.first_name,
+            'last_name': npc.last_name,
+            'salutation': npc.salutation,
+            'mail': npc.mail,
+            'image': encode(npc.image),
+            'dialog': npc.dialog.id.hex
+        })
+        documents['dialogs'].append({
+            '_key': npc.dialog.id.hex,
+            'start': npc.dialog.start.id.hex
+        })
+        interactions = list(nx.dfs_preorder_nodes(npc.dialog.graph, npc.dialog.start))
+        for interaction in interactions:
+            logger.debug(f'serializing interaction {repr(interaction)}')
+            documents['interactions'].append(encode(interaction))
+            if interaction.task:
+                task_dump = encode(interaction.task)
+                task_dump['for'] = interaction.id.hex
+                documents['tasks'].append(task_dump)
+        for source, destination in npc.dialog.graph.edges(interactions):
+            documents['conversation'].append({
+                '_key': f'{source.id.hex}-{destination.id.hex}',
+                '_from': f'interactions/{source.id.hex}',
+                '_to': f'interactions/{destination.id.hex}'
+            })
+
+    documents['games'].append({
+        '_key': game.title,
+        'start': game.start.id.hex,
+        'image': encode(game.image),
+        'energy': game.energy,
+        'creator': creator,
+        'waypoints': len(waypoints),
+        'analysis': game.reachability().summary(game.start)
+    })
+    return documents
+
+
+def create(db: StandardDatabase, game: Game, creator=None) -> {str: dict}:
     """
-    save a game to the database
+    save a game to the database, all documents are inserted in bulk within a single transaction, binary data is
+    moved to the media store first and the game keeps references to it
     :param db: connection
     :param game: target
     :param creator: creator of the game
+    :return: dict of collection name with the number of inserted documents and the insert time in seconds
     """
     logger.info(f'create called for {game.title}')
-    if not db.has_collection('games'):
-        logger.info(f'games collection does not exist, creating it.')
-        db.create_collection('games')
-    db_games = db.collection('games')
-    if db_games.find({'key': game.title}):
+    if db.collection('games').has(game.title):
         logger.warning(f'{game.title} already in metadata')
         raise GameStateException(f'{game.title} already in metadata')
-    if db.has_graph(game.title):
+    if db.has_graph(f'game_{game.title}'):
         logger.warning(f'{game.title} already defined')
         raise GameStateException(f'{game.title} already defined')
-    if not nx.is_directed_acyclic_graph(game.graph):
-        logger.warning(f'{game.title} is not acyclic')
-        raise GameStateException(f'{game.title} is not acyclic')
     if not game.start_is_set():
         logger.warning(f'{game.title} has no starting point')
         raise GameStateException(f'{game.title} has no starting point')
-    db_game_graph = db.create_graph(f'game_{game.title}')
-    if not db_game_graph.has_vertex_collection('waypoints'):
-        logger.info(f'waypoints vertex collection does not exist, creating it.')
-        db_game_graph.create_vertex_collection('waypoints')
-    path = db_game_graph.create_edge_definition(
-        edge_collection='path',
-        from_vertex_collections=['waypoints'],
-        to_vertex_collections=['waypoints']
-    )
-    # add all game nodes
-    for waypoint_vertex in set(game.start.all_path_nodes()):
-        logger.debug(f'inserting waypoint vertex {repr(waypoint_vertex)}')
-        db_game_graph.insert_vertex('waypoints', json.dumps(waypoint_vertex, cls=MarugotoEncoder))
-
-    # tasks as documents
-    if not db.has_collection('tasks'):
-        logger.info(f'tasks collection does not exist, creating it.')
-        db.create_collection('tasks')
-    tasks = db.collection('tasks')
-
-    # dialogs metadata
-    if not db.has_collection('dialogs'):
-        logger.info(f'dialogs does not exist, creating it.')
-        db.create_collection('dialogs')
-    db_dialogs = db.collection('dialogs')
-
-    # npc dialog metadata
-    if not db.has_collection('npcs'):
-        logger.info(f'npcs collection does not exist, creating it.')
-        db.create_collection('npcs')
-    db_npcs = db.collection('npcs')
-
+    try:
+        analysis = game.reachability()
+    except GameGraphException as e:
+        logger.warning(f'{game.title} is not acyclic: {e}')
+        raise GameStateException(f'{game.title} is not acyclic')
+    if not analysis.can_finish(game.start, game.energy):
+        logger.warning(f'{game.title} cannot be finished with the starting energy of {game.energy}')
     for npc in game.npcs:
-        if db_npcs.find({'_key': f'{game.title}-{npc.first_name}-{npc.last_name}'}):
+        if db.collection('npcs').has(f'{game.title}-{npc.first_name}-{npc.last_name}'):
             logger.warning(f'dialog {game.title}-{npc.first_name}-{npc.last_name} already in metadata')
             raise GameStateException(f'dialog {game.title}-{npc.first_name}-{npc.last_name} already in metadata')
-        logger.debug(f'inserting npc {game.title}-{npc.first_name}-{npc.last_name} with dialog {npc.dialog.id.hex}')
-        db_npcs.insert({
-            '_key': f'{game.title}-{npc.first_name}-{npc.last_name}',
-            'game': f'game_{game.title}',
-            'first_name': npc.first_name,
-            'last_name': npc.last_name,
-            'salutation': npc.salutation,
-            'mail': npc.mail,
-            'image': base64.encodebytes(npc.image) if npc.image else None,
-            'dialog': npc.dialog.id.hex
-        })
-
-        if db_dialogs.find({'_key': npc.dialog.id.hex}):
+        if db.collection('dialogs').has(npc.dialog.id.hex):
             logger.warning(f'dialog {npc.dialog.id} already in metadata')
             raise GameStateException(f'dialog {npc.dialog.id} already in metadata')
         if db.has_graph(f'dialog_{npc.dialog.id.hex}'):
@@ -107,324 +250,248 @@ def create(db: StandardDatabase, game: Game, creator=None):
         if not npc.dialog.start_is_set():
             logger.warning(f'dialog {npc.dialog.id} has no starting point')
             raise GameStateException(f'dialog {npc.dialog.id} has no starting point')
-        db_dialog_graph = db.create_graph(f'dialog_{npc.dialog.id.hex}')
-        if not db_dialog_graph.has_vertex_collection('interactions'):
-            logger.debug(f'interaction vertex collection does not exist, creating it.')
-            db_dialog_graph.create_vertex_collection('interactions')
-        conversation = db_dialog_graph.create_edge_definition(
-            edge_collection='conversation',
-            from_vertex_collections=['interactions'],
-            to_vertex_collections=['interactions']
-        )
-        # add all dialog nodes
-        for interaction_vertex in set(npc.dialog.start.all_path_nodes()):
-            logger.debug(f'inserting interaction vertex {repr(interaction_vertex)}')
-            db_dialog_graph.insert_vertex('interactions', json.dumps(interaction_vertex, cls=MarugotoEncoder))
-
-        dia_visited = {}
-
-        def dialog_traversal(s, i):
-            """
-            Walk through the game path from a starting source
-            :param s: starting waypoint for traversal
-            :param i: dict containing identified steps
-            """
-            for successor in npc.dialog.graph.successors(s):
-                logger.debug(f'successor {repr(successor)} for {repr(s)}')
-                if s not in i.keys():
-                    logger.debug(f'{repr(s)} is new, adding it')
-                    i[s] = []
-                if successor not in i[s]:
-                    if successor.task:
-                        logger.debug(f'{repr(successor)} has {repr(successor.task)}, adding to tasks')
-                        task_dump = json.loads(json.dumps(successor.task, cls=MarugotoEncoder))
-                        task_dump['_key'] = successor.task.id.hex
-                        task_dump['for'] = successor.id.hex
-                        if not tasks.find(task_dump):
-                            tasks.insert(json.dumps(task_dump))
-                    logger.debug(f'inserting interaction edge {repr(s)} to {repr(successor)}')
-                    conversation.insert({
-                        '_key': f'{s.id.hex}-{successor.id.hex}',
-                        '_from': f'interactions/{s.id.hex}',
-                        '_to': f'interactions/{successor.id.hex}'
-                    })
-                    dia_visited[s].append(successor)
-                    dialog_traversal(successor, i)
-
-        logger.debug(f'traversing dialog graph for {npc.first_name} {npc.last_name}')
-        dialog_traversal(npc.dialog.start, dia_visited)
-        logger.debug(f'inserting dialog {npc.dialog.id.hex}')
-        db_dialogs.insert({
-            '_key': npc.dialog.id.hex,
-            'start': npc.dialog.start.id.hex
-        })
 
-    wp_visited = {}
-
-    def game_traversal(s, i):
-        """
-        Walk through the game path from a starting source
-        :param s: starting waypoint for traversal
-        :param i: dict containing identified steps
-        """
-        for successor in game.graph.successors(s):
-            logger.debug(f'successor {repr(successor)} for {repr(s)}')
-            if s not in i.keys():
-                logger.debug(f'{repr(s)} is new, adding it.')
-                i[s] = []
-            if successor not in i[s]:
-                for task in successor.tasks:
-                    logger.debug(f'{repr(successor)} has {repr(task)}, adding to tasks')
-                    task_dump = json.loads(json.dumps(task, cls=MarugotoEncoder))
-                    task_dump['_key'] = task.id.hex
-                    task_dump['for'] = successor.id.hex
-                    if not tasks.find(task_dump):
-                        tasks.insert(json.dumps(task_dump))
-                logger.debug(f'waypoint interaction edge {repr(s)} to {repr(successor)}')
-                weight = game.graph.edges[s, successor]['weight'] if 'weight' in game.graph.edges[s, successor] and game.graph.edges[s, successor]['weight'] else None
-                path.insert({
-                    '_key': f'{s.id.hex}-{successor.id.hex}',
-                    '_from': f'waypoints/{s.id.hex}',
-                    '_to': f'waypoints/{successor.id.hex}',
-                    'weight': weight
-                })
-                wp_visited[s].append(successor)
-                game_traversal(successor, i)
-
-    logger.debug(f'traversing game graph for {game.title}')
-    game_traversal(game.start, wp_visited)
-    logger.debug(f'inserting game {game.title}')
-    db_games.insert({
-        '_key': game.title,
-        'start': game.start.id.hex,
-        'image': base64.encodebytes(game.image) if game.image else None,
-        'creator': creator
-    })
-
-
-def read(db: StandardDatabase, title: str) -> Game:
+    started = perf_counter()
+    try:
+        references = externalize(media_store(db), game)
+    except MediaStateException as e:
+        logger.warning(f'could not store media of {game.title}: {e}')
+        raise GameStateException(f'could not store media of {game.title}: {e}')
+    logger.debug(f'stored {references} media references for {game.title} in {perf_counter() - started:.3f}s')
+
+    started = perf_counter()
+    documents = serialize(game, creator)
+    logger.debug(f'serialized {game.title} in {perf_counter() - started:.3f}s')
+
+    # graph definitions cannot be part of a transaction, they are removed again if the insert fails
+    graphs = [(f'game_{game.title}', 'path', 'waypoints')] + \
+             [(f'dialog_{npc.dialog.id.hex}', 'conversation', 'interactions') for npc in game.npcs]
+    for name, edges, vertices in graphs:
+        logger.debug(f'creating graph {name}')
+        db.create_graph(name, edge_definitions=[{
+            'edge_collection': edges,
+            'from_vertex_collections': [vertices],
+            'to_vertex_collections': [vertices]
+        }])
+
+    stats = {}
+    txn_db = db.begin_transaction(write=PUBLISH_COLLECTIONS)
+    try:
+        for collection, docs in documents.items():
+            if not docs:
+                continue
+            started = perf_counter()
+            for result in txn_db.collection(collection).insert_many(docs, silent=False):
+                if isinstance(result, ArangoError):
+                    raise result
+            stats[collection] = {'count': len(docs), 'seconds': perf_counter() - started}
+            logger.debug(f"inserted {len(docs)} documents in {collection} in {stats[collection]['seconds']:.3f}s")
+        txn_db.commit_transaction()
+        game_cache.pop(game.title)
+    except ArangoError as e:
+        logger.warning(f'could not publish {game.title}: {e}')
+        txn_db.abort_transaction()
+        for name, _, _ in graphs:
+            db.delete_graph(name, ignore_missing=True)
+        raise GameStateException(f'could not publish {game.title}: {e}')
+    logger.info(f'published {game.title}: {stats}')
+    return stats
+
+
+def read_dialogs(db: StandardDatabase, title: str) -> [NonPlayableCharacter]:
     """
-    load an existing game back from the database
+    load the NPCs of a game with their dialogs, interactions and tasks in a single query
     :param db: connection
     :param title: game title
-    :return: game object
+    :return: list of NPCs
     """
-    logger.info(f'read called for {title}')
     npcs = []
-    db_npcs = db.collection('npcs')
-    db_dialogs = db.collection('dialogs')
-    for db_npc in db_npcs.find({'game': f'game_{title}'}):
+    for result in db.aql.execute(NPC_QUERY, bind_vars={'game': f'game_{title}', 'depth': MAX_DEPTH}):
+        db_npc = result['npc']
         logger.debug(f'reading back npc {db_npc["_key"]}')
-        db_dialog = next(db_dialogs.find({'_key': db_npc['dialog']}), None)
+        db_dialog = result['dialog']
         if not db_dialog:
             logger.warning(f"dialog {db_npc['dialog']} not in metadata")
             raise GameStateException(f"dialog {db_npc['dialog']} not in metadata")
-        if not db.has_graph(f"dialog_{db_npc['dialog']}"):
-            logger.warning(f"dialog {db_npc['dialog']} does not exist")
-            raise GameStateException(f"dialog {db_npc['dialog']} does not exist")
-
-        vertices = []
-        path = []
-        for k, v in dict(db.graph(f"dialog_{db_npc['dialog']}").traverse(start_vertex=f"interactions/{db_dialog['start']}",
-                                                                         direction='outbound',
-                                                                         strategy='dfs',
-                                                                         edge_uniqueness='global',
-                                                                         vertex_uniqueness='global')).items():
-            if k == 'vertices':
-                for vertex in v:
-                    vertices.append(vertex)
-            elif k == 'paths':
-                for edge in v:
-                    path.append(edge)
-        interactions = []
-        for v in vertices:
-            interaction = json.loads(json.dumps(v), cls=MarugotoDecoder)
+        dialog = Dialog()
+        dialog.id = UUID(db_dialog['_key'])
+        interactions = {}
+        for vertex in result['interactions']:
+            interaction = decode(vertex)
+            interaction.graph = dialog.graph
+            dialog.graph.add_node(interaction)
             logger.debug(f'got {repr(interaction)}')
-            for task in db.collection('tasks'):
-                if task['for'] == interaction.id.hex:
-                    interaction.task = json.loads(json.dumps(task), cls=MarugotoDecoder)
-                    logger.debug(f'got {repr(interaction.task)} for {repr(interaction)}')
-            interactions.append(interaction)
-
-        start_index = -1
-        for e in path:
-            if not e['edges']:
-                start = next(iter([i for i in interactions if i.id == UUID(e['vertices'][0]['_key'])]), None)
-                if start:
-                    start_index = interactions.index(start)
-                    logger.debug(f'setting start index to {start_index}')
-                continue
-            for edge in e['edges']:
-                source = next(iter([i for i in interactions if i.id == UUID(edge['_from'][13:])]), None)
-                if not source:
-                    logger.warning(f"malformed source for dialog {db_npc['dialog']}")
-                    raise GameStateException(f"malformed source for dialog {db_npc['dialog']}")
-                idx = interactions.index(source)
-                destination = next(iter([i for i in interactions if i.id == UUID(edge['_to'][13:])]), None)
-                if not destination:
-                    logger.warning(f"malformed destination for {repr(source)} in dialog {db_npc['dialog']}")
-                    raise GameStateException(f"malformed destination for {repr(source)} in dialog {db_npc['dialog']}")
-                logger.debug(f'adding follow up interaction {repr(destination)} to {repr(source)}')
-                source.add_follow_up(destination)
-                logger.debug(f'setting index for {repr(source)} to {idx}')
-                interactions[idx] = source
-
-        if start_index == -1:
+            interactions[vertex['_key']] = interaction
+        for db_task in result['tasks']:
+            interaction = interactions.get(db_task['for'])
+            if interaction:
+                interaction.task = decode(db_task)
+                logger.debug(f'got {repr(interaction.task)} for {repr(interaction)}')
+        for edge in result['edges']:
+            source = interactions.get(edge['_from'].split('/', 1)[1])
+            if not source:
+                logger.warning(f"malformed source for dialog {db_npc['dialog']}")
+                raise GameStateException(f"malformed source for dialog {db_npc['dialog']}")
+            destination = interactions.get(edge['_to'].split('/', 1)[1])
+            if not destination:
+                logger.warning(f"malformed destination for {repr(source)} in dialog {db_npc['dialog']}")
+                raise GameStateException(f"malformed destination for {repr(source)} in dialog {db_npc['dialog']}")
+            logger.debug(f'adding follow up interaction {repr(destination)} to {repr(source)}')
+            source.add_follow_up(destination)
+        start = interactions.get(db_dialog['start'])
+        if not start:
             logger.warning(f"could not determine start for dialog {db_npc['dialog']}")
             raise GameStateException(f"could not determine start for dialog {db_npc['dialog']}")
+        dialog.set_start(start)
 
-        npc = NonPlayableCharacter(db_npc['first_name'], db_npc['last_name'], Dialog(interactions[start_index]))
+        npc = NonPlayableCharacter(db_npc['first_name'], db_npc['last_name'], dialog)
         npc.salutation = db_npc['salutation']
         npc.mail = db_npc['mail']
-        npc.image = base64.decodebytes(db_npc['image']) if db_npc['image'] else None
+        npc.image = decode_blob(db_npc['image'])
         logger.debug(f'adding {repr(npc)}')
         npcs.append(npc)
+    return npcs
 
-    games = db.collection('games')
-    db_game = next(games.find({'_key': title}), None)
+
+def read(db: StandardDatabase, title: str) -> Game:
+    """
+    load an existing game back from the database, the waypoints, paths and tasks are fetched in a single query
+    and glued back together through lookups by id
+    :param db: connection
+    :param title: game title
+    :return: game object
+    """
+    logger.info(f'read called for {title}')
+    db_game = db.collection('games').get(title)
     if not db_game:
         logger.warning(f'game {title} not in metadata')
         raise GameStateException(f'game {title} not in metadata')
     if not db.has_graph(f'game_{title}'):
         logger.warning(f'game {title} does not exist')
         raise GameStateException(f'game {title} does not exist')
-    vertices = []
-    path = []
-    for k, v in dict(db.graph(f'game_{title}').traverse(start_vertex=f"waypoints/{db_game['start']}",
-                                                        direction='outbound',
-                                                        strategy='dfs',
-                                                        edge_uniqueness='global',
-                                                        vertex_uniqueness='global')).items():
-        if k == 'vertices':
-            for vertex in v:
-                vertices.append(vertex)
-        elif k == 'paths':
-            for edge in v:
-                path.append(edge)
-    waypoints = []
-    for v in vertices:
-        waypoint = json.loads(json.dumps(v), cls=MarugotoDecoder)
+
+    npcs = read_dialogs(db, title)
+    interactions = {}
+    for npc in npcs:
+        for interaction in npc.dialog.graph.nodes:
+            interactions[interaction.id] = interaction
+
+    result = next(db.aql.execute(GAME_QUERY, bind_vars={'start': f"waypoints/{db_game['start']}", 'depth': MAX_DEPTH}))
+    game = Game(title, decode_blob(db_game['image']))
+    game.energy = db_game.get('energy')
+    game.npcs = npcs
+    waypoints = {}
+    for vertex in result['waypoints']:
+        waypoint = decode(vertex)
+        waypoint.graph = game.graph
+        game.graph.add_node(waypoint)
         logger.debug(f'got {repr(waypoint)}')
-        for task in db.collection('tasks'):
-            if task['for'] == waypoint.id.hex:
-                waypoint.tasks.remove(UUID(task['_key']))
-                task = json.loads(json.dumps(task), cls=MarugotoDecoder)
-                logger.debug(f'got {repr(task)} for {repr(waypoint)}')
-                waypoint.tasks.append(task)
-        if waypoint.interactions:
-            for i in waypoint.interactions:
-                if isinstance(i, UUID):
-                    interaction = next(iter([ita for ita in [d.all_path_nodes() for d in [npc.dialog for npc in npcs]] if ita.id == i]), None)
-                    if interaction:
-                        logger.debug(f'adding {repr(interaction)} to {repr(waypoint)}')
-                        waypoint.interactions.append(interaction)
-                    else:
-                        logger.warning(f'could not locate interaction {i}')
-                        raise GameStateException(f'could not locate interaction {i}')
-        waypoints.append(waypoint)
-
-    # glue back the task destinations for waypoints
-    for task in [ts for t in [w.tasks for w in waypoints if w.tasks] for ts in t]:
-        if task.destination and isinstance(task.destination, UUID):
-            destination = next(iter([w for w in waypoints if w.id == task.destination]), None)
-            if not destination:
-                logger.warning(f'could not find destination {task.destination} for task {task.id} in game {title}')
-                raise GameStateException(f'could not find destination {task.destination} for task {task.id} in game {title}')
-            logger.debug(f'adding {repr(destination)} to {repr(task)}')
-            task.destination = destination
-    # glue back interaction destinations for waypoints
-    for interaction in [ias for ia in [w.interactions for w in waypoints if w.interactions] for ias in ia]:
+        waypoints[waypoint.id] = waypoint
+
+    for db_task in result['tasks']:
+        waypoint = waypoints.get(UUID(db_task['for']))
+        if not waypoint:
+            continue
+        task = decode(db_task)
+        logger.debug(f'got {repr(task)} for {repr(waypoint)}')
+        waypoint.tasks = [task if t == task.id else t for t in waypoint.tasks]
+
+    for waypoint in waypoints.values():
+        # glue back interactions and task destinations for waypoints
+        for i, interaction in enumerate(waypoint.interactions):
+            if isinstance(interaction, UUID):
+                if interaction not in interactions:
+                    logger.warning(f'could not locate interaction {interaction}')
+                    raise GameStateException(f'could not locate interaction {interaction}')
+                logger.debug(f'adding {repr(interactions[interaction])} to {repr(waypoint)}')
+                waypoint.interactions[i] = interactions[interaction]
+        for task in waypoint.tasks:
+            if task.destination and isinstance(task.destination, UUID):
+                if task.destination not in waypoints:
+                    logger.warning(f'could not find destination {task.destination} for task {task.id} in game {title}')
+                    raise GameStateException(f'could not find destination {task.destination} for task {task.id} in game {title}')
+                logger.debug(f'adding {repr(waypoints[task.destination])} to {repr(task)}')
+                task.destination = waypoints[task.destination]
+
+    # glue back interaction and task destinations, and waypoints for dialogs
+    for interaction in interactions.values():
         if interaction.destination and isinstance(interaction.destination, UUID):
-            destination = next(iter([w for w in waypoints if w.id == interaction.destination]), None)
-            if not destination:
+            if interaction.destination not in waypoints:
                 logger.warning(f'could not find destination {interaction.destination} for interaction {interaction.id} in game {title}')
                 raise GameStateException(f'could not find destination {interaction.destination} for interaction {interaction.id} in game {title}')
-            logger.debug(f'adding {repr(destination)} to {repr(interaction)}')
-            interaction.destination = destination
-
-    # glue back interaction and task destinations, and waypoints for dialogs
-    for start in [d.start for d in [npc.dialog for npc in npcs]]:
-
-        int_visited = {}
-
-        def interaction_traversal(s, i, l):
-            for successor in start.graph.successors(s):
-                logger.debug(f'successor {repr(successor)} for {repr(s)}')
-                if s not in i.keys():
-                    logger.debug(f'{repr(s)} is new, adding it.')
-                    i[s] = []
-                if successor not in i[s]:
-                    if s.destination and isinstance(s.destination, UUID):
-                        destination = next(iter([w for w in l if w.id == s.destination]), None)
-                        if not destination:
-                            logger.warning(f'could not find destination {s.destination} for interaction {s.id} in game {title}')
-                            raise GameStateException(f'could not find destination {s.destination} for interaction {s.id} in game {title}')
-                        logger.debug(f'adding {repr(destination)} to {repr(s)}')
-                        s.destination = destination
-                    if s.task and s.task.destination and isinstance(s.task.destination, UUID):
-                        destination = next(iter([w for w in l if w.id == s.task.destination]), None)
-                        if not destination:
-                            logger.warning(f'could not find destination {s.destination} for task {s.task.id} in interaction {s.id} in game {title}')
-                            raise GameStateException(f'could not find destination {s.destination} for task {s.task.id} in interaction {s.id} in game {title}')
-                        logger.debug(f'adding task destination {repr(destination)} to {repr(s.task)} for {repr(s)}')
-                        s.task.destination = destination
-                    if s.waypoints:
-                        wps = []
-                        for waypoint in s.waypoints:
-                            if isinstance(waypoint, UUID):
-                                destination = next(iter([w for w in l if w.id == waypoint]), None)
-                                if not destination:
-                                    logger.warning(f'could not find waypoint {waypoint} for interaction {interaction.id} in game {title}')
-                                    raise GameStateException(f'could not find waypoint {waypoint} for interaction {interaction.id} in game {title}')
-                                logger.debug(f'adding {repr(destination)}')
-                                wps.append(destination)
-                            else:
-                                logger.debug(f'adding {repr(waypoint)}')
-                                wps.append(waypoint)
-                        s.waypoints = wps
-
-                    int_visited[s].append(successor)
-                    interaction_traversal(successor, i, l)
-
-        logger.debug(f'starting interaction traversal to glue back waypoints')
-        interaction_traversal(start, int_visited, waypoints)
-
-    start_index = -1
-    for e in path:
-        if not e['edges']:
-            start = next(iter([i for i in waypoints if i.id == UUID(e['vertices'][0]['_key'])]), None)
-            if start:
-                start_index = waypoints.index(start)
-                logger.debug(f'settings start index to {start_index}')
-            continue
-        for edge in e['edges']:
-            source = next(iter([i for i in waypoints if i.id == UUID(edge['_from'][10:])]), None)
-            if not source:
-                logger.warning(f'malformed source for game {title}')
-                raise GameStateException(f'malformed source for game {title}')
-            idx = waypoints.index(source)
-            destination = next(iter([i for i in waypoints if i.id == UUID(edge['_to'][10:])]), None)
-            if not destination:
-                logger.warning(f'malformed destination for {source} in game {title}')
-                raise GameStateException(f'malformed destination for {source} in game {title}')
-            logger.debug(f'adding {repr(destination)} to {repr(source)}')
-            if 'weight' in edge and edge['weight']:
-                source.add_destination(destination, edge['weight'])
-            else:
-                source.add_destination(destination)
-            logger.debug(f'setting index for {repr(source)} to {idx}')
-            waypoints[idx] = source
-
-    if start_index == -1:
+            logger.debug(f'adding {repr(waypoints[interaction.destination])} to {repr(interaction)}')
+            interaction.destination = waypoints[interaction.destination]
+        if interaction.task and interaction.task.destination and isinstance(interaction.task.destination, UUID):
+            if interaction.task.destination not in waypoints:
+                logger.warning(f'could not find destination {interaction.task.destination} for task {interaction.task.id} in interaction {interaction.id} in game {title}')
+                raise GameStateException(f'could not find destination {interaction.task.destination} for task {interaction.task.id} in interaction {interaction.id} in game {title}')
+            logger.debug(f'adding task destination {repr(waypoints[interaction.task.destination])} to {repr(interaction.task)} for {repr(interaction)}')
+            interaction.task.destination = waypoints[interaction.task.destination]
+        wps = []
+        for waypoint in interaction.waypoints:
+            if isinstance(waypoint, UUID):
+                if waypoint not in waypoints:
+                    logger.warning(f'could not find waypoint {waypoint} for interaction {interaction.id} in game {title}')
+                    raise GameStateException(f'could not find waypoint {waypoint} for interaction {interaction.id} in game {title}')
+                waypoint = waypoints[waypoint]
+            logger.debug(f'adding {repr(waypoint)}')
+            wps.append(waypoint)
+        interaction.waypoints = wps
+
+    for edge in result['edges']:
+        source = waypoints.get(UUID(edge['_from'].split('/', 1)[1]))
+        if not source:
+            logger.warning(f'malformed source for game {title}')
+            raise GameStateException(f'malformed source for game {title}')
+        destination = waypoints.get(UUID(edge['_to'].split('/', 1)[1]))
+        if not destination:
+            logger.warning(f'malformed destination for {source} in game {title}')
+            raise GameStateException(f'malformed destination for {source} in game {title}')
+        logger.debug(f'adding {repr(destination)} to {repr(source)}')
+        if 'weight' in edge and edge['weight']:
+            source.add_destination(destination, edge['weight'])
+        else:
+            source.add_destination(destination)
+
+    start = waypoints.get(UUID(db_game['start']))
+    if not start:
         logger.warning(f'could not determine start for game {title}')
         raise GameStateException(f'could not determine start for game {title}')
+    game.set_start(start)
+
+    return game
 
-    game = Game(title, base64.decodebytes(db_game['image']) if db_game['image'] else None, waypoints[start_index])
-    game.npcs = npcs
 
+def read_cached(db: StandardDatabase, title: str) -> Game:
+    """
+    load a game through the process wide game cache, a cached game is used as long as the revision of its
+    metadata document has not changed; cached games are shared between requests and frozen, changing them raises
+    an exception, use read for a game that can be changed
+    :param db: connection
+    :param title: game title
+    :return: game object
+    """
+    db_game = db.collection('games').get(title)
+    if not db_game:
+        logger.warning(f'game {title} not in metadata')
+        raise GameStateException(f'game {title} not in metadata')
+    cached = game_cache.get(title)
+    if cached and cached[0] == db_game['_rev']:
+        return cached[1]
+    game = read(db, title)
+    game.freeze()
+    game_cache.put(title, (db_game['_rev'], game))
     return game
 
 
+def cache_stats() -> dict:
+    """
+    statistics of the game cache
+    :return: dict with hits, misses, evictions, size and estimated bytes
+    """
+    return game_cache.stats()
+
+
 def get_all_games(db: StandardDatabase) -> [str]:
     """
     get all game titles
@@ -434,6 +501,35 @@ def get_all_games(db: StandardDatabase) -> [str]:
     return [d['_key'] for d in db.collection('games')]
 
 
+def list_games(db: StandardDatabase, limit: int = 20, cursor: str = None) -> ([dict], str):
+    """
+    page through the game summaries, served from the games metadata only
+    :param db: connection
+    :param limit: maximum number of games
+    :param cursor: title of the last game of the previous page
+    :return: list of game summaries and the cursor for the next page (empty if this is the last page)
+    """
+    if cursor:
+        summaries = list(db.aql.execute(LIST_AFTER_QUERY, bind_vars={'cursor': cursor, 'limit': limit}))
+    else:
+        summaries = list(db.aql.execute(LIST_QUERY, bind_vars={'limit': limit}))
+    return summaries, summaries[-1]['title'] if len(summaries) == limit else ''
+
+
+def read_image(db: StandardDatabase, title: str):
+    """
+    get the image of a game
+    :param db: connection
+    :param title: game title
+    :return: Media reference, base64 encoded image for games published before the media store, or None
+    """
+    db_game = db.collection('games').get(title)
+    if not db_game:
+        logger.warning(f'game {title} not in metadata')
+        raise GameStateException(f'game {title} not in metadata')
+    return Media.parse(db_game['image']) or db_game['image']
+
+
 def get_all_dialogs(db: StandardDatabase) -> [str]:
     """
     get all dialog ids
@@ -445,17 +541,13 @@ def get_all_dialogs(db: StandardDatabase) -> [str]:
 
 def delete(db: StandardDatabase, game: Game, requester=None):
     """
-    delete all objects associated with a game
+    delete all objects associated with a game within a single transaction
     :param db: connection
     :param game: target
     :param requester: player requesting the delete
     """
     logger.info(f'delete called for {game.title}')
-    db_npcs = db.collection('npcs')
-    db_dialogs = db.collection('dialogs')
-    tasks = db.collection('tasks')
-    games = db.collection('games')
-    db_game = next(games.find({'_key': game.title}), None)
+    db_game = db.collection('games').get(game.title)
     if not db_game:
         logger.warning(f'game {game.title} not in metadata')
         raise GameStateException(f'game {game.title} not in metadata')
@@ -465,33 +557,22 @@ def delete(db: StandardDatabase, game: Game, requester=None):
     if db_game['creator'] and not db_game['creator'] == requester:
         raise GameStateException(f'cannot delete game {game.title}, you are not the owner')
 
-    for db_npc in db_npcs.find({'game': f'game_{game.title}'}):
-        db_dialog = next(db_dialogs.find({'_key': db_npc['dialog']}), None)
-        if not db.has_graph(f"dialog_{db_npc['dialog']}"):
-            logger.warning(f"dialog {db_npc['dialog']} does not exist")
-            raise GameStateException(f"dialog {db_npc['dialog']} does not exist")
-        for k, v in dict(db.graph(f"dialog_{db_npc['dialog']}").traverse(start_vertex=f"interactions/{db_dialog['start']}",
-                                                                         direction='outbound',
-                                                                         strategy='dfs',
-                                                                         edge_uniqueness='global',
-                                                                         vertex_uniqueness='global')).items():
-            if k == 'vertices':
-                for interaction in v:
-                    if 'task' in interaction and interaction['task']:
-                        db_task = next(tasks.find({'_key': interaction['task']}))
-                        if db_task:
-                            db.delete_document(db_task)
-        db.delete_document(db_dialog)
-        db.delete_graph(f"dialog_{db_npc['dialog']}", drop_collections=True)
-        db.delete_document(db_npc)
-
-    for node in nx.dfs_tree(game.graph):
-        for task in node.tasks:
-            db_task = next(tasks.find({'_key': task.id.hex}), None)
-            if db_task:
-                db.delete_document(db_task)
-    db.delete_document(db_game)
-    db.delete_graph(f'game_{game.title}', drop_collections=True)
+    txn_db = db.begin_transaction(write=PUBLISH_COLLECTIONS)
+    try:
+        for collection, docs in serialize(game).items():
+            if docs:
+                logger.debug(f'removing {len(docs)} documents from {collection}')
+                txn_db.collection(collection).delete_many([{'_key': d['_key']} for d in docs])
+        txn_db.commit_transaction()
+        game_cache.pop(game.title)
+    except ArangoError as e:
+        logger.warning(f'could not delete {game.title}: {e}')
+        txn_db.abort_transaction()
+        raise GameStateException(f'could not delete {game.title}: {e}')
+    # the vertex and edge collections are shared between games
+    for npc in game.npcs:
+        db.delete_graph(f'dialog_{npc.dialog.id.hex}', ignore_missing=True)
+    db.delete_graph(f'game_{game.title}')
 
 
 def update(db: StandardDatabase, game: Game):
@@ -1,66 +1,473 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
 
-import json
+import copy
 import logging
+import os
 from datetime import datetime
 from uuid import UUID
 
 from arango.database import StandardDatabase
+from arango.exceptions import ArangoError
 
-from database.game import read as game_read
+from database.game import read_cached as game_read
 from database.player import read as player_read
+from database.storage import pack, unpack, storage_format
 from model.instance import GameInstance
-from model.player import Player
-from util.coder import MarugotoEncoder, MarugotoDecoder
+from model.player import Player, PlayerState
+from util.coder import CODEC_VERSION, encode, encode_stamp, decode_stamp, reference
 
 
 logger = logging.getLogger('database.instance')
 
+# an instance is its document, the snapshots of its player states and the event log since the latest snapshot
+INSTANCE_COLLECTIONS = ['instances', 'snapshots', 'events']
+# number of events after which the player states are compacted into a new snapshot
+SNAPSHOT_INTERVAL = int(os.getenv('INSTANCE_SNAPSHOT_INTERVAL', 100))
+
+# player_ids and game_master_id are indexed (see schema.COLLECTIONS), and initialize() creates the collections, so
+# saves() and hosts() are answered by a single query without decoding instances
+SAVES_QUERY = '''
+FOR i IN instances
+    FILTER @player IN i.player_ids
+    SORT i.created_at
+    RETURN [i.created_at, i.name, i.game_title, i.pseudonyms[@player]]
+'''
+HOSTS_QUERY = '''
+FOR i IN instances
+    FILTER i.game_master_id == @player
+    SORT i.created_at
+    RETURN [i.created_at, i.name, i.game_title]
+'''
+# latest snapshot of every player of an instance up to a sequence number, with the events of the player after it,
+# and the sequence number of the last event
+REPLAY_QUERY = '''
+LET states = (
+    FOR player IN @players
+        LET snapshot = FIRST(
+            FOR s IN snapshots
+                FILTER s.instance == @instance AND s.player_id == player AND (@until == null OR s.seq <= @until)
+                SORT s.seq DESC
+                LIMIT 1
+                RETURN s
+        )
+        FILTER snapshot != null
+        LET events = (
+            FOR e IN events
+                FILTER e.instance == @instance AND e.player == player AND e.seq > snapshot.seq
+                    AND (@until == null OR e.seq <= @until)
+                SORT e.seq
+                RETURN e
+        )
+        RETURN {snapshot: snapshot, events: events}
+)
+LET last = FIRST(
+    FOR e IN events
+        FILTER e.instance == @instance AND (@until == null OR e.seq <= @until)
+        SORT e.seq DESC
+        LIMIT 1
+        RETURN e.seq
+)
+RETURN {states: states, last: last}
+'''
+# players of an instance written before its document listed them, taken from their snapshots
+PLAYERS_QUERY = '''
+FOR s IN snapshots
+    FILTER s.instance == @instance
+    RETURN DISTINCT s.player_id
+'''
+
 
 class InstanceStateException(Exception):
     pass
 
 
+def detached(instance: GameInstance) -> GameInstance:
+    """
+    shallow copy of an instance without the player states and the NPC paths per player
+    :param instance: game instance
+    :return: copy to store as the instance document
+    """
+    result = copy.copy(instance)
+    result.player_states = []
+    result.npc_states = []
+    for npc_state in instance.npc_states:
+        npc_copy = copy.copy(npc_state)
+        npc_copy.paths = {}
+        result.npc_states.append(npc_copy)
+    return result
+
+
+def document(instance: GameInstance) -> dict:
+    """
+    encode a game instance to its document, with the membership fields used by the listing queries
+    the player states are stored in snapshots, see snapshot_document
+    :param instance: game instance
+    :return: document
+    """
+    result = pack('instances', detached(instance))
+    result.update({
+        'name': instance.name,
+        'game_title': instance.game.title,
+        'created_at': encode_stamp(instance.created_at),
+        'game_master_id': instance.game_master.id.hex if instance.game_master else None,
+        'player_ids': [p.player.id.hex for p in instance.player_states],
+        'pseudonyms': {p.player.id.hex: f'{p.first_name} {p.last_name}' for p in instance.player_states},
+        'seq': instance.sequence or 0
+    })
+    return result
+
+
+def snapshot_document(instance: GameInstance, state: PlayerState) -> dict:
+    """
+    encode a player state, with the paths of the NPCs for this player, to a snapshot at the current sequence number
+    keyed by instance, player and sequence number
+    :param instance: game instance
+    :param state: player state
+    :return: document
+    """
+    seq = instance.sequence or 0
+    result = pack('snapshots', state, f'{instance.id.hex}-{state.player.id.hex}-{seq}')
+    result.update({
+        'instance': instance.id.hex,
+        'player_id': state.player.id.hex,
+        'seq': seq,
+        'npc_paths': {str(npc): [{'stamp': encode_stamp(d), 'interaction': reference(i)}
+                                 for d, i in npc.paths.get(state, npc.paths.get(state.player.id, []))]
+                      for npc in instance.npc_states}
+    })
+    return result
+
+
+def event_document(instance: GameInstance, state: PlayerState, seq: int, delta: tuple) -> dict:
+    """
+    encode a change recorded by a player state as an event
+    :param instance: game instance
+    :param state: player state
+    :param seq: sequence number of the event in the instance
+    :param delta: (kind, *values) as recorded by the player state
+    :return: document
+    """
+    kind, *values = delta
+    result = {'_key': f'{instance.id.hex}-{seq}', 'instance': instance.id.hex, 'player': state.player.id.hex,
+              'seq': seq, 'type': kind}
+    if kind == 'moved':
+        stamp, waypoint = values
+        result.update({'stamp': encode_stamp(stamp), 'waypoint': reference(waypoint)})
+    elif kind == 'answered':
+        stamp, task, answer = values
+        result.update({'stamp': encode_stamp(stamp), 'task': reference(task), 'answer': encode(answer)})
+    elif kind == 'item':
+        stamp, holder, item = values
+        result.update({'stamp': encode_stamp(stamp), 'holder': reference(holder), 'item': encode(item)})
+    elif kind == 'dialog':
+        npc, stamp, interaction, response = values
+        result.update({'npc': str(npc), 'stamp': encode_stamp(stamp), 'interaction': reference(interaction),
+                       'response': response})
+    elif kind == 'npc':
+        npc, stamp, interaction = values
+        result.update({'npc': str(npc), 'stamp': encode_stamp(stamp), 'interaction': reference(interaction)})
+    elif kind in ['budget', 'energy']:
+        result['value'] = values[0]
+    else:
+        raise InstanceStateException(f'unknown change {kind} for {state.player.email} in {instance.id}')
+    return result
+
+
+def fold(game_instance: GameInstance, state: PlayerState, event: dict):
+    """
+    apply an event to a decoded player state, references are resolved afterwards by attach
+    :param game_instance: decoded game instance
+    :param state: decoded player state
+    :param event: event document
+    """
+    kind = event['type']
+    if kind == 'moved':
+        state.path.append((decode_stamp(event['stamp']), UUID(event['waypoint'])))
+    elif kind == 'answered':
+        # answers are kept in the log only, their effects are events of their own
+        pass
+    elif kind == 'item':
+        state.inventory.setdefault(decode_stamp(event['stamp']), []).append((UUID(event['holder']), event['item']))
+    elif kind == 'dialog':
+        state.dialogs.setdefault(event['npc'], []).append((decode_stamp(event['stamp']),
+                                                           UUID(event['interaction']),
+                                                           event['response']))
+    elif kind == 'npc':
+        npc = next(iter([n for n in game_instance.npc_states if str(n) == event['npc']]), None)
+        if not npc:
+            raise InstanceStateException(f"could not find NPC {event['npc']} in {game_instance.id}")
+        npc.paths.setdefault(state.player.id, []).append((decode_stamp(event['stamp']), UUID(event['interaction'])))
+    elif kind == 'budget':
+        state.budget = event['value']
+    elif kind == 'energy':
+        state.energy = event['value']
+    else:
+        raise InstanceStateException(f"unknown change {kind} in {game_instance.id}")
+
+
+def insert(txn_db, collection: str, documents: [dict], overwrite: bool = False):
+    for result in txn_db.collection(collection).insert_many(documents, overwrite=overwrite, silent=False):
+        if isinstance(result, ArangoError):
+            raise result
+
+
+def buffer():
+    # the buffer drains instances with the functions of this module
+    from database.buffer import write_buffer
+    return write_buffer()
+
+
 def save(db: StandardDatabase, instance: GameInstance):
     """
-    save a game instance
+    save a complete game instance, the pending changes are appended to the event log and every player state is
+    written as a new snapshot, needed when creating an instance and after adding or removing players
     :param db: connection
     :param instance: game
     """
     logger.info(f'save called for {instance.id} ({instance.game.title})')
-    if not db.has_collection('instances'):
-        logger.info('creating collection instances')
-        db.create_collection('instances')
-    col = db.collection('instances')
-    txn_db = db.begin_transaction(read=col.name, write=col.name)
-    txn_col = txn_db.collection('instances')
-    txn_col.insert(json.dumps(instance, cls=MarugotoEncoder))
-    txn_db.commit_transaction()
+    # events of the instance still in the write-behind buffer come before the ones written here
+    if instance.sequence is not None and not buffer().settle(instance.id.hex):
+        logger.warning(f'could not write the queued changes of {instance.id}')
+        raise InstanceStateException(f'could not write the queued changes of {instance.id}')
+    previous = instance.sequence
+    if previous is None:
+        # the first snapshot already contains everything that happened before it
+        for state in instance.player_states:
+            state.deltas = []
+    events = pending(instance)
+    instance.sequence = (previous or 0) + len(events)
+    txn_db = db.begin_transaction(write=INSTANCE_COLLECTIONS)
+    try:
+        if events:
+            insert(txn_db, 'events', events)
+        txn_db.collection('instances').insert(document(instance), overwrite=True)
+        if instance.player_states:
+            insert(txn_db, 'snapshots', [snapshot_document(instance, s) for s in instance.player_states],
+                   overwrite=True)
+        txn_db.commit_transaction()
+    except ArangoError as e:
+        logger.warning(f'could not save {instance.id}: {e}')
+        txn_db.abort_transaction()
+        instance.sequence = previous
+        raise InstanceStateException(f'could not save {instance.id}: {e}')
+    for state in instance.player_states:
+        state.deltas = []
+    instance.stale = set()
 
 
-def load(db: StandardDatabase, game_id: str) -> GameInstance:
+def update(db: StandardDatabase, instance: GameInstance) -> int:
+    """
+    persist the changes recorded by the player states since the last save or update as events through the
+    write-behind buffer, written before returning with INSTANCE_DURABILITY=sync and in the next flush otherwise;
+    only players with changes are snapshotted again when a snapshot is due, an instance that has never been saved
+    is saved in full
+    :param db: connection for sync writes
+    :param instance: game instance
+    :return: number of persisted or queued changes
+    """
+    if instance.sequence is None:
+        save(db, instance)
+        return 0
+    changes = sum(len(s.deltas) for s in instance.player_states)
+    buffer().submit(instance, db)
+    return changes
+
+
+
+def pending(instance: GameInstance) -> [dict]:
+    """
+    encode the changes recorded by the player states since they were last persisted as events
+    :param instance: saved game instance
+    :return: event documents numbered after the last persisted event
+    """
+    deltas = [(state, delta) for state in instance.player_states for delta in state.deltas]
+    return [event_document(instance, state, seq, delta)
+            for seq, (state, delta) in enumerate(deltas, (instance.sequence or 0) + 1)]
+
+
+def drain(instance: GameInstance) -> [dict]:
+    """
+    take the changes recorded by the player states and encode them as events numbered after the last event,
+    changes recorded while draining are left for the next drain
+    :param instance: saved game instance
+    :return: event documents, the sequence number of the instance is advanced past them
     """
-    load a game instance by id
+    if instance.sequence is None:
+        logger.warning(f'game instance {instance.id} has not been saved')
+        raise InstanceStateException(f'game instance {instance.id} has not been saved')
+    events = []
+    for state in instance.player_states:
+        count = len(state.deltas)
+        for delta in state.deltas[:count]:
+            events.append(event_document(instance, state, instance.sequence + len(events) + 1, delta))
+        del state.deltas[:count]
+    instance.sequence += len(events)
+    return events
+
+
+def append(db: StandardDatabase, instance: GameInstance) -> int:
+    """
+    append the changes recorded by the player states to the event log, every SNAPSHOT_INTERVAL events
+    the player states are compacted into a new snapshot
+    :param db: connection
+    :param instance: game instance
+    :return: number of appended events
+    """
+    if instance.sequence is None:
+        logger.warning(f'game instance {instance.id} has not been saved')
+        raise InstanceStateException(f'game instance {instance.id} has not been saved')
+    events = pending(instance)
+    if not events:
+        return 0
+    # all or none of the events are stored, so a retry numbers them the same without hitting stored keys
+    txn_db = db.begin_transaction(write=['events'])
+    try:
+        insert(txn_db, 'events', events)
+        txn_db.commit_transaction()
+    except ArangoError as e:
+        logger.warning(f'could not append events for {instance.id}: {e}')
+        txn_db.abort_transaction()
+        raise InstanceStateException(f'could not append events for {instance.id}: {e}')
+    previous, instance.sequence = instance.sequence, instance.sequence + len(events)
+    for state in instance.player_states:
+        state.deltas = []
+    instance.stale.update(e['player'] for e in events)
+    logger.debug(f'appended {len(events)} events for {instance.id} up to {instance.sequence}')
+    if previous // SNAPSHOT_INTERVAL != instance.sequence // SNAPSHOT_INTERVAL:
+        snapshot(db, instance)
+    return len(events)
+
+
+def snapshots(instance: GameInstance) -> [dict]:
+    """
+    encode the player states with changes after their latest snapshot to snapshots at the current sequence number
+    :param instance: saved game instance without pending changes
+    :return: snapshot documents
+    """
+    if instance.sequence is None or any(s.deltas for s in instance.player_states):
+        logger.warning(f'game instance {instance.id} has changes that are not in the event log')
+        raise InstanceStateException(f'game instance {instance.id} has changes that are not in the event log')
+    return [snapshot_document(instance, s) for s in instance.player_states if s.player.id.hex in instance.stale]
+
+
+def snapshot(db: StandardDatabase, instance: GameInstance):
+    """
+    compact the event log by writing the player states that changed since their latest snapshot as snapshots at
+    the current sequence number, events are kept so older states can still be replayed
+    :param db: connection
+    :param instance: saved game instance without pending changes
+    """
+    documents = snapshots(instance)
+    if not documents:
+        return
+    try:
+        results = db.collection('snapshots').insert_many(documents, overwrite=True, silent=False)
+    except ArangoError as e:
+        logger.warning(f'could not snapshot {instance.id} at {instance.sequence}: {e}')
+        raise InstanceStateException(f'could not snapshot {instance.id} at {instance.sequence}: {e}')
+    failed = [r for r in results if isinstance(r, ArangoError)]
+    # a snapshot that failed is taken again next time, the events stay the record until then
+    instance.stale.difference_update(d['player_id'] for d, r in zip(documents, results)
+                                     if not isinstance(r, ArangoError))
+    if failed:
+        logger.warning(f'could not snapshot {len(failed)} players of {instance.id} at {instance.sequence}: {failed[0]}')
+        raise InstanceStateException(f'could not snapshot {instance.id} at {instance.sequence}: {failed[0]}')
+    logger.info(f'snapshot of {len(documents)} players of {instance.id} at {instance.sequence}')
+
+
+def replay(db: StandardDatabase, game_id: str, until: int = None) -> GameInstance:
+    """
+    rebuild a game instance from its latest snapshot and the events after it, without loading the game
     :param db: connection
     :param game_id: game instance id
-    :return Game Instance
+    :param until: sequence number to replay up to, the latest state if not set
+    :return: decoded game instance, references into the game are resolved by attach
     """
-    logger.info(f'load called for {game_id}')
-    if not db.has_collection('instances'):
-        logger.warning('no collections for instances')
-        raise InstanceStateException('no collections for instances')
-    col = db.collection('instances')
-    db_game_instance = next(col.find({'_key': game_id}), None)
+    db_game_instance = db.collection('instances').get(game_id)
     if not db_game_instance:
         logger.warning(f'could not find game instance {game_id}')
         raise InstanceStateException(f'could not find game instance {game_id}')
-    game_instance = json.loads(json.dumps(db_game_instance), cls=MarugotoDecoder)
+    game_instance = unpack(db_game_instance)
+    if game_instance.player_states:
+        # instances saved before the event log embed their player states
+        return game_instance
+    player_ids = db_game_instance.get('player_ids')
+    if player_ids is None:
+        player_ids = list(db.aql.execute(PLAYERS_QUERY, bind_vars={'instance': game_id}))
+    result = next(db.aql.execute(REPLAY_QUERY, bind_vars={'instance': game_id, 'until': until,
+                                                          'players': player_ids}))
+    if not result['states'] and player_ids:
+        logger.warning(f'no snapshot for game instance {game_id} up to {until}')
+        raise InstanceStateException(f'no snapshot for game instance {game_id} up to {until}')
+    restore(game_instance, result['states'], result['last'])
+    return game_instance
+
+
+def restore(game_instance: GameInstance, states: [dict], last: int = None):
+    """
+    decode the latest snapshot of every player into a decoded game instance and fold the events of the player
+    after it back in
+    :param game_instance: decoded game instance
+    :param states: dicts with the snapshot document of a player and the event documents after it, in sequence
+    :param last: sequence number of the last event of the instance
+    """
+    npcs = {str(n): n for n in game_instance.npc_states}
+    sequence = last or 0
+    for state in states:
+        db_snapshot = state['snapshot']
+        player_state = unpack(db_snapshot)
+        for npc, path in db_snapshot['npc_paths'].items():
+            if npc in npcs:
+                npcs[npc].paths[player_state.player.id] = [(decode_stamp(p['stamp']), UUID(p['interaction']))
+                                                           for p in path]
+        for event in state['events']:
+            fold(game_instance, player_state, event)
+        if state['events']:
+            game_instance.stale.add(db_snapshot['player_id'])
+        game_instance.player_states.append(player_state)
+        sequence = max(sequence, db_snapshot['seq'])
+    game_instance.sequence = sequence
+
+
+def load(db: StandardDatabase, game_id: str) -> GameInstance:
+    """
+    load a game instance by id, from its latest snapshot and the events after it
+    :param db: connection
+    :param game_id: game instance id
+    :return Game Instance
+    """
+    logger.info(f'load called for {game_id}')
+    buffer().release(game_id)
+    game_instance = replay(db, game_id)
     game_instance.game = game_read(db, game_instance.game.title)
     for player_state in game_instance.player_states:
         if not isinstance(player_state.player, Player):
             player_state.player = player_read(db, player_state.player)
+    attach(game_instance)
+    return game_instance
+
+
+def identify(o) -> UUID:
+    return o if isinstance(o, UUID) else o.id
+
+
+def attach(game_instance: GameInstance):
+    """
+    resolve the waypoint, interaction, NPC and player references of the states to the objects of the loaded game
+    :param game_instance: decoded game instance with its game loaded
+    """
+    waypoints = {w.id: w for w in game_instance.game.graph.nodes}
+    interactions = {i.id: i for n in game_instance.game.npcs for i in n.dialog.graph.nodes}
+    npcs = {str(n): n for n in game_instance.npc_states}
+    players = {}
+    for player_state in game_instance.player_states:
         player_state.game_instance = game_instance
+        player_state.path = [(stamp, waypoints.get(identify(w), w)) for stamp, w in player_state.path]
+        player_state.dialogs = {npcs.get(str(npc), npc): [(stamp, interactions.get(identify(i), i), response)
+                                                          for stamp, i, response in dialog]
+                                for npc, dialog in player_state.dialogs.items()}
+        players[player_state.player.id] = player_state
     for npc_state in game_instance.npc_states:
         npc_state.game_instance = game_instance
         if isinstance(npc_state.dialog.start, UUID):
@@ -70,7 +477,36 @@ def load(db: StandardDatabase, game_id: str) -> GameInstance:
                            f'in {game_instance.game.title} ({game_instance.id})')
             raise InstanceStateException(f'could not find dialog for NPC {npc_state.first_name} {npc_state.last_name} '
                                          f'in {game_instance.game.title} ({game_instance.id})')
-    return game_instance
+        # images are shared with the game, which holds media references once published
+        npc = next(iter([n for n in game_instance.game.npcs if n == npc_state]), None)
+        if npc and npc.image is not None:
+            npc_state.image = npc.image
+        npc_state.paths = {players.get(identify(p), p): [(stamp, interactions.get(identify(i), i)) for stamp, i in path]
+                           for p, path in npc_state.paths.items()}
+
+
+def migrate(db: StandardDatabase) -> int:
+    """
+    rewrite stored game instances that were saved with an older codec version or in another storage format
+    than the one currently configured
+    :param db: connection
+    :return: number of migrated instances
+    """
+    if not db.has_collection('instances'):
+        return 0
+    migrated = 0
+    fmt = storage_format('instances').name
+    query = 'FOR i IN instances FILTER i._v == null OR i._v < @version OR (i._format || "json") != @format ' \
+            'OR i.seq == null RETURN i'
+    for db_game_instance in db.aql.execute(query, bind_vars={'version': CODEC_VERSION, 'format': fmt}):
+        game_instance = replay(db, db_game_instance['_key']) if db_game_instance.get('seq') is not None \
+            else unpack(db_game_instance)
+        for state in game_instance.player_states + game_instance.npc_states:
+            state.game_instance = game_instance
+        save(db, game_instance)
+        migrated += 1
+    logger.info(f'migrated {migrated} game instances to codec version {CODEC_VERSION} ({fmt})')
+    return migrated
 
 
 def saves(db: StandardDatabase, player: Player) -> [(datetime, str, str, str)]:
@@ -81,21 +517,8 @@ def saves(db: StandardDatabase, player: Player) -> [(datetime, str, str, str)]:
     :return list of (creation date, game instance name, game title, pseudonym)
     """
     logger.info(f'saves requested for player {player.email}')
-    if not db.has_collection('instances'):
-        logger.warning('no collections for instances')
-        raise InstanceStateException('no collections for instances')
-    col = db.collection('instances')
-    result = []
-    for db_game_instance in col.all():
-        game_instance = json.loads(json.dumps(db_game_instance), cls=MarugotoDecoder)
-        game_instance.game = game_read(db, game_instance.game.title)
-        for player_state in game_instance.player_states:
-            if player_state.player.id == player.id:
-                result.append((game_instance.created_at,
-                               game_instance.name,
-                               game_instance.game.title,
-                               f'{player_state.first_name} {player_state.last_name}'))
-    return result
+    return [(decode_stamp(created_at), name, title, pseudonym) for created_at, name, title, pseudonym in
+            db.aql.execute(SAVES_QUERY, bind_vars={'player': player.id.hex})]
 
 
 def hosts(db: StandardDatabase, player: Player) -> [(datetime, str, str)]:
@@ -106,14 +529,5 @@ def hosts(db: StandardDatabase, player: Player) -> [(datetime, str, str)]:
     :return: list of (creation date, game instance name, game title)
     """
     logger.info(f'hosts requested for player {player.email}')
-    if not db.has_collection('instances'):
-        logger.warning('no collections for instances')
-        raise InstanceStateException('no collections for instances')
-    col = db.collection('instances')
-    result = []
-    for db_game_instance in col.all():
-        game_instance = json.loads(json.dumps(db_game_instance), cls=MarugotoDecoder)
-        game_instance.game = game_read(db, game_instance.game.title)
-        if game_instance.game_master and game_instance.game_master.id == player.id:
-            result.append((game_instance.created_at, game_instance.name, game_instance.game.title))
-    return result
+    return [(decode_stamp(created_at), name, title) for created_at, name, title in
+            db.aql.execute(HOSTS_QUERY, bind_vars={'player': player.id.hex})]
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+from threading import RLock
+
+from arango.database import StandardDatabase
+from arango.exceptions import ArangoError
+
+from database.connection import get_db
+from model.component import Video
+from model.game import Game
+from model.media import Media, digest, sniff
+from util.coder import encode_blob, decode_blob
+
+logger = logging.getLogger('database.media')
+
+FILESYSTEM = 'filesystem'
+COLLECTION = 'collection'
+
+# bytes per chunk when streaming media
+CHUNK_SIZE = 64 * 1024
+KEY = re.compile(r'^[0-9a-f]{64}$')
+
+# size and content type of a media document, without its data
+STAT_QUERY = """
+FOR m IN media
+    FILTER m._key == @key
+    RETURN {size: m.size, content_type: m.content_type}
+"""
+
+# documents and the fields that held inline base64 data before the media store
+INLINE_FIELDS = [('games', 'image'), ('npcs', 'image'), ('tasks', 'media'), ('waypoints', 'level')]
+
+file_store = None
+store_lock = RLock()
+
+
+class MediaStateException(Exception):
+    pass
+
+
+def valid(key: str) -> bool:
+    return isinstance(key, str) and KEY.match(key) is not None
+
+
+def read_file(path: str, start: int = 0, stop: int = None):
+    """
+    read a file in chunks from a memory map, the file is mapped right away so it can be removed while it is streamed
+    :param path: file path
+    :param start: first byte
+    :param stop: byte after the last byte, the end of the file if not set
+    :return: generator of chunks of bytes
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        stop = size if stop is None else min(stop, size)
+        if start >= stop:
+            return iter(())
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def chunks():
+        with mapped:
+            for offset in range(start, stop, CHUNK_SIZE):
+                yield mapped[offset:min(offset + CHUNK_SIZE, stop)]
+    return chunks()
+
+
+class FileMediaStore(object):
+    """
+    Media stored as files named by their content hash, spread over directories by the first two hex digits
+    """
+    def __init__(self, path: str):
+        """
+        :param path: root directory of the store, created on first write
+        """
+        self.root = path
+
+    def path(self, key: str) -> str:
+        if not valid(key):
+            raise MediaStateException(f'invalid media key {key}')
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data: bytes) -> Media:
+        """
+        store binary data once, storing the same data again is a no-op
+        :param data: binary data
+        :return: reference to the data
+        """
+        media = Media(digest(data), len(data), sniff(data))
+        path = self.path(media.key)
+        if os.path.exists(path):
+            return media
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file next to the target so the rename is atomic
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except OSError as e:
+            os.unlink(temporary)
+            raise MediaStateException(f'could not store media {media.key}: {e}')
+        logger.debug(f'stored {repr(media)} of {media.size} bytes')
+        return media
+
+    def put_file(self, source) -> Media:
+        """
+        store the contents of a binary file once, copying it in chunks so large files are never held in memory
+        :param source: file opened for binary reading
+        :return: reference to the data
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.root)
+        sha256 = hashlib.sha256()
+        size = 0
+        head = b''
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    head = head or chunk[:16]
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            media = Media(sha256.hexdigest(), size, sniff(head))
+            path = self.path(media.key)
+            if os.path.exists(path):
+                os.unlink(temporary)
+                return media
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temporary, path)
+        except OSError as e:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise MediaStateException(f'could not store media: {e}')
+        logger.debug(f'stored {repr(media)} of {media.size} bytes')
+        return media
+
+    def stat(self, key: str) -> Media:
+        """
+        get the size and content type of stored media
+        :param key: content hash
+        :return: Media or None if it is not stored
+        """
+        if not valid(key):
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                head = f.read(16)
+                f.seek(0, os.SEEK_END)
+                return Media(key, f.tell(), sniff(head))
+        except FileNotFoundError:
+            return None
+
+    def open(self, key: str):
+        """
+        open stored media for reading, so servers that support it can send the file without copying it
+        :param key: content hash
+        :return: file opened for binary reading
+        """
+        return open(self.path(key), 'rb')
+
+    def read(self, key: str, start: int = 0, stop: int = None):
+        """
+        read stored media in chunks
+        :param key: content hash
+        :param start: first byte
+        :param stop: byte after the last byte, the end of the data if not set
+        :return: generator of chunks of bytes
+        """
+        return read_file(self.path(key), start, stop)
+
+
+class CollectionMediaStore(object):
+    """
+    Media stored as base64 in the media collection keyed by their content hash
+    """
+    def __init__(self, db: StandardDatabase = None):
+        """
+        :param db: connection, the process wide connection if not set
+        """
+        self._db = db
+
+    def db(self):
+        return self._db or get_db()
+
+    def put(self, data: bytes) -> Media:
+        media = Media(digest(data), len(data), sniff(data))
+        collection = self.db().collection('media')
+        if collection.has(media.key):
+            return media
+        try:
+            collection.insert({'_key': media.key, 'size': media.size, 'content_type': media.content_type,
+                               'data': encode_blob(data)}, overwrite=True, silent=True)
+        except ArangoError as e:
+            raise MediaStateException(f'could not store media {media.key}: {e}')
+        logger.debug(f'stored {repr(media)} of {media.size} bytes')
+        return media
+
+    def put_file(self, source) -> Media:
+        return self.put(source.read())
+
+    def stat(self, key: str) -> Media:
+        if not valid(key):
+            return None
+        result = next(self.db().aql.execute(STAT_QUERY, bind_vars={'key': key}), None)
+        return Media(key, result['size'], result['content_type']) if result else None
+
+    def read(self, key: str, start: int = 0, stop: int = None):
+        document = self.db().collection('media').get(key)
+        if not document:
+            raise MediaStateException(f'media {key} not found')
+        data = decode_blob(document['data'])
+        stop = len(data) if stop is None else stop
+        for offset in range(start, stop, CHUNK_SIZE):
+            yield data[offset:min(offset + CHUNK_SIZE, stop)]
+
+
+def media_store(db: StandardDatabase = None):
+    """
+    the media store configured by MEDIA_STORE, the file store is shared by the process
+    :param db: connection for the collection store, the process wide connection if not set
+    :return: FileMediaStore or CollectionMediaStore
+    """
+    global file_store
+    kind = os.getenv('MEDIA_STORE', FILESYSTEM)
+    if kind == COLLECTION:
+        return CollectionMediaStore(db)
+    if kind != FILESYSTEM:
+        raise ValueError(f'unknown media store {kind}, expected {FILESYSTEM} or {COLLECTION}')
+    with store_lock:
+        if not file_store:
+            file_store = FileMediaStore(os.getenv('MEDIA_PATH', 'media'))
+        return file_store
+
+
+def reference(store, data):
+    """
+    store binary data and return its reference, anything else is returned as is
+    :param store: media store
+    :param data: binary data, a binary file, Media or None
+    :return: Media or the value
+    """
+    if isinstance(data, (bytes, bytearray)) and data:
+        return store.put(bytes(data))
+    if hasattr(data, 'read'):
+        return store.put_file(data)
+    return data
+
+
+def externalize(store, game: Game) -> int:
+    """
+    move the game image, NPC images, level icons, video fragments and task media of a game into the media store,
+    the game is changed in place to hold references
+    :param store: media store
+    :param game: game about to be published
+    :return: number of references
+    """
+    if game.frozen:
+        raise MediaStateException(f'game {game.title} is read-only')
+    count = 0
+
+    def ref(data):
+        nonlocal count
+        result = reference(store, data)
+        count += isinstance(result, Media)
+        return result
+
+    game.image = ref(game.image)
+    tasks = []
+    for waypoint in game.graph.nodes:
+        if waypoint.level:
+            waypoint.level.icon = ref(waypoint.level.icon)
+        if isinstance(waypoint, Video):
+            waypoint.fragment = ref(waypoint.fragment)
+        tasks += waypoint.tasks
+    for npc in game.npcs:
+        npc.image = ref(npc.image)
+        tasks += [i.task for i in npc.dialog.graph.nodes if i.task]
+    for task in tasks:
+        task.media = ref(task.media)
+    return count
+
+
+def migrate(db: StandardDatabase, store=None) -> int:
+    """
+    move the inline base64 data of published games into the media store, safe to run more than once
+    :param db: connection
+    :param store: media store, the configured store if not set
+    :return: number of documents rewritten
+    """
+    store = store or media_store(db)
+    count = 0
+    for name, field in INLINE_FIELDS:
+        collection = db.collection(name)
+        for document in collection:
+            value = document.get(field)
+            if field == 'level':
+                if not isinstance(value, dict) or not value.get('icon'):
+                    continue
+                icon = decode_blob(value['icon'])
+                if isinstance(icon, Media):
+                    continue
+                update = {'level': dict(value, icon=str(store.put(icon)))}
+            else:
+                data = decode_blob(value) if isinstance(value, str) else None
+                if not data or isinstance(data, Media):
+                    continue
+                update = {field: str(store.put(data))}
+            collection.update(dict(update, _key=document['_key']))
+            count += 1
+    logger.info(f'moved inline media of {count} documents to the media store')
+    return count
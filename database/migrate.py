@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import logging
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database.connection import get_db, shutdown
+from database.instance import migrate as migrate_instances
+from database.media import migrate as migrate_media
+from database.player import migrate as migrate_players
+from database.schema import initialize
+
+logger = logging.getLogger('database.migrate')
+
+
+def main():
+    """
+    create the collections and indexes, move player tokens to their own collection, migrate stored documents to the
+    current codec version and move inline media to the media store, safe to run more than once
+    """
+    try:
+        initialize(get_db())
+        migrate_players(get_db())
+        migrate_media(get_db())
+        migrate_instances(get_db())
+    finally:
+        shutdown()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -2,41 +2,117 @@
 # -*- coding: utf-8 -*-#
 
 import hashlib
+import hmac
 import binascii
 import logging
+import os
+from threading import Lock
+from time import time
 from uuid import UUID
 
 from arango.database import StandardDatabase
+from arango.exceptions import DocumentInsertError, DocumentUpdateError
+from jose import jwt, JWTError
 
 from model.player import Player, PlayerStateException
+from util.executor import BoundedExecutor
 
 
-logger = logging.getLogger('database.instance')
+logger = logging.getLogger('database.player')
 
+UNIQUE_CONSTRAINT_VIOLATED = 1210
 
-def hash_password(password, salt) -> str:
+PASSWORD_ALGORITHM = 'pbkdf2_sha512'
+LEGACY_ITERATIONS = 100000
+LEGACY_SALT_LENGTH = 64
+
+executor = None
+executor_lock = Lock()
+
+
+class PlayerExistsException(PlayerStateException):
+    pass
+
+
+def password_executor() -> BoundedExecutor:
+    """
+    executor that runs password hashing off the request loop, created on first use
+    :return: executor
+    """
+    global executor
+    with executor_lock:
+        if not executor:
+            executor = BoundedExecutor(int(os.getenv('HASH_WORKERS', 4)),
+                                       int(os.getenv('HASH_QUEUE_LIMIT', 32)),
+                                       float(os.getenv('HASH_QUEUE_TIMEOUT', 5)))
+        return executor
+
+
+def password_iterations() -> int:
+    """
+    configured PBKDF2 work factor
+    :return: number of iterations
+    """
+    return int(os.getenv('PASSWORD_ITERATIONS', LEGACY_ITERATIONS))
+
+
+def hash_password(password, salt, iterations: int = None) -> str:
     """
     Hash a password for storing.
     :param password: target for encryption
     :param salt: encryption salt
-    :return hashed password
+    :param iterations: work factor, defaults to PASSWORD_ITERATIONS
+    :return hashed password as algorithm$iterations$salt$hash
+    """
+    iterations = iterations or password_iterations()
+    salt = hashlib.sha256(salt.encode()).hexdigest()
+    password_hash = binascii.hexlify(hashlib.pbkdf2_hmac('sha512', password.encode('utf-8'), salt.encode('ascii'), iterations))
+    return f"{PASSWORD_ALGORITHM}${iterations}${salt}${password_hash.decode('ascii')}"
+
+
+def parse_password(stored_password) -> (int, str, str):
+    """
+    split a stored password in its parts, passwords stored without parameters are salt followed by hash
+    :param stored_password: password that was already hashed
+    :return: iterations, salt, hash
     """
-    salt = hashlib.sha256(salt.encode()).hexdigest().encode('ascii')
-    password_hash = binascii.hexlify(hashlib.pbkdf2_hmac('sha512', password.encode('utf-8'), salt, 100000))
-    return (salt + password_hash).decode('ascii')
+    if stored_password.startswith(f'{PASSWORD_ALGORITHM}$'):
+        _, iterations, salt, password_hash = stored_password.split('$')
+        return int(iterations), salt, password_hash
+    return LEGACY_ITERATIONS, stored_password[:LEGACY_SALT_LENGTH], stored_password[LEGACY_SALT_LENGTH:]
 
 
-def verify_password(stored_password, provided_password, salt):
+def verify_password(stored_password, provided_password) -> bool:
     """
     Verify a stored password against one provided by user
     :param stored_password: password that was already hashed
     :param provided_password: clear text password to compare
     :return bool
     """
-    salt = stored_password[:len(salt)]
-    stored_password = stored_password[len(salt):]
-    password_hash = binascii.hexlify(hashlib.pbkdf2_hmac('sha512', provided_password.encode('utf-8'), salt.encode('ascii'), 100000))
-    return password_hash == stored_password
+    iterations, salt, stored_hash = parse_password(stored_password)
+    password_hash = binascii.hexlify(hashlib.pbkdf2_hmac('sha512', provided_password.encode('utf-8'), salt.encode('ascii'), iterations))
+    return hmac.compare_digest(password_hash.decode('ascii'), stored_hash)
+
+
+def needs_rehash(stored_password) -> bool:
+    """
+    check if a stored password was hashed with other parameters than the configured ones
+    :param stored_password: password that was already hashed
+    :return: bool
+    """
+    return not stored_password.startswith(f'{PASSWORD_ALGORITHM}$') or \
+        parse_password(stored_password)[0] != password_iterations()
+
+
+def find_by_mail(db: StandardDatabase, email):
+    """
+    find a player document using the unique index on mail
+    :param db: connection
+    :param email: mail
+    :return: player document or None
+    """
+    cursor = db.aql.execute('FOR p IN players FILTER p.mail == @mail LIMIT 1 RETURN p', bind_vars={'mail': email})
+    return next(cursor, None)
 
 
 def authenticate(db: StandardDatabase, email, password, salt):
@@ -48,38 +124,47 @@ def authenticate(db: StandardDatabase, email, password, salt):
     :param salt: encryption salt
     :return: Player or None
     """
-    if not db.has_collection('players'):
-        logger.warning('cannot authenticate: no players defined')
-        return None
-    col = db.collection('players')
-    db_player = next(col.find({'mail': email}), None)
+    db_player = find_by_mail(db, email)
     if not db_player:
         logger.warning(f'could not find player {email}')
         return None
-    if verify_password(db_player['password'], hash_password(password, salt), salt):
+    if password_executor().run(verify_password, db_player['password'], password):
+        if needs_rehash(db_player['password']):
+            logger.info(f'rehashing password for {email}')
+            db_player['password'] = password_executor().run(hash_password, password, salt)
+            db.collection('players').update({'_key': db_player['_key'], 'password': db_player['password']})
         player = Player(db_player['mail'], '')
         player.id = UUID(db_player['_key'])
         player.password = db_player['password']
         return player
 
 
-def add_token(db: StandardDatabase, email, token):
+def token_key(token) -> str:
+    """
+    key of a token document, tokens are stored by their hash
+    :param token: jwt token
+    :return: sha256 hex digest of the token
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def add_token(db: StandardDatabase, email, token, expires_at: int = None):
     """
     add a token to a player
     :param db: connection
     :param email: mail
     :param token: jwt token
+    :param expires_at: unix timestamp after which the token is removed
     """
-    if not db.has_collection('players'):
-        logger.error('cannot add token if players do not exist')
-        raise PlayerStateException('players collection does not exist')
-    col = db.collection('players')
-    db_player = next(col.find({'mail': email}), None)
+    db_player = find_by_mail(db, email)
     if not db_player:
         logger.error(f'could not resolve player {email}')
         raise PlayerStateException(f'player {email} does not exist')
-    db_player['tokens'].append(token)
-    col.update(db_player)
+    db.collection('tokens').insert({
+        '_key': token_key(token),
+        'player': db_player['_key'],
+        'expires_at': expires_at
+    }, overwrite=True)
 
 
 def remove_token(db: StandardDatabase, email, token):
@@ -89,16 +174,11 @@ def remove_token(db: StandardDatabase, email, token):
     :param email: mail
     :param token: jwt token
     """
-    if not db.has_collection('players'):
-        logger.error('cannot remove token if players do not exist')
-        raise PlayerStateException('players collection does not exist')
-    col = db.collection('players')
-    db_player = next(col.find({'mail': email}), None)
+    db_player = find_by_mail(db, email)
     if not db_player:
         logger.error(f'could not resolve player {email}')
         raise PlayerStateException(f'player {email} does not exist')
-    db_player['tokens'].remove(token)
-    col.update(db_player)
+    db.collection('tokens').delete(token_key(token), ignore_missing=True)
 
 
 def validate(db: StandardDatabase, token, email=None):
@@ -109,28 +189,47 @@ def validate(db: StandardDatabase, token, email=None):
     :param email: mail
     :return Player or None
     """
-    if not db.has_collection('players'):
-        logger.error('cannot validate token if players do not exist')
-        raise PlayerStateException('players collection does not exist')
-    col = db.collection('players')
-    if email:
-        db_player = next(col.find({'mail': email}), None)
-        if not db_player:
-            logger.error(f'could not resolve player {email}')
-            raise PlayerStateException(f'player {email} does not exist')
-        if token in db_player['tokens']:
-            player = Player(db_player['mail'], '')
-            player.id = UUID(db_player['_key'])
-            player.password = db_player['password']
-            return player
-    else:
-        for db_player in col.all():
-            if 'tokens' in db_player and token in db_player['tokens']:
-                player = Player(db_player['mail'], '')
-                player.id = UUID(db_player['_key'])
-                player.password = db_player['password']
-                return player
-    return None
+    db_token = db.collection('tokens').get(token_key(token))
+    if not db_token:
+        return None
+    db_player = db.collection('players').get(db_token['player'])
+    if not db_player:
+        logger.warning(f"token for unknown player {db_token['player']}")
+        return None
+    if email and db_player['mail'] != email:
+        return None
+    player = Player(db_player['mail'], '')
+    player.id = UUID(db_player['_key'])
+    player.password = db_player['password']
+    return player
+
+
+def migrate(db: StandardDatabase) -> int:
+    """
+    move the tokens kept in player documents by earlier versions to the tokens collection, expired tokens are
+    dropped, safe to run more than once
+    :param db: connection
+    :return: number of moved tokens
+    """
+    count = 0
+    now = time()
+    for db_player in db.aql.execute('FOR p IN players FILTER p.tokens != null RETURN p'):
+        documents = []
+        for token in db_player['tokens'] or []:
+            try:
+                expires_at = jwt.get_unverified_claims(token).get('exp')
+            except JWTError as e:
+                logger.warning(f"dropping unreadable token of player {db_player['_key']}: {e}")
+                continue
+            if expires_at is not None and expires_at <= now:
+                continue
+            documents.append({'_key': token_key(token), 'player': db_player['_key'], 'expires_at': expires_at})
+        if documents:
+            db.collection('tokens').insert_many(documents, overwrite=True)
+        db.collection('players').update({'_key': db_player['_key'], 'tokens': None}, keep_none=False)
+        count += len(documents)
+    logger.info(f'moved {count} tokens from player documents to the tokens collection')
+    return count
 
 
 def create(db: StandardDatabase, email, password, salt) -> Player:
@@ -142,12 +241,15 @@ def create(db: StandardDatabase, email, password, salt) -> Player:
     :param salt: encryption salt
     :return: Player
     """
-    if not db.has_collection('players'):
-        logger.info('creating collection players')
-        db.create_collection('players')
-    player = Player(email, hash_password(password, salt))
+    player = Player(email, password_executor().run(hash_password, password, salt))
     col = db.collection('players')
-    col.insert({'_key': player.id.hex, 'mail': player.email, 'password': player.password, 'tokens': []})
+    try:
+        col.insert({'_key': player.id.hex, 'mail': player.email, 'password': player.password})
+    except DocumentInsertError as e:
+        if e.error_code == UNIQUE_CONSTRAINT_VIOLATED:
+            logger.warning(f'player already registered under {email}')
+            raise PlayerExistsException(f'player already registered under {email}')
+        raise
     return player
 
 
@@ -158,27 +260,13 @@ def read(db: StandardDatabase, player_id):
     :param player_id: id
     :return: Player or None
     """
-    if not db.has_collection('players'):
-        logger.error('cannot resolve player if players do not exist')
-        raise PlayerStateException('players collection does not exist')
     col = db.collection('players')
-    db_player = next(col.find({'_key': player_id}), None)
+    db_player = col.get(player_id)
     if not db_player:
         return None
-    return Player(db_player['email'], db_player['password'])
-
-
-def get_all_player_emails(db: StandardDatabase) -> [str]:
-    """
-    return all player email addresses
-    :param db: connection
-    :return: list of known mail addresses
-    """
-    if not db.has_collection('players'):
-        logger.error('cannot resolve player if players do not exist')
-        raise PlayerStateException('players collection does not exist')
-    col = db.collection('players')
-    return [p['mail'] for p in col.all()]
+    player = Player(db_player['mail'], db_player['password'])
+    player.id = UUID(db_player['_key'])
+    return player
 
 
 def update(db: StandardDatabase, player: Player, salt, email: str = None, password: str = None, tokens: [str] = None) -> Player:
@@ -192,39 +280,43 @@ def update(db: StandardDatabase, player: Player, salt, email: str = None, passwo
     :param tokens: non-expired tokens for player
     :return: Player
     """
-    if not db.has_collection('players'):
-        logger.error('cannot resolve player if players do not exist')
-        raise PlayerStateException('players collection does not exist')
     col = db.collection('players')
-    db_player = next(col.find({'mail': player.email}), None)
+    db_player = find_by_mail(db, player.email)
     if not db_player:
         logger.error(f'cannot find player {player.email}')
         raise PlayerStateException(f'could not find player {player.email}')
     if email and password:
-        player = Player(email, hash_password(password, salt))
+        player = Player(email, password_executor().run(hash_password, password, salt))
     elif email:
         player = Player(email, db_player['password'])
     elif password:
-        player = Player(db_player['mail'], hash_password(password, salt))
+        player = Player(db_player['mail'], password_executor().run(hash_password, password, salt))
     else:
         player = Player(db_player['mail'], db_player['password'])
     player.id = UUID(db_player['_key'])
-    col.update({'_key': player.id.hex, 'mail': player.email, 'password': player.password})
+    try:
+        col.update({'_key': player.id.hex, 'mail': player.email, 'password': player.password})
+    except DocumentUpdateError as e:
+        if e.error_code == UNIQUE_CONSTRAINT_VIOLATED:
+            logger.warning(f'player already registered under {player.email}')
+            raise PlayerExistsException(f'player already registered under {player.email}')
+        raise
     return player
 
 
 def delete(db: StandardDatabase, player: Player):
     """
-    remove existing player
+    remove existing player and their tokens
     :param db: connection
     :param player: target
+    :return: removed token documents
     """
-    if not db.has_collection('players'):
-        logger.error('cannot remove player if players do not exist')
-        raise PlayerStateException(f'players collection does not exist')
     col = db.collection('players')
-    db_player = next(col.find({'mail': player.email}), None)
+    db_player = find_by_mail(db, player.email)
     if not db_player:
         logger.error(f'cannot find player {player.email}')
         raise PlayerStateException(f'could not find player {player.email}')
+    tokens = list(db.aql.execute('FOR t IN tokens FILTER t.player == @player REMOVE t IN tokens RETURN OLD',
+                                 bind_vars={'player': db_player['_key']}))
     col.delete(db_player)
+    return tokens
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import logging
+
+from arango.database import StandardDatabase
+
+
+logger = logging.getLogger('database.schema')
+
+
+# collections with their indexes as (type, fields, options)
+COLLECTIONS = {
+    'games': [],
+    'waypoints': [],
+    'path': [],
+    'dialogs': [],
+    'interactions': [],
+    'conversation': [],
+    'npcs': [
+        ('persistent', ['game'], {})
+    ],
+    'tasks': [
+        ('persistent', ['for'], {})
+    ],
+    'players': [
+        ('persistent', ['mail'], {'unique': True})
+    ],
+    'instances': [
+        ('persistent', ['player_ids[*]'], {}),
+        ('persistent', ['game_master_id'], {'sparse': True})
+    ],
+    'snapshots': [
+        ('persistent', ['instance', 'player_id', 'seq'], {'unique': True})
+    ],
+    'events': [
+        ('persistent', ['instance', 'seq'], {'unique': True}),
+        ('persistent', ['instance', 'player', 'seq'], {})
+    ],
+    'media': [],
+    'tokens': [
+        ('ttl', ['expires_at'], {'expiry_time': 0}),
+        ('persistent', ['player'], {})
+    ]
+}
+
+# collections holding graph edges
+EDGE_COLLECTIONS = ['path', 'conversation']
+
+
+def initialize(db: StandardDatabase):
+    """
+    make sure all collections and their indexes exist, this is run by the migration before the server starts
+    creating an index that already exists is a no-op in ArangoDB
+    :param db: connection
+    """
+    for name, indexes in COLLECTIONS.items():
+        if not db.has_collection(name):
+            logger.info(f'creating collection {name}')
+            db.create_collection(name, edge=name in EDGE_COLLECTIONS)
+        col = db.collection(name)
+        for index_type, fields, options in indexes:
+            logger.debug(f'ensuring {index_type} index on {name} {fields}')
+            if index_type == 'persistent':
+                col.add_persistent_index(fields=fields, unique=options.get('unique'), sparse=options.get('sparse'))
+            elif index_type == 'ttl':
+                col.add_ttl_index(fields=fields, expiry_time=options['expiry_time'])
+            else:
+                raise ValueError(f'unknown index type {index_type} for {name}')
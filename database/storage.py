@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import logging
+import os
+
+from util.coder import Serializer, serializer, encode, decode, encode_blob, decode_blob, CODEC_VERSION
+
+
+logger = logging.getLogger('database.storage')
+
+# serialization format of collections that store complete objects, e.g. STORAGE_FORMATS=instances:msgpack
+# collections that are not listed are stored as json documents
+STORAGE_FORMATS = dict(f.split(':', 1) for f in os.getenv('STORAGE_FORMATS', '').split(',') if f)
+
+
+def storage_format(collection: str) -> Serializer:
+    """
+    get the serialization format for a collection
+    :param collection: collection name
+    :return: serializer
+    """
+    return serializer(STORAGE_FORMATS.get(collection, 'json'))
+
+
+def pack(collection: str, o, key: str = None) -> dict:
+    """
+    encode an object to a document in the storage format of the collection, documents in a binary format
+    keep the key, codec version and format as fields and hold the serialized object in a single data field
+    :param collection: collection name
+    :param o: object to store
+    :param key: document key, defaults to the id of the object
+    :return: document
+    """
+    fmt = storage_format(collection)
+    if fmt.name == 'json':
+        result = encode(o)
+        if key:
+            result['_key'] = key
+        return result
+    return {
+        '_key': key or o.id.hex,
+        '_v': CODEC_VERSION,
+        '_format': fmt.name,
+        'data': encode_blob(fmt.dumps(o))
+    }
+
+
+def unpack(document: dict):
+    """
+    decode a document in any storage format
+    :param document: document from the database
+    :return: decoded object
+    """
+    if '_format' in document:
+        return serializer(document['_format']).loads(decode_blob(document['data']))
+    return decode(document)
@@ -4,6 +4,7 @@
 import model.game
 import model.player
 import model.instance
+import model.media
 import model.task
 import model.component
 import model.dialog
@@ -39,6 +39,10 @@ class Image(Waypoint):
 
 
 class Video(Waypoint):
+    """
+    Waypoint showing a video fragment, the fragment is kept in the media store and the waypoint only holds its
+    reference so games with video cost no more memory than games with text
+    """
     def __init__(self,
                  graph: nx.DiGraph,
                  title: str,
@@ -48,10 +52,24 @@ class Video(Waypoint):
                  time_limit: float = None,
                  money_limit: float = None,
                  timer_visible: bool = None,
-                 level: Level = None):
-        super().__init__(graph, title, description, time_limit, money_limit, timer_visible, level)
-        self.video = fragment
+                 level: Level = None,
+                 *,
+                 budget_modification: float = None,
+                 items=None,
+                 duration: float = None):
+        """
+        the positional parameters are those of earlier versions, later ones are keyword only
+        :param fragment: Media reference, or binary data or a binary file until the game is published
+        :param caption: caption shown with the video
+        :param budget_modification: modify budget if waypoint is reached
+        :param items: items to add to inventory if waypoint is reached
+        :param duration: length of the video in seconds
+        """
+        super().__init__(graph, title, description, time_limit, money_limit, budget_modification, items,
+                         timer_visible, level)
+        self.fragment = fragment
         self.caption = caption
+        self.duration = duration
 
 
 class Audio(Waypoint):
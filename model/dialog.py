@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
 
+from datetime import timedelta
+from math import isclose
+from threading import RLock
 from uuid import uuid4
 
 import networkx as nx
@@ -8,6 +11,46 @@ import networkx as nx
 from model.task import Task
 
 
+# graph attribute holding the compiled transition table of a dialog graph
+TRANSITIONS = 'transitions'
+# graph attribute marking a dialog or game graph as read-only, set on graphs shared between requests
+FROZEN = 'frozen'
+# graph attribute holding the graphs and attributes of tables compiled from a dialog graph, like game move tables
+DEPENDENTS = 'dependents'
+
+# compiled tables of shared graphs are built once
+compile_lock = RLock()
+
+
+class DialogGraphException(Exception):
+    pass
+
+
+def depend(graph: nx.DiGraph, dependent: nx.DiGraph, key: str):
+    """
+    drop a table compiled from a dialog graph together with the transition table of the dialog
+    :param graph: dialog graph
+    :param dependent: graph holding the compiled table
+    :param key: graph attribute of the compiled table
+    """
+    dependents = graph.graph.setdefault(DEPENDENTS, [])
+    if not any(g is dependent and k == key for g, k in dependents):
+        dependents.append((dependent, key))
+
+
+def invalidate(graph: nx.DiGraph):
+    """
+    drop the compiled transition table of a dialog graph and the tables compiled from it, they are compiled again
+    on next use
+    :param graph: dialog graph
+    """
+    if graph.graph.get(FROZEN):
+        raise DialogGraphException('dialog is read-only')
+    graph.graph.pop(TRANSITIONS, None)
+    for dependent, key in graph.graph.pop(DEPENDENTS, []):
+        dependent.graph.pop(key, None)
+
+
 class Interaction(object):
     """
     Interaction between player and npc, the idea is that interactions can have waypoints associated with them,
@@ -67,12 +110,15 @@ class Interaction(object):
         :param interaction: the follow up
         :param waypoints: only available at a given waypoints
         """
+        if self.graph.graph.get(FROZEN):
+            raise DialogGraphException(f'dialog of {self} is read-only')
         self.graph.add_edge(self, interaction)
         if waypoints and isinstance(waypoints, list):
             for waypoint in waypoints:
                 self.waypoints.append(waypoint)
         elif waypoints:
             self.waypoints.append(waypoints)
+        invalidate(self.graph)
 
     def follow_ups(self, waypoint=None):
         """
@@ -133,6 +179,51 @@ class Mail(Interaction):
         self.body = body
 
 
+class DialogTable(object):
+    """
+    Compiled transitions of a dialog graph, so finding the next interaction costs O(out-degree)
+    """
+    def __init__(self, graph: nx.DiGraph):
+        """
+        compile the gated follow ups of every interaction, a transition is a tuple of
+        (follow up, waypoint ids or None, money limit or None, time limit or None, task or None)
+        :param graph: dialog graph
+        """
+        # interaction by id
+        self.interactions = {}
+        # transitions by interaction id, in graph order
+        self.transitions = {}
+        # ids of the waypoints any follow up is bound to
+        self.waypoints = set()
+        # whether any follow up is available regardless of waypoint
+        self.roaming = False
+        for interaction in graph.nodes:
+            self.interactions[interaction.id] = interaction
+            transitions = []
+            for successor in graph.successors(interaction):
+                waypoints = frozenset(getattr(w, 'id', w) for w in successor.waypoints) or None
+                if waypoints:
+                    self.waypoints.update(waypoints)
+                else:
+                    self.roaming = True
+                transitions.append((
+                    successor,
+                    waypoints,
+                    None if isclose(successor.money_limit, 0.0) else successor.money_limit,
+                    None if isclose(successor.time_limit, 0.0) else timedelta(seconds=successor.time_limit),
+                    successor.task
+                ))
+            self.transitions[interaction.id] = tuple(transitions)
+
+    def interaction(self, position):
+        """
+        find the interaction of the graph for a dialog position
+        :param position: interaction (or id)
+        :return: interaction or None
+        """
+        return self.interactions.get(getattr(position, 'id', position))
+
+
 class Dialog(object):
     """
     Main container for dialogs between a player and a NPC
@@ -163,3 +254,24 @@ class Dialog(object):
         :return: bool
         """
         return self.start is not None
+
+    def transitions(self) -> DialogTable:
+        """
+        compiled transition table of the dialog graph, compiled on first use and again after add_follow_up,
+        call invalidate after changing interaction waypoints, limits or tasks directly
+        :return: DialogTable
+        """
+        table = self.graph.graph.get(TRANSITIONS)
+        if table is None:
+            with compile_lock:
+                table = self.graph.graph.get(TRANSITIONS)
+                if table is None:
+                    table = DialogTable(self.graph)
+                    self.graph.graph[TRANSITIONS] = table
+        return table
+
+    def invalidate(self):
+        """
+        drop the compiled transition table and the move tables of games compiled from it
+        """
+        invalidate(self.graph)
@@ -1,14 +1,65 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
 
+import sys
+from array import array
 from uuid import uuid4
 
 import networkx as nx
 
+from model.dialog import FROZEN, compile_lock, depend
 from model.instance import GameInstance
 from model.player import NonPlayableCharacter
 
 
+# graph attributes holding the compiled move table and reachability analysis of a game graph
+MOVES = 'moves'
+REACHABILITY = 'reachability'
+UNBLOCKED = frozenset()
+# reachable sets are dropped (and answered by traversal) when all bitmaps together exceed this many bits
+MAX_REACH_BITS = 512 * 1024 * 1024
+FULL_WORD = (1 << 64) - 1
+
+
+class GameGraphException(Exception):
+    pass
+
+
+def writable(graph: nx.DiGraph):
+    """
+    make sure a game graph can be changed
+    :param graph: game graph
+    """
+    if graph.graph.get(FROZEN):
+        raise GameGraphException('game graph is read-only')
+
+
+def invalidate(graph: nx.DiGraph):
+    """
+    drop the compiled move table and reachability analysis of a game graph, they are compiled again on next use
+    :param graph: game graph
+    """
+    writable(graph)
+    graph.graph.pop(MOVES, None)
+    graph.graph.pop(REACHABILITY, None)
+
+
+def reachability(graph: nx.DiGraph):
+    """
+    reachability analysis of a game graph, compiled on first use
+    :param graph: game graph
+    :return: Reachability
+    """
+    analysis = graph.graph.get(REACHABILITY)
+    if analysis is None:
+        with compile_lock:
+            analysis = graph.graph.get(REACHABILITY)
+            if analysis is None:
+                analysis = Reachability(graph)
+                graph.graph[REACHABILITY] = analysis
+    return analysis
+
+
 class Level(object):
     def __init__(self, title: str, icon=None):
         """
@@ -83,43 +134,312 @@ class Waypoint(object):
         :param waypoint: destination
         :param weight: potential edge weight
         """
+        writable(self.graph)
         if not weight:
             self.graph.add_edge(self, waypoint)
         else:
             self.graph.add_edge(self, waypoint, weight=weight)
+        invalidate(self.graph)
 
     def add_task(self, task):
         """
         add a task
         :param task: task that needs to be solved for this waypoint
         """
+        writable(self.graph)
         if task.destination:
             self.graph.add_edge(self, task.destination)
         self.tasks.append(task)
+        invalidate(self.graph)
 
     def add_interaction(self, interaction):
         """
         add an interaction
         :param interaction: specific interaction with NPC
         """
+        writable(self.graph)
         if interaction.destination:
             self.graph.add_edge(self, interaction.destination)
         self.interactions.append(interaction)
+        invalidate(self.graph)
 
     def all_path_nodes(self):
         """
         return all possible waypoints from here
-        :return: list of waypoints
+        :return: list of waypoints in topological order, starting with this one
         """
-        return nx.dfs_tree(self.graph, self)
+        return reachability(self.graph).reachable(self)
 
     def is_finish(self) -> bool:
         """
         A finish is defined as a Waypoint without destinations
         """
-        if len(list(self.graph.successors(self))) == 0:
-            return True
-        return False
+        return self.graph.out_degree(self) == 0
+
+
+class MoveTable(object):
+    """
+    Compiled moves of a game graph, so a move check costs O(out-degree) instead of scanning the graph
+    """
+    def __init__(self, graph: nx.DiGraph, npcs=()):
+        """
+        compile the successors, edge weights and blocked destinations for every waypoint, and which NPCs can
+        continue their dialog at a waypoint
+        :param graph: game graph
+        :param npcs: non-playable characters of the game
+        """
+        # waypoint by id
+        self.waypoints = {}
+        # successor waypoint -> edge weight (or None) by waypoint id, in graph order
+        self.successors = {}
+        # destinations that only become available through a task or an interaction, by waypoint id
+        self.blocked = {}
+        # tasks and interactions that lead to a destination, by waypoint id
+        self.tasks = {}
+        self.interactions = {}
+        for waypoint, adjacent in graph.adjacency():
+            key = waypoint.id
+            self.waypoints[key] = waypoint
+            self.successors[key] = {s: data.get('weight') for s, data in adjacent.items()}
+            tasks = tuple(t for t in waypoint.tasks if t.destination) if waypoint.tasks else ()
+            interactions = tuple(i for i in waypoint.interactions if i.destination) if waypoint.interactions else ()
+            self.tasks[key] = tasks
+            self.interactions[key] = interactions
+            self.blocked[key] = frozenset([t.destination for t in tasks] + [i.destination for i in interactions]) \
+                if tasks or interactions else UNBLOCKED
+        # NPCs with a follow up bound to a waypoint, by waypoint id, and NPCs with follow ups bound to none
+        self.listeners = {}
+        self.roaming = set()
+        for npc in npcs:
+            dialog = npc.dialog.transitions()
+            for waypoint in dialog.waypoints:
+                self.listeners.setdefault(waypoint, set()).add(npc)
+            if dialog.roaming:
+                self.roaming.add(npc)
+
+    def waypoint(self, position):
+        """
+        find the waypoint of the graph for a position
+        :param position: waypoint (or id)
+        :return: waypoint or None
+        """
+        return self.waypoints.get(getattr(position, 'id', position))
+
+    def weight(self, source, destination):
+        """
+        weight of the edge between two waypoints
+        :param source: source waypoint
+        :param destination: destination waypoint
+        :return: weight, None if the edge has no weight or does not exist
+        """
+        return self.successors.get(source.id, {}).get(destination)
+
+    def npcs(self, waypoint) -> set:
+        """
+        NPCs that may have a follow up interaction when a player reaches a waypoint
+        :param waypoint: reached waypoint
+        :return: set of NPCs
+        """
+        return self.roaming.union(self.listeners.get(waypoint.id, ()))
+
+
+class Reachability(object):
+    """
+    Analysis of a game graph: a topological order, the waypoints reachable from every waypoint and the energy and
+    moves left to reach a finish, so path and finish checks are lookups instead of graph traversals
+    """
+    def __init__(self, graph: nx.DiGraph):
+        """
+        analyse the graph in a single pass in reverse topological order; the order is a reversed depth first
+        post-order, which keeps the waypoints below a waypoint close together so every reachable set is stored as
+        a bitmap relative to the position of its waypoint
+        :param graph: game graph, must be acyclic
+        """
+        self.graph = graph
+        adjacency = list(graph.adjacency())
+        # successors as (position, weight) by position in graph order, positions avoid hashing waypoints
+        position = {id(w): n for n, (w, _) in enumerate(adjacency)}
+        successors = [[(position[id(s)], data.get('weight') or 0.0) for s, data in adjacent.items()]
+                      for _, adjacent in adjacency]
+        postorder = []
+        # 0 not visited, 1 on the depth first stack, 2 done
+        visited = [0] * len(adjacency)
+        for root in range(len(adjacency)):
+            if visited[root]:
+                continue
+            visited[root] = 1
+            stack = [(root, iter(successors[root]))]
+            while stack:
+                node, children = stack[-1]
+                for child, _ in children:
+                    if visited[child] == 1:
+                        raise GameGraphException(f'{repr(adjacency[node][0])} and {repr(adjacency[child][0])} '
+                                                 f'are on a cycle')
+                    if not visited[child]:
+                        visited[child] = 1
+                        stack.append((child, iter(successors[child])))
+                        break
+                else:
+                    stack.pop()
+                    visited[node] = 2
+                    postorder.append(node)
+        count = len(postorder)
+        rank = [0] * count
+        for i, node in enumerate(postorder):
+            rank[node] = count - 1 - i
+        # waypoints in topological order, and the position of a waypoint in it by id
+        self.order = [adjacency[node][0] for node in reversed(postorder)]
+        self.index = {w.id: i for i, w in enumerate(self.order)}
+        # waypoints without destinations
+        self.finishes = frozenset(adjacency[node][0] for node in postorder if not successors[node])
+        # by position: bitmap of reachable waypoints where bit n is the waypoint n positions further in the order,
+        # least and most energy needed, and fewest and most moves, to reach a finish, and the next waypoint on the
+        # way to a finish that takes the least energy (-1 for finishes)
+        self.reach = [0] * count
+        self.cheapest = [-1] * count
+        self.min_energy = [0.0] * count
+        self.max_energy = [0.0] * count
+        self.min_moves = [0] * count
+        self.max_moves = [0] * count
+        reach, min_energy, max_energy, min_moves, max_moves, cheapest = \
+            self.reach, self.min_energy, self.max_energy, self.min_moves, self.max_moves, self.cheapest
+        bits = 0
+        for node in postorder:
+            i = rank[node]
+            if not successors[node]:
+                if reach is not None:
+                    reach[i] = 1
+                continue
+            bitmap = 1
+            low = high = shortest = longest = None
+            for child, weight in successors[node]:
+                j = rank[child]
+                if reach is not None:
+                    bitmap |= reach[j] << (j - i)
+                if low is None or weight + min_energy[j] < low:
+                    low = weight + min_energy[j]
+                    cheapest[i] = j
+                if high is None or weight + max_energy[j] > high:
+                    high = weight + max_energy[j]
+                if shortest is None or min_moves[j] < shortest:
+                    shortest = min_moves[j]
+                if longest is None or max_moves[j] > longest:
+                    longest = max_moves[j]
+            min_energy[i], max_energy[i], min_moves[i], max_moves[i] = low, high, shortest + 1, longest + 1
+            if reach is not None:
+                reach[i] = bitmap
+                bits += bitmap.bit_length()
+                if bits > MAX_REACH_BITS:
+                    reach = self.reach = None
+
+    def reaches(self, source, destination) -> bool:
+        """
+        check if a waypoint can be reached from another waypoint
+        :param source: waypoint
+        :param destination: waypoint
+        :return: bool
+        """
+        i = self.index[source.id]
+        offset = self.index[destination.id] - i
+        if offset < 0:
+            return False
+        if self.reach is None:
+            return nx.has_path(self.graph, source, destination)
+        return bool(self.reach[i] >> offset & 1)
+
+    def reachable(self, waypoint) -> list:
+        """
+        all waypoints that can be reached from a waypoint
+        :param waypoint: waypoint
+        :return: list of waypoints in topological order, starting with the waypoint
+        """
+        i = self.index[waypoint.id]
+        if self.reach is None:
+            return sorted(nx.descendants(self.graph, waypoint) | {waypoint}, key=lambda w: self.index[w.id])
+        # split the bitmap into 64 bit words once and walk only the set bits of each word, lowest first
+        bits = self.reach[i]
+        words = array('Q', bits.to_bytes((bits.bit_length() + 63) // 64 * 8, 'little'))
+        if sys.byteorder == 'big':
+            words.byteswap()
+        result = []
+        for w, word in enumerate(words):
+            position = i + w * 64 - 1
+            if word == FULL_WORD:
+                result.extend(self.order[position + 1:position + 65])
+                continue
+            while word:
+                low = word & -word
+                result.append(self.order[position + low.bit_length()])
+                word ^= low
+        return result
+
+    def can_finish(self, waypoint, energy: float = None) -> bool:
+        """
+        check if a finish can still be reached from a waypoint with the energy that is left
+        :param waypoint: waypoint
+        :param energy: energy left, no energy means energy is not limited
+        :return: bool
+        """
+        return not energy or self.min_energy[self.index[waypoint.id]] <= energy
+
+    def is_safe(self, destination, weight: float = None, energy: float = None) -> bool:
+        """
+        check if a finish can still be reached after moving to a destination
+        :param destination: waypoint to move to
+        :param weight: weight of the path to the destination
+        :param energy: energy left before the move, no energy means energy is not limited
+        :return: bool
+        """
+        return not energy or self.min_energy[self.index[destination.id]] <= energy - (weight or 0.0)
+
+    def safe_moves(self, waypoint, energy: float = None) -> list:
+        """
+        destinations of a waypoint from which a finish can still be reached with the energy left after the move,
+        regardless of tasks and interactions blocking them
+        :param waypoint: waypoint
+        :param energy: energy left, no energy means energy is not limited
+        :return: list of waypoints
+        """
+        return [s for s, data in self.graph.adj[waypoint].items() if self.is_safe(s, data.get('weight'), energy)]
+
+    def route(self, waypoint) -> list:
+        """
+        the way from a waypoint to a finish that takes the least energy
+        :param waypoint: waypoint
+        :return: list of waypoints, starting with the waypoint and ending with a finish
+        """
+        i = self.index[waypoint.id]
+        route = [self.order[i]]
+        while self.cheapest[i] >= 0:
+            i = self.cheapest[i]
+            route.append(self.order[i])
+        return route
+
+    def progress(self, waypoint, moves: int) -> float:
+        """
+        progress towards a finish, taking the shortest way to a finish from here
+        :param waypoint: current waypoint
+        :param moves: number of moves made so far
+        :return: fraction between 0 and 1
+        """
+        remaining = self.min_moves[self.index[waypoint.id]]
+        return moves / (moves + remaining) if remaining else 1.0
+
+    def summary(self, start) -> dict:
+        """
+        analysis of a game from its start, stored with the published game
+        :param start: starting waypoint
+        :return: dict with the number of finishes reachable from the start, the least and most energy and the
+                 fewest and most moves to reach a finish
+        """
+        i = self.index[start.id]
+        return {
+            'finishes': sum(1 for w in self.reachable(start) if w in self.finishes),
+            'min_energy': self.min_energy[i],
+            'max_energy': self.max_energy[i],
+            'min_moves': self.min_moves[i],
+            'max_moves': self.max_moves[i]
+        }
 
 
 class Game(object):
@@ -141,11 +461,58 @@ class Game(object):
         self.energy = energy
         self.npcs = []
 
+    def moves(self) -> MoveTable:
+        """
+        compiled move table of the game graph, compiled on first use and again after waypoints changed through
+        add_destination, add_task or add_interaction, an NPC was added or an NPC dialog was changed through
+        add_follow_up or invalidated, call invalidate after changing tasks or edges directly
+        :return: MoveTable
+        """
+        table = self.graph.graph.get(MOVES)
+        if table is None:
+            with compile_lock:
+                table = self.graph.graph.get(MOVES)
+                if table is None:
+                    table = MoveTable(self.graph, self.npcs)
+                    self.graph.graph[MOVES] = table
+                    # the listeners are compiled from the dialogs, a changed dialog drops the table
+                    for npc in self.npcs:
+                        depend(npc.dialog.graph, self.graph, MOVES)
+        return table
+
+    def reachability(self) -> Reachability:
+        """
+        reachability analysis of the game graph, compiled on first use and again after the graph changed the same
+        way as the move table
+        :return: Reachability
+        """
+        return reachability(self.graph)
+
+    def invalidate(self):
+        """
+        drop the compiled move table and reachability analysis
+        """
+        invalidate(self.graph)
+
+    @property
+    def frozen(self) -> bool:
+        return bool(self.graph.graph.get(FROZEN))
+
+    def freeze(self):
+        """
+        make the game and the dialogs of its NPCs read-only, for games shared between requests; changing the graphs,
+        the start or the NPCs afterwards raises an exception, the compiled tables and the scores of text answers
+        are still built on first use under a lock
+        """
+        for graph in [self.graph] + [npc.dialog.graph for npc in self.npcs]:
+            graph.graph[FROZEN] = True
+
     def set_start(self, waypoint):
         """
         Starting point of the game
         :param waypoint: starting waypoint
         """
+        writable(self.graph)
         self.start = waypoint
 
     def start_is_set(self) -> bool:
@@ -160,7 +527,9 @@ class Game(object):
         add NPC to a multiplayer game
         :param npc: our non-playable character
         """
+        writable(self.graph)
         self.npcs.append(npc)
+        self.invalidate()
 
     def create_new_game(self, name: str = None, game_master=None, starts_at=None, ends_at=None):
         """
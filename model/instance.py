@@ -39,6 +39,10 @@ class GameInstance(object):
         self.ends_at = ends_at
         self.player_states = []
         self.npc_states = [n.create(self) for n in self.game.npcs]
+        # sequence number of the last persisted change, None if the instance has never been saved
+        self.sequence = None
+        # ids of the players with persisted changes after their latest snapshot
+        self.stale = set()
 
     def add_player(self, player: Player, first_name: str, last_name: str):
         """
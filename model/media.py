@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import hashlib
+
+# prefix of media references, base64 encoded data never contains a colon
+PREFIX = 'sha256:'
+
+# content types recognized by the leading bytes of the data
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF', 'application/pdf'),
+    (b'OggS', 'audio/ogg'),
+    (b'ID3', 'audio/mpeg'),
+    (b'\x1aE\xdf\xa3', 'video/webm')
+]
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+
+def digest(data: bytes) -> str:
+    """
+    content hash of binary data
+    :param data: binary data
+    :return: sha256 hex digest
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def sniff(data: bytes) -> str:
+    """
+    guess the content type of binary data from its leading bytes
+    :param data: binary data
+    :return: content type
+    """
+    for signature, content_type in SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:8] == b'ftyp':
+        return 'video/mp4'
+    return DEFAULT_CONTENT_TYPE
+
+
+class Media(object):
+    """
+    Reference to binary data in the media store by its content hash, games hold references instead of the data
+    """
+    def __init__(self, key: str, size: int = None, content_type: str = None):
+        """
+        :param key: sha256 hex digest of the data
+        :param size: size of the data in bytes
+        :param content_type: content type of the data
+        """
+        self.key = key
+        self.size = size
+        self.content_type = content_type
+
+    def __eq__(self, other):
+        if self and other and isinstance(other, Media):
+            return self.key == other.key
+        return False
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __str__(self):
+        return f'{PREFIX}{self.key}'
+
+    def __repr__(self):
+        return f'Media: ({self.key}) ({self.content_type})'
+
+    @staticmethod
+    def parse(value):
+        """
+        parse a media reference
+        :param value: reference string
+        :return: Media, or None if the value is not a reference
+        """
+        if isinstance(value, str) and value.startswith(PREFIX):
+            return Media(value[len(PREFIX):])
+        return None
@@ -6,6 +6,7 @@ from math import isclose
 from uuid import UUID, uuid4
 
 from model.dialog import Dialog, Interaction
+from model.task import evaluate
 
 
 class PlayerStateException(Exception):
@@ -59,6 +60,18 @@ class PlayerState(object):
             self.path = []
         self.dialogs = {}
         self.inventory = {}
+        # changes since the state was last persisted, as (kind, *values), see record
+        self.deltas = []
+
+    def record(self, kind: str, *values):
+        """
+        record a change to the state so it can be persisted as an append-only delta
+        :param kind: moved (stamp, waypoint), answered (stamp, task, answer), item (stamp, key, item),
+                     dialog (npc, stamp, interaction, response), npc (npc, stamp, interaction), budget (budget)
+                     or energy (energy)
+        :param values: values of the change
+        """
+        self.deltas.append((kind, *values))
 
     def add_dialog_response(self, npc, interaction, response):
         """
@@ -67,10 +80,14 @@ class PlayerState(object):
         :param interaction: interaction target
         :param response: response to log
         """
-        self.budget += interaction.budget_modification
+        dt = datetime.utcnow()
+        if interaction.budget_modification:
+            self.budget += interaction.budget_modification
+            self.record('budget', self.budget)
         if npc not in self.dialogs.keys():
             self.dialogs[npc] = []
-        self.dialogs[npc].append((datetime.utcnow(), interaction, response))
+        self.dialogs[npc].append((dt, interaction, response))
+        self.record('dialog', npc, dt, interaction, response)
 
     def add_stuff(self, key, stuff):
         """
@@ -83,56 +100,72 @@ class PlayerState(object):
             self.inventory[dt].append((key, stuff))
         else:
             self.inventory[dt] = [(key, stuff)]
+        self.record('item', dt, key, stuff)
 
-    def available_moves(self, answer=None):
+    def available_moves(self, answer=None, safe: bool = False):
         """
-        show my available moves
-        :param answer: optional input for a task
+        show my available moves, using the compiled move table of the game
+        :param answer: optional input for a task (or Answer)
+        :param safe: only moves after which a finish can still be reached with the energy left
         """
+        answer = evaluate(answer)
         previous_move_stamp = self.path[-1][0]
-        current = next(iter(n for n in self.game_instance.game.graph.nodes if n == self.current_position()), None)
-        if not current:
-            raise PlayerStateException(f'Could not determine current position on path for {self.first_name} '
-                                       f'{self.last_name} ({self.player.email} -> {self.game_instance.title}')
+        table = self.game_instance.game.moves()
+        current = self.current_waypoint(table)
+        analysis = self.game_instance.game.reachability() if safe and self.energy else None
+        now = datetime.utcnow()
         moves = []
-        for successor in self.game_instance.game.graph.successors(current):
+        unsafe = set()
+        reachable = False
+        blocked = table.blocked[current.id]
+        for successor, weight in table.successors[current.id].items():
             # check if there is a time limit we've exceeded
-            if not isclose(successor.time_limit, 0.0) and datetime.utcnow() > previous_move_stamp + timedelta(seconds=successor.time_limit):
+            if not isclose(successor.time_limit, 0.0) and now > previous_move_stamp + timedelta(seconds=successor.time_limit):
                 continue
             # check if there is a budget requirement we don't meet
             if not isclose(successor.money_limit, 0.0) and self.budget < successor.money_limit:
                 continue
             # check if there is an energy requirement we don't meet
-            if self.energy and 'weight' in self.game_instance.game.graph.edges[current, successor] and self.game_instance.game.graph.edges[current, successor]['weight']:
-                if self.energy - self.game_instance.game.graph.edges[current, successor]['weight'] < 0:
-                    continue
-            # validate answers to return blocked waypoints
-            for task in current.tasks:
-                if not isclose(task.time_limit, 0.0) and datetime.utcnow() > previous_move_stamp + timedelta(seconds=task.time_limit):
-                    continue
-                if not isclose(task.money_limit, 0.0) and self.budget < task.money_limit:
-                    continue
-                if task.destination and task.solve(answer):
-                    moves.append(task.destination)
-            # check NPC interactions to return waypoints which require dialog
-            for interaction in current.interactions:
-                for npc in self.game_instance.npc_states:
-                    if interaction.destination and interaction in npc.get_player_dialog(self):
-                        moves.append(interaction.destination)
-            # and everything else
-            if successor not in [d.destination for d in current.tasks if d.destination] + [d.destination for d in current.interactions if d.destination]:
+            if self.energy and weight and self.energy - weight < 0:
+                continue
+            # check if a finish can still be reached from there with the energy left
+            if analysis and not analysis.is_safe(successor, weight, self.energy):
+                unsafe.add(successor)
+                continue
+            reachable = True
+            # everything that is not blocked by a task or an interaction
+            if successor not in blocked:
                 moves.append(successor)
-        return set(moves)
+        if not reachable:
+            return set(moves)
+        # validate answers to return blocked waypoints, in a single batch
+        tasks = [t for t in table.tasks[current.id]
+                 if (isclose(t.time_limit, 0.0) or now <= previous_move_stamp + timedelta(seconds=t.time_limit)) and
+                 (isclose(t.money_limit, 0.0) or self.budget >= t.money_limit)]
+        moves.extend(t.destination for t, solved in zip(tasks, answer.solve(tasks)) if solved)
+        # check NPC interactions to return waypoints which require dialog
+        if table.interactions[current.id]:
+            seen = set(i for npc in self.game_instance.npc_states for i in npc.get_player_dialog(self))
+            moves.extend(i.destination for i in table.interactions[current.id] if i in seen)
+        return set(moves) - unsafe if unsafe else set(moves)
 
     def available_path(self):
         """
         show my available path
         """
-        current = next(iter(n for n in self.game_instance.game.graph.nodes if n == self.current_position()), None)
+        return self.current_waypoint(self.game_instance.game.moves()).all_path_nodes()
+
+    def current_waypoint(self, table):
+        """
+        find the current position in the game graph
+        :param table: compiled move table of the game
+        :return: waypoint
+        """
+        current = table.waypoint(self.current_position())
         if not current:
             raise PlayerStateException(f'Could not determine current position on path for {self.first_name} '
                                        f'{self.last_name} ({self.player.email} -> {self.game_instance.game.title}')
-        return current.all_path_nodes()
+        return current
 
     def current_position(self):
         return self.path[-1][1]
@@ -141,9 +174,11 @@ class PlayerState(object):
         """
         (generator) move to next waypoint
         :param waypoint: next step on path
-        :param answer: optional input for task
+        :param answer: optional input for task (or Answer)
         :return: dict of {npc, [interactions]} for any given NPC
         """
+        # the answer is scored once per task for the whole move
+        answer = evaluate(answer)
         if self.game_instance.starts_at and datetime.utcnow() < self.game_instance.starts_at:
             raise PlayerStateException(f'game has not started yet, wait till {self.game_instance.starts_at} (UTC)')
         if self.game_instance.ends_at and datetime.utcnow() > self.game_instance.ends_at:
@@ -152,30 +187,55 @@ class PlayerState(object):
         if waypoint not in self.available_moves(answer):
             raise PlayerIllegalMoveException(f'Cannot move from {self.current_position().title} to {waypoint.title}')
 
+        budget, energy = self.budget, self.energy
         if waypoint.items:
             for item in waypoint.items:
                 self.add_stuff(waypoint, item)
-        for task in waypoint.tasks:
-            if task.solve(answer):
+        for task, solved in zip(waypoint.tasks, answer.solve(waypoint.tasks)):
+            if solved:
+                self.record('answered', datetime.utcnow(), task, answer.value)
                 self.budget += task.budget_modification
-            if task.items and task.solve(answer):
+            if task.items and solved:
                 for item in task.items:
                     self.add_stuff(task, item)
         self.budget += waypoint.budget_modification
 
-        if self.energy and 'weight' in self.game_instance.game.graph.edges[self.current_position(), waypoint] and \
-                self.game_instance.game.graph.edges[self.current_position(), waypoint]['weight']:
-            self.energy -= self.game_instance.game.graph.edges[self.current_position(), waypoint]['weight']
-        self.path.append((datetime.utcnow(), waypoint))
-
+        weight = self.game_instance.game.moves().weight(self.current_position(), waypoint)
+        if self.energy and weight:
+            self.energy -= weight
+        dt = datetime.utcnow()
+        self.path.append((dt, waypoint))
+        self.record('moved', dt, waypoint)
+        if self.budget != budget:
+            self.record('budget', self.budget)
+        if self.energy != energy:
+            self.record('energy', self.energy)
+
+        # only NPCs with a follow up for this waypoint can continue their dialog
+        interested = self.game_instance.game.moves().npcs(waypoint)
         interactions = {}
         for npc in self.game_instance.npc_states:
-            interactions[npc] = npc.available_interaction(self, answer)
+            interactions[npc] = npc.available_interaction(self, answer) if npc in interested else None
         return interactions
 
     def is_finished(self):
         return self.current_position().is_finish()
 
+    def can_finish(self) -> bool:
+        """
+        check if a finish can still be reached with the energy that is left
+        """
+        game = self.game_instance.game
+        return game.reachability().can_finish(self.current_waypoint(game.moves()), self.energy)
+
+    def progress(self) -> float:
+        """
+        progress towards a finish, as the moves made out of those needed along the shortest way to a finish
+        :return: fraction between 0 and 1
+        """
+        game = self.game_instance.game
+        return game.reachability().progress(self.current_waypoint(game.moves()), len(self.path) - 1)
+
 
 class NonPlayableCharacter(object):
     """
@@ -247,13 +307,16 @@ class NonPlayableCharacterState(NonPlayableCharacter):
         add an interaction to the dialog
         :param instance: player state
         :param interaction: interaction to add
-        :param answer: response to the interaction
+        :param answer: response to the interaction (or Answer)
         """
-        instance.add_dialog_response(self, interaction, answer)
+        answer = evaluate(answer)
+        instance.add_dialog_response(self, interaction, answer.value)
         next_interaction = self.available_interaction(instance, answer)
         if next_interaction:
-            self.paths[instance].append((datetime.utcnow(), next_interaction))
-            if next_interaction.task and next_interaction.task.solve(answer) and next_interaction.task.items:
+            dt = datetime.utcnow()
+            self.paths[instance].append((dt, next_interaction))
+            instance.record('npc', self, dt, next_interaction)
+            if next_interaction.task and answer.solves(next_interaction.task) and next_interaction.task.items:
                 for item in next_interaction.task.items:
                     instance.add_stuff(next_interaction.task, item)
             if next_interaction.items:
@@ -272,24 +335,25 @@ class NonPlayableCharacterState(NonPlayableCharacter):
         """
         show NPC available interactions for a given player
         :param instance: player state
-        :param answer: optional answer for a given NPC task (like respond to email)
+        :param answer: optional answer for a given NPC task (like respond to email), or Answer
         :return Interaction (or None)
         """
-        previous = self.paths[instance][-1]
-        current = next(iter(n for n in self.dialog.graph.nodes if n == previous[1]), None)
+        answer = evaluate(answer)
+        stamp, previous = self.paths[instance][-1]
+        table = self.dialog.transitions()
+        current = table.interaction(previous)
         if not current:
             raise PlayerStateException(f'Dialog position error for {instance.first_name} {instance.last_name} '
                                        f'({instance.player.email})')
-        for successor in self.dialog.graph.successors(current):
-            if (isclose(successor.money_limit, 0.0) or successor.money_limit < instance.budget) and (isclose(successor.time_limit, 0.0) or datetime.now() < previous[0] + timedelta(seconds=successor.time_limit)):
-                if successor.waypoints and instance.path[-1][1] in successor.waypoints:
-                    if successor.task and successor.task.solve(answer):
-                        return successor
-                    elif not successor.task:
-                        return successor
-                elif not successor.waypoints:
-                    if successor.task and successor.task.solve(answer):
-                        return successor
-                    elif not successor.task:
-                        return successor
+        position = getattr(instance.path[-1][1], 'id', None)
+        now = datetime.now()
+        for successor, waypoints, money_limit, time_limit, task in table.transitions[current.id]:
+            if money_limit is not None and money_limit >= instance.budget:
+                continue
+            if time_limit is not None and now >= stamp + time_limit:
+                continue
+            if waypoints and position not in waypoints:
+                continue
+            if not task or answer.solves(task):
+                return successor
         return None
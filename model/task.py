@@ -1,16 +1,112 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
 
+import re
+import unicodedata
+from collections import OrderedDict
+from threading import Lock
 from uuid import uuid4
 from datetime import datetime, timedelta
 
-from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz, process
+
+TOKEN = re.compile(r'\w+')
+# number of recent answers per text task that keep their fuzzy score, shared lock for all score caches
+SCORE_CACHE_SIZE = 64
+score_lock = Lock()
 
 
 class TaskSolverException(Exception):
     pass
 
 
+def tokenize(text: str) -> [str]:
+    """
+    split text into case folded words without accents or punctuation
+    :param text: any text
+    :return: list of words
+    """
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return TOKEN.findall(''.join(c for c in text if not unicodedata.combining(c)))
+
+
+def normalize(text: str) -> str:
+    """
+    normalized form of a text, its words joined by single spaces
+    :param text: any text
+    :return: normalized text
+    """
+    return ' '.join(tokenize(text))
+
+
+def score_texts(key: str, tasks: list) -> [bool]:
+    """
+    fuzzy match a normalized answer against the solution variants of text tasks in one batch
+    :param key: normalized answer
+    :param tasks: text tasks
+    :return: success or fail for each task
+    """
+    choices = [(variant, n) for n, task in enumerate(tasks) for variant in task.variants]
+    best = [0.0] * len(tasks)
+    for _, score, index in process.extract(key, [c[0] for c in choices], scorer=fuzz.partial_ratio, limit=None,
+                                           score_cutoff=min(t.ratio for t in tasks)):
+        n = choices[index][1]
+        best[n] = max(best[n], score)
+    results = []
+    for task, score in zip(tasks, best):
+        results.append(score > task.ratio)
+        task.remember(key, results[-1])
+    return results
+
+
+def solve_text(task, answer: str) -> bool:
+    key = normalize(answer)
+    result = task.lookup(key)
+    if result is None:
+        result = score_texts(key, [task])[0]
+    return result
+
+
+def solve_date(task, answer: datetime) -> bool:
+    return answer - task.solution < timedelta(days=task.days)
+
+
+def solve_list(task, answer: list) -> bool:
+    return sorted(task.solution) == sorted(answer)
+
+
+def solve_float(task, answer: float) -> bool:
+    return task.solution - answer < task.offset
+
+
+def solve_equal(task, answer) -> bool:
+    return task.solution == answer
+
+
+def solve_unsupported(task, answer) -> bool:
+    raise TaskSolverException(f'could not find solver for type {type(answer)} ({task.description})')
+
+
+# solvers by solution type, bool before int as it is a subclass
+SOLVERS = {
+    str: solve_text,
+    datetime: solve_date,
+    list: solve_list,
+    bool: solve_equal,
+    int: solve_equal,
+    float: solve_float
+}
+
+
+def solver_for(solution):
+    """
+    pick the solver for a type of solution
+    :param solution: task solution
+    :return: solver function taking a task and an answer of the solution type
+    """
+    return next((SOLVERS[t] for t in type(solution).__mro__ if t in SOLVERS), solve_unsupported)
+
+
 class Task(object):
     """
     Tasks are supposed to be solved by players, the logic here is that if a task is solved (a)
@@ -28,7 +124,8 @@ class Task(object):
                  budget_modification: float = 0.0,
                  ratio: int = 90,
                  days: int = 1,
-                 offset: float = 0.01):
+                 offset: float = 0.01,
+                 alternatives=None):
         """
         each task can have varying solution types; text, date, image, etc.
         :param destination: destination (waypoint or interaction) that becomes available on completing the task
@@ -43,21 +140,104 @@ class Task(object):
         :param ratio: fuzzyness ratio lower bound for text answers
         :param days: timedelta allowed on date answers
         :param offset: delta allowed for float answers
+        :param alternatives: other accepted solutions for text answers
         """
         self.id = uuid4()
         self.destination = destination
         self.description = description
         self.text = text
+        self._alternatives = alternatives
+        self._ratio = ratio
         self.solution = solution
         self.media = media
         self.items = items
         self.time_limit = time_limit
         self.money_limit = money_limit
         self.budget_modification = budget_modification
-        self.ratio = ratio
         self.days = days
         self.offset = offset
 
+    @property
+    def solution(self):
+        return self._solution
+
+    @solution.setter
+    def solution(self, solution):
+        """
+        set the solution and pick the solver for its type once
+        :param solution: solution that solves the task
+        """
+        self._solution = solution
+        self.solver = solver_for(solution)
+        self.prepare()
+
+    @property
+    def ratio(self):
+        return self._ratio
+
+    @ratio.setter
+    def ratio(self, ratio: int):
+        """
+        set the fuzzyness ratio lower bound for text answers, answers scored against the previous ratio are
+        scored again
+        :param ratio: lower bound
+        """
+        self._ratio = ratio
+        self.prepare()
+
+    @property
+    def alternatives(self):
+        return self._alternatives
+
+    @alternatives.setter
+    def alternatives(self, alternatives):
+        """
+        set the other accepted solutions for text answers
+        :param alternatives: list of solutions
+        """
+        self._alternatives = alternatives
+        self.prepare()
+
+    def prepare(self):
+        """
+        precompute the normalized variants of a text solution and its alternatives, answers with the same
+        normalized form are accepted without scoring
+        """
+        self.variants = frozenset()
+        self.scores = None
+        if self.solver is solve_text and self.solution:
+            self.variants = frozenset(normalize(s) or s for s in [self.solution] + (self.alternatives or []) if s)
+
+    def lookup(self, key: str):
+        """
+        look up a normalized text answer in the solution variants and the recently scored answers
+        :param key: normalized answer
+        :return: success or fail, None if the answer still needs scoring
+        """
+        if key in self.variants:
+            return True
+        if not self.scores:
+            return None
+        with score_lock:
+            result = self.scores.get(key)
+            if result is not None:
+                self.scores.move_to_end(key)
+            return result
+
+    def remember(self, key: str, result: bool):
+        """
+        keep the result of scoring a normalized text answer
+        :param key: normalized answer
+        :param result: success or fail
+        """
+        with score_lock:
+            if self.scores is None:
+                self.scores = OrderedDict()
+            self.scores[key] = result
+            self.scores.move_to_end(key)
+            if len(self.scores) > SCORE_CACHE_SIZE:
+                self.scores.popitem(last=False)
+
     def __eq__(self, other):
         if self and other and isinstance(other, Task):
             return self.id == other.id
@@ -84,16 +264,63 @@ class Task(object):
             return False
         if not isinstance(answer, type(self.solution)):
             return False
-        if isinstance(answer, str):
-            return fuzz.partial_ratio(answer, self.solution) > self.ratio
-        if isinstance(answer, datetime):
-            return answer - self.solution < timedelta(days=self.days)
-        if isinstance(answer, list):
-            return self.solution.sort() == answer.sort()
-        if isinstance(answer, int):
-            return self.solution == answer
-        if isinstance(answer, float):
-            return self.solution - answer < self.offset
-        if isinstance(answer, bool):
-            return self.solution == answer
-        raise TaskSolverException(f'could not find solver for type {type(answer)} ({self.description})')
+        return self.solver(self, answer)
+
+
+class Answer(object):
+    """
+    An answer evaluated against many tasks, the result for each task is memoized so the answer is scored once
+    per task however often a move asks for it
+    """
+    def __init__(self, value):
+        """
+        :param value: any answer of any type
+        """
+        self.value = value
+        self.key = normalize(value) if isinstance(value, str) else None
+        # results by task id
+        self.results = {}
+
+    def solves(self, task: Task) -> bool:
+        """
+        check if the answer solves a task
+        :param task: task to solve
+        :return: success or fail
+        """
+        result = self.results.get(task.id)
+        if result is None:
+            result = self.solve([task])[0]
+        return result
+
+    def solve(self, tasks: [Task]) -> [bool]:
+        """
+        evaluate the answer against many tasks in a single call, text answers are looked up in the normalized
+        solution variants first and the remaining text tasks are scored in one batch
+        :param tasks: tasks to solve
+        :return: success or fail for each task
+        """
+        texts = []
+        for task in tasks:
+            if task.id in self.results:
+                continue
+            if task.solver is solve_text and task.solution and self.value and isinstance(self.value, str):
+                result = task.lookup(self.key)
+                if result is None:
+                    texts.append(task)
+                else:
+                    self.results[task.id] = result
+            else:
+                self.results[task.id] = task.solve(self.value)
+        if texts:
+            for task, result in zip(texts, score_texts(self.key, texts)):
+                self.results[task.id] = result
+        return [self.results[t.id] for t in tasks]
+
+
+def evaluate(answer) -> Answer:
+    """
+    wrap an answer for memoized evaluation, unless it already is
+    :param answer: any answer of any type, or an Answer
+    :return: Answer
+    """
+    return answer if isinstance(answer, Answer) else Answer(answer)
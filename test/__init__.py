@@ -4,3 +4,12 @@
 import test.test_game
 import test.test_dialog
 import test.test_database
+import test.test_connection
+import test.test_cache
+import test.test_password
+import test.test_coder
+import test.test_instance
+import test.test_buffer
+import test.test_task
+import test.test_media
+import test.test_auth
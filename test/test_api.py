@@ -12,6 +12,7 @@ from requests.adapters import HTTPAdapter
 from urllib3 import Retry
 
 from app import Server
+from database.schema import initialize
 from model.game import Game, Waypoint
 from model.task import Task
 from util.converter import generate_api_game
@@ -47,7 +48,9 @@ def create_clean_db(wait_for_api):
     if sys_db.has_database(os.getenv('DB_NAME')):
         sys_db.delete_database(os.getenv('DB_NAME'))
     sys_db.create_database(os.getenv('DB_NAME'))
-    return client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    initialize(db)
+    return db
 
 
 @pytest.fixture(scope="session")
@@ -97,4 +100,9 @@ def test_create_and_delete_game(wait_for_api, create_clean_db, client):
         f"{ROOT_URL}/games"
     )
     assert lg.status_code == 200
-    assert game.title in [g['title'] for g in lg.data]
+    assert game.title in [g['title'] for g in json.loads(lg.data)['games']]
+    lg = client.get(
+        f"{ROOT_URL}/games/{game.title}"
+    )
+    assert lg.status_code == 200
+    assert json.loads(lg.data)['title'] == game.title
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+from time import sleep, time
+from uuid import uuid4
+
+import pytest
+from jose import jwt
+
+import api.auth
+from api.auth import validate_token, revoke_token, revoke_tokens
+from database.player import token_key
+from model.player import Player
+from util.cache import LRUCache
+
+SECRET = 'test secret'
+ALGORITHM = 'HS256'
+
+
+class Validator(object):
+    """
+    stands in for the token store, counting lookups
+    """
+    def __init__(self, player=None):
+        self.player = player
+        self.calls = 0
+
+    def __call__(self, db, token):
+        self.calls += 1
+        return self.player
+
+
+@pytest.fixture
+def validator(monkeypatch):
+    player = Player('test@player.com', '')
+    player.id = uuid4()
+    result = Validator(player)
+    monkeypatch.setenv('SECRET_KEY', SECRET)
+    monkeypatch.setenv('TOKEN_ALGO', ALGORITHM)
+    monkeypatch.setenv('TOKEN_VALIDATION', 'cache')
+    monkeypatch.setattr(api.auth, 'token_cache', LRUCache(10, 60))
+    monkeypatch.setattr(api.auth, 'get_db', lambda: None)
+    monkeypatch.setattr(api.auth, 'validate', result)
+    monkeypatch.setattr(api.auth, 'remove_token', lambda db, email, token: None)
+    return result
+
+
+def token(sub='test@player.com', lifetime=3600, secret=SECRET):
+    claims = {'sub': sub, 'iat': int(time())}
+    if lifetime is not None:
+        claims['exp'] = int(time() + lifetime)
+    return jwt.encode(claims, secret, algorithm=ALGORITHM)
+
+
+def test_invalid_tokens_are_rejected_before_the_database(validator):
+    assert validate_token(token(lifetime=-10))[1] == 401
+    assert validate_token(token(secret='other secret'))[1] == 401
+    assert validate_token('not a token')[1] == 401
+    assert validator.calls == 0
+
+
+def test_cached_token_skips_the_database(validator):
+    valid = token()
+    result, code = validate_token(valid)
+    assert code == 200 and result['sub'] == 'test@player.com' and result['uid'] == validator.player.id
+    assert validate_token(valid) == (result, 200)
+    assert validator.calls == 1
+
+
+def test_unknown_token(validator):
+    validator.player = None
+    assert validate_token(token())[1] == 401
+
+
+def test_token_for_another_player(validator):
+    assert validate_token(token(sub='other@player.com'))[1] == 401
+
+
+def test_revoked_token(validator):
+    valid = token()
+    assert validate_token(valid)[1] == 200
+    revoke_token('test@player.com', valid)
+    assert validate_token(valid)[1] == 401
+    assert validator.calls == 1
+
+
+def test_removed_player_tokens_are_revoked(validator):
+    sessions = [token(), token(lifetime=7200)]
+    assert all(validate_token(t)[1] == 200 for t in sessions)
+    revoke_tokens([{'_key': token_key(t), 'expires_at': jwt.get_unverified_claims(t)['exp']} for t in sessions])
+    assert all(validate_token(t)[1] == 401 for t in sessions)
+    assert validator.calls == 2
+
+
+def test_token_without_expiry(validator):
+    result, code = validate_token(token(lifetime=None))
+    assert code == 200 and result['sub'] == 'test@player.com'
+
+
+def test_cache_entries_expire(validator, monkeypatch):
+    monkeypatch.setattr(api.auth, 'token_cache', LRUCache(10, 0.05))
+    valid = token()
+    validate_token(valid)
+    validate_token(valid)
+    assert validator.calls == 1
+    sleep(0.1)
+    validate_token(valid)
+    assert validator.calls == 2
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import pytest
+from arango.exceptions import ArangoError
+
+from database.buffer import WriteBehindBuffer
+from database.instance import InstanceStateException
+from test.test_coder import create_instance
+
+
+def error(code):
+    result = ArangoError(f'error {code}')
+    result.error_code = code
+    return result
+
+
+class Collection(object):
+    def __init__(self, fail=0):
+        self.documents = {}
+        self.calls = 0
+        self.fail = fail
+        # keys of documents that can not be written
+        self.broken = set()
+
+    def insert_many(self, documents, overwrite=False, silent=False):
+        self.calls += 1
+        if self.fail:
+            self.fail -= 1
+            return [error(503) for _ in documents]
+        results = []
+        for document in documents:
+            if document['_key'] in self.broken:
+                results.append(error(500))
+            elif document['_key'] in self.documents and not overwrite:
+                results.append(error(1210))
+            else:
+                self.documents[document['_key']] = document
+                results.append({'_key': document['_key']})
+        return results
+
+    def get_many(self, keys):
+        return [self.documents[k] for k in keys if k in self.documents]
+
+
+class Database(object):
+    def __init__(self, fail=0):
+        self.collections = {'events': Collection(fail), 'snapshots': Collection()}
+
+    def collection(self, name):
+        return self.collections[name]
+
+
+def saved_instance():
+    instance = create_instance()
+    instance.sequence = 0
+    return instance
+
+
+def test_batched_flush_on_checkpoint():
+    db = Database()
+    buffer = WriteBehindBuffer(max_events=1000, interval=60, db=db)
+    instances = [saved_instance() for _ in range(3)]
+    for instance in instances:
+        buffer.submit(instance)
+    queued = buffer.queued()
+    assert queued and not db.collections['events'].documents
+    buffer.checkpoint()
+    assert db.collections['events'].calls == 1
+    assert len(db.collections['events'].documents) == queued
+    assert all(i.sequence == queued // 3 for i in instances)
+    assert buffer.stats()['queued'] == 0 and buffer.stats()['flushed'] == queued
+    buffer.shutdown()
+
+
+def test_flush_on_size_and_retry():
+    db = Database(fail=1)
+    buffer = WriteBehindBuffer(max_events=1, interval=60, db=db)
+    instance = saved_instance()
+    buffer.submit(instance)
+    assert buffer.stats()['errors'] == instance.sequence and buffer.queued() == instance.sequence
+    buffer.shutdown()
+    assert len(db.collections['events'].documents) == instance.sequence
+    assert buffer.queued() == 0
+
+
+def test_snapshot_after_interval(monkeypatch):
+    monkeypatch.setattr('database.buffer.SNAPSHOT_INTERVAL', 2)
+    db = Database()
+    buffer = WriteBehindBuffer(durability='batched', max_events=1000, interval=60, db=db)
+    instance = saved_instance()
+    buffer.submit(instance)
+    buffer.checkpoint(instance)
+    player = instance.player_states[0].player.id.hex
+    assert list(db.collections['snapshots'].documents) == [f'{instance.id.hex}-{player}-{instance.sequence}']
+    assert not instance.stale
+    # a flush without new events of the player writes no snapshot
+    buffer._snapshots.add(instance)
+    buffer.checkpoint(instance)
+    assert db.collections['snapshots'].calls == 1
+    buffer.shutdown()
+
+
+def test_stored_events_count_as_written():
+    db = Database()
+    buffer = WriteBehindBuffer(max_events=1000, interval=60, db=db)
+    instance = saved_instance()
+    buffer.submit(instance)
+    buffer.checkpoint()
+    # a retry of events that did reach the database
+    buffer._retry = list(db.collections['events'].documents.values())
+    assert buffer.flush() == instance.sequence
+    assert buffer.queued() == 0 and buffer.stats()['errors'] == 0
+    buffer.shutdown()
+
+
+def test_later_events_wait_for_failed_ones():
+    db = Database()
+    buffer = WriteBehindBuffer(max_events=1000, interval=60, db=db)
+    instance, other = saved_instance(), saved_instance()
+    db.collections['events'].broken.add(f'{instance.id.hex}-1')
+    buffer.submit(instance)
+    buffer.checkpoint()
+    written = set(db.collections['events'].documents)
+    assert f'{instance.id.hex}-1' not in written and f'{instance.id.hex}-2' in written
+    # the next changes of the instance wait for the failed event, other instances are written
+    instance.player_states[0].move_to(next(iter(instance.player_states[0].available_moves())))
+    buffer.submit(instance)
+    buffer.submit(other)
+    buffer.checkpoint()
+    written = set(db.collections['events'].documents)
+    assert f'{instance.id.hex}-{instance.sequence}' not in written
+    assert f'{other.id.hex}-{other.sequence}' in written
+    db.collections['events'].broken.clear()
+    buffer.checkpoint()
+    assert all(f'{instance.id.hex}-{seq}' in db.collections['events'].documents
+               for seq in range(1, instance.sequence + 1))
+    assert buffer.queued() == 0
+    buffer.shutdown()
+
+
+def test_retry_is_bounded():
+    db = Database(fail=1)
+    buffer = WriteBehindBuffer(max_events=1000, interval=60, db=db, max_retry=2)
+    instance = saved_instance()
+    buffer.submit(instance)
+    buffer.checkpoint()
+    assert buffer.queued() == 2 and buffer.stats()['dropped'] == instance.sequence - 2
+    # the oldest events are kept
+    assert [e['seq'] for e in buffer._retry] == [1, 2]
+    buffer.shutdown()
+
+
+def test_events_of_another_writer_are_conflicts():
+    db = Database()
+    buffer = WriteBehindBuffer(max_events=1000, interval=60, db=db)
+    instance = saved_instance()
+    key = f'{instance.id.hex}-1'
+    db.collections['events'].documents[key] = {'_key': key, 'instance': instance.id.hex, 'seq': 1, 'player': 'other'}
+    buffer.submit(instance)
+    assert buffer.flush() == instance.sequence - 1
+    assert buffer.queued() == 1 and buffer.stats()['conflicts'] == 1
+    assert db.collections['events'].documents[key]['player'] == 'other'
+    # the instance takes no changes until it is loaded again
+    with pytest.raises(InstanceStateException):
+        buffer.submit(instance)
+    buffer.checkpoint()
+    assert buffer.queued() == 1
+    buffer.release(instance.id.hex)
+    assert buffer.queued() == 0 and buffer.stats()['conflicts'] == 0 and buffer.stats()['dropped'] == 1
+    buffer.shutdown()
+
+
+def test_events_are_kept_when_flush_fails(monkeypatch):
+    db = Database()
+    buffer = WriteBehindBuffer(max_events=1000, interval=60, db=db)
+    instance = saved_instance()
+    buffer.submit(instance)
+    sequence = buffer.queued()
+
+    def broken(events):
+        raise KeyError('_key')
+    monkeypatch.setattr(buffer, '_write', broken)
+    with pytest.raises(KeyError):
+        buffer.flush()
+    assert buffer.queued() == sequence and instance.sequence == sequence
+    monkeypatch.undo()
+    assert buffer.flush() == sequence
+    assert len(db.collections['events'].documents) == sequence
+    buffer.shutdown()
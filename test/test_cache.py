@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+from time import sleep
+
+from util.cache import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_ttl_expiry():
+    cache = LRUCache(10, 0.05)
+    cache.put('a', 1)
+    cache.put('b', 2, 10)
+    assert cache.get('a') == 1
+    sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert cache.pop('b') == 2
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test_weight_eviction():
+    cache = LRUCache(10, maxweight=10, weigher=len)
+    cache.put('a', 'aaaa')
+    cache.put('b', 'bbbb')
+    cache.put('c', 'cccc')
+    assert 'a' not in cache
+    assert cache.weight == 8
+    cache.put('b', 'b')
+    assert cache.weight == 5
+    assert cache.stats()['evictions'] == 1
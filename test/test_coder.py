@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import json
+
+import msgpack
+import pytest
+
+from database import storage
+from database.instance import attach
+from model.dialog import Mail, Dialog
+from model.game import Game, Waypoint, Level
+from model.player import Player, NonPlayableCharacter
+from util.coder import encode, decode, MarugotoDecoder, CODEC_VERSION, SERIALIZERS, Serializer
+
+
+def create_instance():
+    """
+      start
+        |
+        w1 <- dialog becomes available
+        |
+        end <- blocked till dialog in phase 2 (ds2)
+    """
+    game = Game('test', b'\x89PNG image')
+    start = Waypoint(game.graph, 'start', level=Level('first', b'icon'))
+    w1 = Waypoint(game.graph, 'w1', items=['some item'])
+    end = Waypoint(game.graph, 'end')
+    game.set_start(start)
+    npc_dialog = Dialog()
+    ds1 = Mail(npc_dialog.graph, 'test subject 1', 'test body 1')
+    ds1.waypoints.append(w1)
+    start.add_destination(w1)
+    npc_dialog.set_start(ds1)
+    ds2 = Mail(npc_dialog.graph, 'test subject 2', 'test body 2', items=['test item'], destination=end)
+    ds1.add_follow_up(ds2, end)
+    w1.add_interaction(ds2)
+    npc = NonPlayableCharacter('test', 'npc', npc_dialog)
+    game.add_non_playable_character(npc)
+    instance = game.create_new_game()
+    instance.add_player(Player('test', 'player'), 'testy', 'mctestpants')
+    interactions = instance.player_states[0].move_to(w1)
+    instance.npc_states[0].update_player_dialog(instance.player_states[0], interactions[npc], 'mail response')
+    return instance
+
+
+def test_encode_nests_objects():
+    instance = create_instance()
+    document = encode(instance)
+    assert document['_v'] == CODEC_VERSION
+    assert isinstance(document['game'], dict)
+    assert isinstance(document['players'][0]['player'], dict)
+    assert document['players'][0]['path'][-1]['waypoint'] == instance.player_states[0].path[-1][1].id.hex
+    assert json.loads(json.dumps(document)) == document
+    waypoint = encode(instance.game.start)
+    assert waypoint['level']['title'] == 'first'
+
+
+def test_decode_round_trip():
+    instance = create_instance()
+    loaded = decode(json.loads(json.dumps(encode(instance))))
+    assert loaded.id == instance.id
+    assert loaded.created_at == instance.created_at
+    assert loaded.game.title == instance.game.title
+    loaded.game = instance.game
+    attach(loaded)
+    state = loaded.player_states[0]
+    original = instance.player_states[0]
+    assert state.player.id == original.player.id
+    assert [w for _, w in state.path] == [w for _, w in original.path]
+    assert list(state.dialogs.keys()) == [loaded.npc_states[0]]
+    assert state.dialogs[loaded.npc_states[0]][0][1] is original.dialogs[instance.npc_states[0]][0][1]
+    assert [v for kvs in state.inventory.values() for _, v in kvs] == ['some item', 'test item']
+    assert loaded.npc_states[0].get_player_dialog(state) == instance.npc_states[0].get_player_dialog(original)
+    assert encode(loaded) == encode(instance)
+
+
+def test_decode_legacy_format():
+    start = Waypoint(Game('test').graph, 'start', items=['some item'], level=Level('first'))
+    document = encode(start)
+    del document['_v']
+    document['level'] = json.dumps(document['level'])
+    document['items'] = [json.dumps(i) for i in document['items']]
+    waypoint = json.loads(json.dumps(document), cls=MarugotoDecoder)
+    assert waypoint.id == start.id
+    assert waypoint.items == ['some item']
+    assert waypoint.level.title == 'first'
+
+
+def test_serializers_round_trip():
+    instance = create_instance()
+    for serializer in SERIALIZERS.values():
+        loaded = serializer.loads(serializer.dumps(instance))
+        assert loaded.id == instance.id
+        assert loaded.game.image == instance.game.image
+        assert [p.player.id for p in loaded.player_states] == [p.player.id for p in instance.player_states]
+    raw = msgpack.unpackb(SERIALIZERS['msgpack'].dumps(instance), raw=False)
+    assert raw['game']['image'] == instance.game.image
+
+
+def test_serializer_backends_implement_dumps_and_loads():
+    class Incomplete(Serializer):
+        def dumps(self, o) -> bytes:
+            return b''
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_storage_format_per_collection(monkeypatch):
+    instance = create_instance()
+    assert storage.pack('instances', instance) == encode(instance)
+    monkeypatch.setitem(storage.STORAGE_FORMATS, 'instances', 'msgpack')
+    document = storage.pack('instances', instance)
+    assert document['_key'] == instance.id.hex
+    assert document['_format'] == 'msgpack'
+    assert json.loads(json.dumps(document)) == document
+    assert storage.unpack(document).id == instance.id
+    assert storage.unpack(encode(instance)).id == instance.id
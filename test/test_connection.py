@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+from database.connection import ConnectionProvider
+
+
+def test_lazy_shared_connection():
+    provider = ConnectionProvider()
+    assert provider.stats() == {}
+    db = provider.db()
+    assert provider.db() is db
+    assert provider.stats()['sessions'] == 1
+    provider.close()
+    assert provider.stats() == {}
+    assert provider.db() is not db
+    provider.close()
@@ -4,17 +4,22 @@
 import json
 import os
 from datetime import datetime, timedelta
+from time import time
 
 import pytest
 import requests
 from arango import ArangoClient
 from dotenv import load_dotenv
+from jose import jwt
 
 from requests.adapters import HTTPAdapter
 from urllib3 import Retry
 
-from database.game import create, read, update, delete, get_all_games, get_all_dialogs
-from database.instance import save, saves, hosts, load
+from database.game import create, read, update, delete, get_all_games, get_all_dialogs, serialize
+from database.instance import save, saves, hosts, load, append, snapshot, replay
+from database.player import create as create_player, update as update_player, validate, migrate as migrate_players, \
+    PlayerExistsException
+from database.schema import initialize
 from model.dialog import Dialog, Mail, Speech
 from model.game import Waypoint, Game
 from model.player import NonPlayableCharacter, Player
@@ -48,7 +53,9 @@ def create_clean_db(wait_for_api):
     if sys_db.has_database(os.getenv('DB_NAME')):
         sys_db.delete_database(os.getenv('DB_NAME'))
     sys_db.create_database(os.getenv('DB_NAME'))
-    return client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    db = client.db(os.getenv('DB_NAME'), username=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    initialize(db)
+    return db
 
 
 @pytest.fixture(scope='function')
@@ -150,8 +157,65 @@ def test_instance_crud(create_clean_db, game):
     instance.add_player(player, 'pseudonym', 'one')
     save(create_clean_db, instance)
     assert instance.name in [f[1] for f in saves(create_clean_db, player)]
+    assert (instance.created_at, instance.name, game.title, 'pseudonym one') in saves(create_clean_db, player)
     assert instance.name not in [f[1] for f in hosts(create_clean_db, player)]
     assert instance.name in [f[1] for f in hosts(create_clean_db, gm)]
     db_instance = load(create_clean_db, instance.id.hex)
     assert db_instance.id == instance.id
     assert db_instance.player_states[0].first_name == 'pseudonym'
+
+
+def test_instance_events(create_clean_db, game):
+    create(create_clean_db, game)
+    instance = game.create_new_game('our event sourced game')
+    instance.add_player(Player('test@player.com', ''), 'pseudonym', 'one')
+    save(create_clean_db, instance)
+    assert instance.sequence == 0
+    state = instance.player_states[0]
+    state.move_to(next(iter(state.available_moves())))
+    changes = len(state.deltas)
+    assert changes and append(create_clean_db, instance) == changes
+    assert not state.deltas and instance.sequence == changes
+    db_instance = load(create_clean_db, instance.id.hex)
+    assert [w for _, w in db_instance.player_states[0].path] == [w for _, w in state.path]
+    assert db_instance.sequence == instance.sequence
+    assert len(replay(create_clean_db, instance.id.hex, 0).player_states[0].path) == 1
+    snapshot(create_clean_db, instance)
+    assert create_clean_db.collection('snapshots').count() == 2
+    assert create_clean_db.collection('events').count() == changes
+    db_instance = load(create_clean_db, instance.id.hex)
+    assert [w for _, w in db_instance.player_states[0].path] == [w for _, w in state.path]
+    # instances written before their documents listed the players
+    create_clean_db.collection('instances').update({'_key': instance.id.hex, 'player_ids': None}, keep_none=False)
+    assert len(replay(create_clean_db, instance.id.hex).player_states) == 1
+
+
+def test_player_update_to_registered_mail(create_clean_db):
+    create_player(create_clean_db, 'first@player.com', 'password', 'salt')
+    second = create_player(create_clean_db, 'second@player.com', 'password', 'salt')
+    with pytest.raises(PlayerExistsException):
+        update_player(create_clean_db, second, 'salt', email='first@player.com')
+
+
+def test_player_tokens_migration(create_clean_db):
+    player = create_player(create_clean_db, 'test@player.com', 'password', 'salt')
+    valid = jwt.encode({'sub': player.email, 'exp': int(time()) + 3600}, 'secret', algorithm='HS256')
+    expired = jwt.encode({'sub': player.email, 'exp': int(time()) - 3600}, 'secret', algorithm='HS256')
+    create_clean_db.collection('players').update({'_key': player.id.hex, 'tokens': [valid, expired]})
+    assert validate(create_clean_db, valid) is None
+    assert migrate_players(create_clean_db) == 1
+    assert validate(create_clean_db, valid).email == player.email
+    assert validate(create_clean_db, expired) is None
+    assert 'tokens' not in create_clean_db.collection('players').get(player.id.hex)
+    assert migrate_players(create_clean_db) == 0
+
+
+def test_serialize_game_documents(game):
+    documents = serialize(game, 'creator')
+    assert len(documents['waypoints']) == len(game.graph.nodes)
+    assert len(documents['path']) == len(game.graph.edges)
+    assert len(documents['tasks']) == 4
+    assert len(documents['interactions']) == 4
+    assert len(documents['conversation']) == 3
+    assert documents['games'][0]['creator'] == 'creator'
+    assert all(t['for'] for t in documents['tasks'])
@@ -75,3 +75,72 @@ def test_npc_required_response():
     assert len(instance.player_states[0].inventory) == 1
     assert len(instance.player_states[0].available_moves()) == 1
     assert instance.player_states[0].move_to(end)
+
+
+def test_dialog_transitions():
+    """
+      start
+        |
+        w1 <- dialog of the first npc continues
+        |
+        end <- dialog of the second npc continues
+    """
+    game = Game('test')
+    start = Waypoint(game.graph, 'start')
+    w1 = Waypoint(game.graph, 'w1')
+    end = Waypoint(game.graph, 'end')
+    start.add_destination(w1)
+    w1.add_destination(end)
+    game.set_start(start)
+    npcs = []
+    for name, waypoint in [('first', w1), ('second', end)]:
+        npc_dialog = Dialog()
+        ds1 = Mail(npc_dialog.graph, f'{name} subject 1', 'test body 1')
+        npc_dialog.set_start(ds1)
+        ds2 = Mail(npc_dialog.graph, f'{name} subject 2', 'test body 2')
+        ds2.waypoints.append(waypoint)
+        ds1.add_follow_up(ds2)
+        npcs.append(NonPlayableCharacter(name, 'npc', npc_dialog))
+        game.add_non_playable_character(npcs[-1])
+    table = npcs[0].dialog.transitions()
+    assert table.waypoints == {w1.id} and not table.roaming
+    assert [t[0] for t in table.transitions[npcs[0].dialog.start.id]] == list(npcs[0].dialog.graph.successors(npcs[0].dialog.start))
+    assert game.moves().npcs(w1) == {npcs[0]}
+    assert game.moves().npcs(end) == {npcs[1]}
+    instance = game.create_new_game()
+    instance.add_player(Player('test', 'player'), 'testy', 'mctestpants')
+    interactions = instance.player_states[0].move_to(w1)
+    assert interactions[npcs[0]] and interactions[npcs[1]] is None
+    interactions = instance.player_states[0].move_to(end)
+    assert interactions[npcs[0]] is None and interactions[npcs[1]]
+
+
+def test_follow_up_added_after_moves():
+    """
+      start
+        |
+        w1
+        |
+        end <- dialog continues once the follow up is added
+    """
+    game = Game('test')
+    start = Waypoint(game.graph, 'start')
+    w1 = Waypoint(game.graph, 'w1')
+    end = Waypoint(game.graph, 'end')
+    start.add_destination(w1)
+    w1.add_destination(end)
+    game.set_start(start)
+    npc_dialog = Dialog()
+    ds1 = Mail(npc_dialog.graph, 'test subject 1', 'test body 1')
+    npc_dialog.set_start(ds1)
+    npc = NonPlayableCharacter('test', 'npc', npc_dialog)
+    game.add_non_playable_character(npc)
+    instance = game.create_new_game()
+    instance.add_player(Player('test', 'player'), 'testy', 'mctestpants')
+    interactions = instance.player_states[0].move_to(w1)
+    assert interactions[npc] is None and not game.moves().npcs(end)
+    ds2 = Mail(npc_dialog.graph, 'test subject 2', 'test body 2')
+    ds2.waypoints.append(end)
+    ds1.add_follow_up(ds2)
+    interactions = instance.player_states[0].move_to(end)
+    assert interactions[npc]
@@ -1,12 +1,48 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
 
+import networkx as nx
 import pytest
 
-from model.game import Game, Waypoint
-from model.player import Player, PlayerIllegalMoveException
+from model.dialog import Dialog, DialogGraphException, Mail
+from model.game import Game, Waypoint, GameGraphException
+from model.player import NonPlayableCharacter, Player, PlayerIllegalMoveException
 from model.task import Task
 
+SOLUTION = 'answer'
+
+
+def generate_game(title, size, npcs=0, dialog_depth=2):
+    """
+    a game where every waypoint is reached from one of the three waypoints before it and every fifth link is blocked
+    by a task, the follow ups of the NPC dialogs are bound to waypoints spread over the game
+    :param title: game title
+    :param size: number of waypoints
+    :param npcs: number of NPCs
+    :param dialog_depth: number of follow ups in the dialog of each NPC
+    :return: game
+    """
+    game = Game(title)
+    waypoints = [Waypoint(game.graph, f'w{n:04}') for n in range(size)]
+    for n in range(1, size):
+        source = waypoints[max(0, n - 1 - n % 3)]
+        if n % 5 == 0:
+            source.add_task(Task(waypoints[n], f'task {n}', 'some task', SOLUTION))
+        else:
+            source.add_destination(waypoints[n], 1.0 if n % 2 else None)
+    game.set_start(waypoints[0])
+    for i in range(npcs):
+        dialog = Dialog()
+        previous = Mail(dialog.graph, f'npc{i} start', 'hello')
+        dialog.set_start(previous)
+        for level in range(dialog_depth):
+            follow_up = Mail(dialog.graph, f'npc{i} {level}', 'some mail')
+            follow_up.waypoints.append(waypoints[(level + 1) * size // (dialog_depth + 1)])
+            previous.add_follow_up(follow_up)
+            previous = follow_up
+        game.add_non_playable_character(NonPlayableCharacter(f'npc{i}', 'generated', dialog))
+    return game
+
 
 def test_simple_graph_generation():
     game = Game('test')
@@ -75,3 +111,122 @@ def test_identify_player_path():
     instance.player_states[0].move_to(end)
     assert instance.player_states[0].current_position() == end
     assert instance.player_states[0].is_finished()
+
+
+def test_move_table():
+    game = Game('test', energy=2.0)
+    start = Waypoint(game.graph, 'start')
+    w1 = Waypoint(game.graph, 'w1')
+    w2 = Waypoint(game.graph, 'w2')
+    start.add_destination(w1, 3.0)
+    start.add_task(Task(w2, 'test description', 'test text', 'answer'))
+    game.set_start(start)
+    table = game.moves()
+    assert game.moves() is table
+    assert table.waypoint(start.id) is start
+    assert table.weight(start, w1) == 3.0
+    assert table.blocked[start.id] == {w2}
+    instance = game.create_new_game()
+    instance.add_player(Player('test', 'player'), 'testy', 'mctestpants')
+    # not enough energy for w1, and w2 needs an answer
+    assert instance.player_states[0].available_moves() == set()
+    assert instance.player_states[0].available_moves('answer') == {w2}
+    # changing the graph compiles the table again
+    end = Waypoint(game.graph, 'end')
+    start.add_destination(end, 1.0)
+    assert game.moves() is not table
+    assert instance.player_states[0].available_moves('answer') == {w2, end}
+    instance.player_states[0].move_to(end)
+    assert instance.player_states[0].energy == 1.0
+
+
+def test_reachability():
+    game = Game('test', energy=3.0)
+    start = Waypoint(game.graph, 'start')
+    w1 = Waypoint(game.graph, 'w1')
+    w2 = Waypoint(game.graph, 'w2')
+    end = Waypoint(game.graph, 'end')
+    other = Waypoint(game.graph, 'other')
+    start.add_destination(w1, 2.0)
+    start.add_destination(w2, 1.0)
+    w1.add_destination(end, 2.0)
+    w2.add_destination(end)
+    w2.add_destination(other, 5.0)
+    game.set_start(start)
+    analysis = game.reachability()
+    assert analysis.order[0] is start and analysis.finishes == {end, other}
+    assert analysis.reaches(start, end) and analysis.reaches(w1, end) and not analysis.reaches(w1, other)
+    assert not analysis.reaches(end, start) and analysis.reaches(w1, w1)
+    assert set(w1.all_path_nodes()) == {w1, end} and start.all_path_nodes()[0] is start
+    assert analysis.summary(start) == {'finishes': 2, 'min_energy': 1.0, 'max_energy': 6.0,
+                                       'min_moves': 2, 'max_moves': 2}
+    assert analysis.can_finish(w1, 2.0) and not analysis.can_finish(w1, 1.0) and analysis.can_finish(w1, None)
+    instance = game.create_new_game()
+    instance.add_player(Player('test', 'player'), 'testy', 'mctestpants')
+    state = instance.player_states[0]
+    assert state.progress() == 0.0 and state.can_finish()
+    state.move_to(w1)
+    assert state.progress() == 0.5 and not state.can_finish()
+    end.add_destination(start)
+    with pytest.raises(GameGraphException):
+        game.reachability()
+
+
+def test_safe_moves():
+    game = Game('test', energy=2.5)
+    start = Waypoint(game.graph, 'start')
+    steep = Waypoint(game.graph, 'steep')
+    flat = Waypoint(game.graph, 'flat')
+    hidden = Waypoint(game.graph, 'hidden')
+    end = Waypoint(game.graph, 'end')
+    start.add_destination(steep, 1.0)
+    start.add_destination(flat, 1.0)
+    start.add_task(Task(hidden, 'test description', 'test text', 'answer'))
+    steep.add_destination(end, 2.0)
+    flat.add_destination(end, 0.5)
+    hidden.add_destination(end, 3.0)
+    game.set_start(start)
+    analysis = game.reachability()
+    assert analysis.route(start) == [start, flat, end]
+    assert analysis.safe_moves(start, 2.5) == [flat] and analysis.safe_moves(start) == [steep, flat, hidden]
+    instance = game.create_new_game()
+    instance.add_player(Player('test', 'player'), 'testy', 'mctestpants')
+    state = instance.player_states[0]
+    assert state.available_moves('answer') == {steep, flat, hidden}
+    assert state.available_moves('answer', safe=True) == {flat}
+    state.move_to(flat)
+    assert state.available_moves(safe=True) == {end}
+
+
+def test_generated_game():
+    game = generate_game('generated', 200, npcs=2, dialog_depth=2)
+    assert nx.is_directed_acyclic_graph(game.graph) and game.start_is_set()
+    assert len(game.graph.nodes) == 200 and sum(len(w.tasks) for w in game.graph.nodes) == 39
+    assert all(nx.is_directed_acyclic_graph(n.dialog.graph) for n in game.npcs)
+    instance = game.create_new_game()
+    instance.add_player(Player('test', 'player'), 'testy', 'mctestpants')
+    state = instance.player_states[0]
+    assert set(game.start.all_path_nodes()) == set(nx.dfs_tree(game.graph, game.start))
+    while not state.is_finished():
+        state.move_to(sorted(state.available_moves(SOLUTION), key=lambda w: w.title)[0], SOLUTION)
+
+
+def test_frozen_game():
+    game = generate_game('frozen', 50, npcs=1, dialog_depth=2)
+    game.freeze()
+    start = game.start
+    with pytest.raises(GameGraphException):
+        start.add_destination(list(game.graph.nodes)[-1])
+    with pytest.raises(GameGraphException):
+        game.set_start(start)
+    with pytest.raises(GameGraphException):
+        game.invalidate()
+    with pytest.raises(DialogGraphException):
+        game.npcs[0].dialog.invalidate()
+    assert game.start is start and game.moves() is game.moves() and game.reachability() is game.reachability()
+    # players move through a frozen game as through any other
+    instance = game.create_new_game()
+    instance.add_player(Player('test', 'player'), 'testy', 'mctestpants')
+    state = instance.player_states[0]
+    while not state.is_finished():
+        state.move_to(sorted(state.available_moves(SOLUTION), key=lambda w: w.title)[0], SOLUTION)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import json
+
+import pytest
+from arango.exceptions import ArangoError
+
+from database.buffer import WriteBehindBuffer, write_buffer, SYNC, BATCHED
+from database.instance import document, snapshot_document, snapshots, event_document, restore, attach, pending, \
+    append, update, save, InstanceStateException
+from model.player import Player
+from test.test_coder import create_instance
+from util.coder import decode, encode
+
+
+def store(o):
+    return json.loads(json.dumps(o))
+
+
+def test_instance_document_without_player_states():
+    instance = create_instance()
+    db_instance = store(document(instance))
+    assert db_instance['players'] is None
+    assert all(not n['paths'] for n in db_instance['npcs'])
+    assert db_instance['player_ids'] == [instance.player_states[0].player.id.hex]
+    assert len(instance.player_states) == 1 and instance.npc_states[0].paths
+
+
+def test_events_are_numbered_per_instance():
+    instance = create_instance()
+    instance.sequence = 10
+    events = pending(instance)
+    assert [e['seq'] for e in events] == list(range(11, 11 + len(events)))
+    assert len(set(e['_key'] for e in events)) == len(events)
+    kinds = [e['type'] for e in events]
+    assert kinds.count('moved') == 1 and 'dialog' in kinds and 'npc' in kinds and 'item' in kinds
+
+
+def test_replay_events_after_snapshot():
+    instance = create_instance()
+    state = instance.player_states[0]
+    # a snapshot taken before the first move, followed by the events since
+    db_snapshot = store(snapshot_document(instance, state))
+    db_snapshot['path'] = db_snapshot['path'][:1]
+    db_snapshot['dialogs'] = {}
+    db_snapshot['inventory'] = {}
+    db_snapshot['budget'] = 0.0
+    db_snapshot['npc_paths'] = {k: v[:1] for k, v in db_snapshot['npc_paths'].items()}
+    events = [store(event_document(instance, state, seq, d)) for seq, d in enumerate(state.deltas, 1)]
+
+    loaded = decode(store(document(instance)))
+    restore(loaded, [{'snapshot': db_snapshot, 'events': events}], len(events))
+    loaded.game = instance.game
+    attach(loaded)
+    assert loaded.sequence == len(events)
+    assert loaded.stale == {state.player.id.hex}
+    assert encode(loaded.player_states[0]) == encode(state)
+    assert encode(loaded.npc_states[0]) == encode(instance.npc_states[0])
+
+    partial = decode(store(document(instance)))
+    restore(partial, [{'snapshot': db_snapshot, 'events': events[:1]}], 1)
+    assert partial.sequence == 1
+    assert len(partial.player_states[0].path) == 1
+
+
+def test_snapshot_only_changed_players():
+    instance = create_instance()
+    instance.add_player(Player('other', 'player'), 'other', 'player')
+    instance.sequence = 0
+    db = Database()
+    append(db, instance)
+    changed = instance.player_states[0].player.id.hex
+    assert instance.stale == {changed}
+    documents = snapshots(instance)
+    assert [d['player_id'] for d in documents] == [changed]
+    assert documents[0]['_key'] == f'{instance.id.hex}-{changed}-{instance.sequence}'
+
+
+class Collection(object):
+    def __init__(self, documents, fail=None):
+        self.documents = documents
+        self.fail = fail
+
+    def insert(self, document, overwrite=False):
+        self.documents[document['_key']] = document
+
+    def insert_many(self, documents, overwrite=False, silent=False):
+        results = []
+        for document in documents:
+            if document['_key'] in self.documents or document['_key'] == self.fail:
+                results.append(ArangoError('unique constraint violated'))
+            else:
+                self.documents[document['_key']] = document
+                results.append({'_key': document['_key']})
+        return results
+
+
+class Database(object):
+    """
+    stream transactions over in memory collections, written documents are only kept on commit
+    """
+    def __init__(self, fail=None):
+        self.documents = {}
+        self.staged = None
+        self.fail = fail
+
+    def begin_transaction(self, write=None):
+        self.staged = dict(self.documents)
+        return self
+
+    def collection(self, name):
+        return Collection(self.staged, self.fail)
+
+    def commit_transaction(self):
+        self.documents = self.staged
+
+    def abort_transaction(self):
+        self.staged = None
+
+
+def test_append_is_atomic():
+    instance = create_instance()
+    instance.sequence = 0
+    changes = len(pending(instance))
+    db = Database(fail=f'{instance.id.hex}-2')
+    with pytest.raises(InstanceStateException):
+        append(db, instance)
+    # nothing of the batch is stored and the changes are kept with the same numbers
+    assert not db.documents and instance.sequence == 0 and len(pending(instance)) == changes
+    db.fail = None
+    assert append(db, instance) == changes
+    assert len(db.documents) == changes and instance.sequence == changes
+    assert not any(s.deltas for s in instance.player_states)
+
+
+def test_update_saves_new_instances_then_appends_changes(monkeypatch):
+    monkeypatch.setattr('database.buffer.buffer', WriteBehindBuffer(SYNC))
+    instance = create_instance()
+    db = Database()
+    player = instance.player_states[0].player.id.hex
+    assert update(db, instance) == 0 and instance.sequence == 0
+    assert set(db.documents) == {instance.id.hex, f'{instance.id.hex}-{player}-0'}
+    state = instance.player_states[0]
+    state.move_to(next(iter(state.available_moves())))
+    assert update(db, instance) == 1 and instance.sequence == 1
+    assert db.documents[f'{instance.id.hex}-1']['type'] == 'moved' and not state.deltas
+    assert len(db.documents) == 3
+
+
+def test_batched_updates_are_written_before_a_save(monkeypatch):
+    db = Database()
+    db.staged = db.documents
+    monkeypatch.setattr('database.buffer.buffer', WriteBehindBuffer(BATCHED, interval=60, db=db))
+    instance = create_instance()
+    update(db, instance)
+    state = instance.player_states[0]
+    state.move_to(next(iter(state.available_moves())))
+    assert update(db, instance) == 1 and f'{instance.id.hex}-1' not in db.documents
+    save(db, instance)
+    assert db.documents[f'{instance.id.hex}-1']['type'] == 'moved' and instance.sequence == 1
+    write_buffer().shutdown()
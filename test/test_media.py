@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import io
+import os
+from threading import Thread
+
+from flask import Flask
+from PIL import Image
+
+from api.media import media_response, get_variant
+from database.derivative import DerivativeCache
+from database.media import FileMediaStore, externalize
+from model.component import Video
+from model.game import Game, Waypoint, Level
+from model.media import Media, digest
+from model.task import Task
+from util.coder import encode, decode
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 1024
+
+
+def test_file_store(tmp_path):
+    store = FileMediaStore(str(tmp_path))
+    media = store.put(IMAGE)
+    assert media.key == digest(IMAGE) and media.size == len(IMAGE) and media.content_type == 'image/png'
+    assert store.put(IMAGE) == media
+    assert store.stat(media.key).size == len(IMAGE)
+    assert store.stat('0' * 64) is None and store.stat('../secret') is None
+    assert b''.join(store.read(media.key)) == IMAGE
+    assert b''.join(store.read(media.key, 100, 200000)) == IMAGE[100:200000]
+
+
+def test_externalize(tmp_path):
+    store = FileMediaStore(str(tmp_path))
+    game = Game('test', IMAGE)
+    start = Waypoint(game.graph, 'start', level=Level('first', IMAGE))
+    end = Waypoint(game.graph, 'end')
+    start.add_task(Task(end, 'task', 'task', 'answer', media=b'some media'))
+    game.set_start(start)
+    assert externalize(store, game) == 3
+    assert game.image == start.level.icon == Media(digest(IMAGE))
+    document = encode(start.level)
+    assert document['icon'] == f'sha256:{digest(IMAGE)}'
+    assert decode(document).icon == game.image
+    assert decode(encode(start.tasks[0])).media == Media(digest(b'some media'))
+    assert externalize(store, game) == 3
+
+
+def test_media_response(tmp_path):
+    store = FileMediaStore(str(tmp_path))
+    media = store.put(IMAGE)
+    app = Flask(__name__)
+    with app.test_request_context():
+        response = media_response(store, media)
+        assert response.status_code == 200 and response.get_etag() == (media.key, False)
+        assert 'immutable' in response.headers['Cache-Control'] and response.mimetype == 'image/png'
+        assert b''.join(response.response) == IMAGE
+        response.close()
+    with app.test_request_context(headers={'Range': 'bytes=10-19'}):
+        response = media_response(store, media)
+        assert response.status_code == 206 and response.headers['Content-Range'] == f'bytes 10-19/{len(IMAGE)}'
+        assert b''.join(response.response) == IMAGE[10:20]
+    with app.test_request_context(headers={'Range': 'bytes=-5'}):
+        assert b''.join(media_response(store, media).response) == IMAGE[-5:]
+    with app.test_request_context(headers={'Range': f'bytes={len(IMAGE)}-'}):
+        assert media_response(store, media).status_code == 416
+    with app.test_request_context(headers={'Range': 'bytes=0-9', 'If-Range': '"other"'}):
+        assert media_response(store, media).status_code == 200
+    with app.test_request_context(headers={'If-None-Match': f'"{media.key}"'}):
+        assert media_response(store, media).status_code == 304
+
+
+def test_video(tmp_path):
+    store = FileMediaStore(str(tmp_path))
+    clip = b'\x1aE\xdf\xa3' + bytes(range(256)) * 4096
+    game = Game('test')
+    start = Waypoint(game.graph, 'start')
+    video = Video(game.graph, 'video', io.BytesIO(clip), 'a clip', duration=12.5)
+    start.add_destination(video)
+    game.set_start(start)
+    assert externalize(store, game) == 1
+    assert video.fragment == Media(digest(clip)) and video.fragment.size == len(clip)
+    document = encode(video)
+    assert document['_type'] == 'Video' and document['fragment'] == f'sha256:{digest(clip)}'
+    assert document['content_type'] == 'video/webm' and document['size'] == len(clip)
+    decoded = decode(document)
+    assert isinstance(decoded, Video) and decoded.duration == 12.5 and decoded.caption == 'a clip'
+    assert decoded.fragment.size == len(clip) and decoded.fragment.content_type == 'video/webm'
+    assert store.put_file(io.BytesIO(clip)) == video.fragment
+    assert b''.join(store.read(video.fragment.key, len(clip) - 10)) == clip[-10:]
+
+
+def png(width, height):
+    output = io.BytesIO()
+    Image.new('RGBA', (width, height), (200, 100, 50, 255)).save(output, 'PNG')
+    return output.getvalue()
+
+
+def test_derivatives(tmp_path):
+    store = FileMediaStore(str(tmp_path / 'media'))
+    original = store.put(png(1200, 600))
+    cache = DerivativeCache(str(tmp_path / 'derivatives'), 1024 * 1024)
+    rendered = []
+    read = store.read
+    store.read = lambda *args: rendered.append(args) or read(*args)
+    threads = [Thread(target=cache.get, args=(store, original.key, 'thumbnail', 'webp')) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(rendered) == 1
+    thumbnail = cache.get(store, original.key, 'thumbnail', 'webp')
+    assert thumbnail.content_type == 'image/webp' and thumbnail.size < original.size
+    with Image.open(io.BytesIO(b''.join(cache.read(thumbnail.key)))) as image:
+        assert image.size == (160, 80)
+    card = cache.get(store, original.key, 'card', 'jpeg')
+    assert cache.stats()['hits'] >= 1 and cache.stats()['misses'] == 2
+    assert cache.get(store, '0' * 64, 'card', 'jpeg') is None
+    cache.maxbytes = card.size
+    cache.get(store, original.key, 'card', 'jpeg')
+    cache._evict()
+    assert cache.stats()['size'] == 1 and not (tmp_path / 'derivatives' / thumbnail.key).exists()
+    assert DerivativeCache(str(tmp_path / 'derivatives'), 1024 * 1024).stats()['weight'] == card.size
+
+
+def test_variant_evicted_before_it_is_opened(tmp_path, monkeypatch):
+    store = FileMediaStore(str(tmp_path / 'media'))
+    original = store.put(png(1200, 600))
+    cache = DerivativeCache(str(tmp_path / 'derivatives'), 1024 * 1024)
+    get = cache.get
+    lookups = []
+
+    def evicting(*args):
+        media = get(*args)
+        lookups.append(media)
+        if len(lookups) == 1:
+            # another request pushes the variant out right after the lookup
+            with cache._lock:
+                cache.weight -= cache._entries.pop(media.key)
+            os.unlink(cache.path(media.key))
+        return media
+    cache.get = evicting
+    monkeypatch.setattr('api.media.derivative_cache', lambda: cache)
+    monkeypatch.setattr('api.media.media_store', lambda: store)
+    with Flask(__name__).test_request_context():
+        response = get_variant(original.key, 'thumbnail')
+        assert response.status_code == 200 and len(lookups) == 2 and cache.stats()['misses'] == 2
+        assert b''.join(response.response) == b''.join(cache.read(lookups[-1].key))
+        response.close()
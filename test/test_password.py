@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import pytest
+
+from database.player import hash_password, verify_password, needs_rehash, password_executor, LEGACY_ITERATIONS
+from util.executor import BoundedExecutor, ExecutorBusyException
+
+
+def test_verify_and_rehash(monkeypatch):
+    monkeypatch.setenv('PASSWORD_ITERATIONS', '1000')
+    stored = hash_password('secret', 'salt')
+    assert verify_password(stored, 'secret')
+    assert not verify_password(stored, 'wrong')
+    assert not needs_rehash(stored)
+    assert password_executor().run(verify_password, stored, 'secret')
+    monkeypatch.setenv('PASSWORD_ITERATIONS', '2000')
+    assert needs_rehash(stored)
+    assert verify_password(stored, 'secret')
+
+
+def test_verify_legacy_password():
+    legacy = hash_password('secret', 'salt', LEGACY_ITERATIONS).split('$', 2)[2].replace('$', '')
+    assert verify_password(legacy, 'secret')
+    assert needs_rehash(legacy)
+
+
+def test_executor_backpressure():
+    executor = BoundedExecutor(1, 0, 0.01)
+    executor._slots.acquire()
+    with pytest.raises(ExecutorBusyException):
+        executor.run(sum, [1, 2])
+    executor._slots.release()
+    assert executor.run(sum, [1, 2]) == 3
+    assert executor.stats()['rejected'] == 1
+    executor.shutdown()
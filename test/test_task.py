@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from model.task import Task, Answer, TaskSolverException, solve_text, solve_equal, solve_list, evaluate, normalize, \
+    SCORE_CACHE_SIZE
+from util.coder import encode, decode
+
+
+def test_solver_by_solution_type():
+    assert Task(None, 'text', 'text', 'answer').solver is solve_text
+    assert Task(None, 'flag', 'flag', True).solver is solve_equal
+    task = Task(None, 'list', 'list', ['a', 'b'])
+    assert task.solver is solve_list
+    assert task.solve(['b', 'a']) and not task.solve(['a'])
+    task.solution = 'answer'
+    assert task.solver is solve_text
+    assert Task(None, 'any', 'any').solve('whatever')
+    assert not Task(None, 'int', 'int', 42).solve('42')
+    assert Task(None, 'date', 'date', datetime(2020, 1, 1)).solve(datetime(2020, 1, 1) + timedelta(hours=2))
+    with pytest.raises(TaskSolverException):
+        Task(None, 'set', 'set', {'a'}).solve({'a'})
+
+
+def test_answer_batch():
+    tasks = [Task(None, f'task {n}', 'task', solution) for n, solution in
+             enumerate(['the capital of france is paris', 'berlin', 'madrid', 42, None])]
+    answer = Answer('paris')
+    assert answer.solve(tasks) == [task.solve('paris') for task in tasks] == [True, False, False, False, True]
+    # memoized per task
+    answer.results[tasks[1].id] = True
+    assert answer.solves(tasks[1])
+    assert evaluate(answer) is answer
+    assert evaluate(42).solve(tasks) == [False, False, False, True, True]
+
+
+def test_normalized_variants():
+    assert normalize('  Café   de  la Paix! ') == 'cafe de la paix'
+    task = Task(None, 'text', 'text', 'Café de la Paix', ratio=95, alternatives=['Grand Café'])
+    assert task.variants == {'cafe de la paix', 'grand cafe'}
+    assert task.solve('cafe DE la paix') and task.solve('GRAND   café.')
+    assert task.scores is None
+    assert not task.solve('hotel')
+    assert task.lookup('hotel') is False
+    for n in range(SCORE_CACHE_SIZE + 1):
+        task.solve(f'hotel {n}')
+    assert len(task.scores) == SCORE_CACHE_SIZE and 'hotel' not in task.scores
+    assert Answer('grand cafe').solve([task]) == [True]
+    assert task.solve('cafe de la pai')
+    task.ratio = 100
+    assert task.scores is None and not task.solve('cafe de la pai')
+    loaded = decode(encode(task))
+    assert loaded.alternatives == ['Grand Café'] and loaded.variants == task.variants
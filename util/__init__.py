@@ -1,4 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
 
+import util.cache
 import util.coder
+import util.executor
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+from collections import OrderedDict
+from threading import RLock
+from time import monotonic
+
+
+class LRUCache(object):
+    """
+    Thread safe least recently used cache, entries can have a time to live
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = None, maxweight: int = None, weigher=None):
+        """
+        bounded cache that evicts the least recently used entry when full
+        :param maxsize: maximum number of entries
+        :param ttl: default time to live of an entry in seconds (None is forever)
+        :param maxweight: maximum total weight of all entries (None is unbounded)
+        :param weigher: function returning the weight of a value, for example its estimated size in bytes
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigher = weigher
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = RLock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def get(self, key, default=None):
+        """
+        get an entry and mark it as recently used
+        :param key: entry key
+        :param default: returned if the entry does not exist or has expired
+        :return: value or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires, weight = entry
+            if expires is not None and expires < monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl: float = None):
+        """
+        add or replace an entry, evicting the least recently used entries if the cache is full
+        :param key: entry key
+        :param value: entry value
+        :param ttl: time to live in seconds, defaults to the time to live of the cache
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        weight = self.weigher(value) if self.weigher else 0
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, monotonic() + ttl if ttl is not None else None, weight)
+            self.weight += weight
+            while len(self._entries) > self.maxsize or \
+                    (self.maxweight is not None and self.weight > self.maxweight and len(self._entries) > 1):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """
+        remove an entry
+        :param key: entry key
+        :param default: returned if the entry does not exist
+        :return: value or default
+        """
+        with self._lock:
+            entry = self._remove(key)
+            return entry[0] if entry else default
+
+    def clear(self):
+        """
+        remove all entries
+        """
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.weight -= entry[2]
+        return entry
+
+    def stats(self) -> dict:
+        """
+        cache statistics
+        :return: dict with hits, misses, evictions, size, maxsize, weight and maxweight
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries), 'maxsize': self.maxsize,
+                    'weight': self.weight, 'maxweight': self.maxweight}
@@ -3,29 +3,129 @@
 
 import base64
 import json
+from abc import ABC, abstractmethod
 from datetime import datetime
 
 from json import JSONEncoder, JSONDecoder
-from time import strptime
 from uuid import UUID
 
+import msgpack
 import networkx as nx
 
+from model.component import Video
 from model.dialog import Speech, Mail, Dialog
 from model.game import Waypoint, Level, Game
 from model.instance import GameInstance
-from model.player import PlayerState, NonPlayableCharacterState, Player
+from model.media import Media
+from model.player import PlayerState, NonPlayableCharacterState, Player, NonPlayableCharacter
 from model.task import Task
 
+# version 1 embedded nested objects as json strings, version 2 nests them as json objects
+CODEC_VERSION = 2
+STAMP_FORMAT = '%Y-%m-%d %H-%M-%S-%f'
+
+
+def encode_stamp(stamp: datetime):
+    return stamp.strftime(STAMP_FORMAT) if stamp else None
+
+
+def decode_stamp(value: str):
+    return datetime.strptime(value, STAMP_FORMAT) if value else None
+
+
+def encode_blob(blob: bytes):
+    """
+    base64 encode binary data as text so it can be stored in a json document
+    :param blob: binary data
+    :return: base64 string or None
+    """
+    return base64.b64encode(blob).decode('ascii') if blob else None
+
+
+def decode_blob(value):
+    """
+    decode base64 text back to binary data, binary formats carry the data as is and media references are
+    returned as a reference to the media store
+    :param value: base64 string, media reference or bytes
+    :return: binary data, Media or None
+    """
+    if not value:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return Media.parse(value) or base64.b64decode(value.encode('ascii'))
+
+
+def legacy(obj: dict) -> bool:
+    """
+    check if a document was written by the version 1 codec
+    :param obj: encoded document
+    :return: True if nested objects are embedded as json strings
+    """
+    return obj.get('_v', 1) < 2
+
+
+def nested(obj: dict, key: str):
+    """
+    get a nested object from a document, version 1 documents embed it as a json string
+    :param obj: encoded document
+    :param key: field name
+    :return: decoded object
+    """
+    value = obj.get(key)
+    if legacy(obj) and isinstance(value, str):
+        return json.loads(value, cls=MarugotoDecoder)
+    return value
+
+
+def items(obj: dict):
+    """
+    get the items of a document, version 1 documents embed each item as a json string
+    :param obj: encoded document
+    :return: list of items or None
+    """
+    if not obj.get('items'):
+        return None
+    if legacy(obj):
+        return [json.loads(i, cls=MarugotoDecoder) for i in obj['items']]
+    return list(obj['items'])
+
+
+def reference(o):
+    """
+    reference to an object by its id, decoded documents hold the id itself
+    :param o: object with an id or an id
+    :return: id hex
+    """
+    return o.hex if isinstance(o, UUID) else o.id.hex
+
 
 class MarugotoEncoder(JSONEncoder):
     """
     Our custom serializer for transferring our objects to the database and over the API
+    nested objects are returned as is, so the encoder handles them while walking the result in a single pass
     """
+    def __init__(self, *args, binary: bool = False, **kwargs):
+        """
+        :param binary: keep binary data as bytes for formats that support it, instead of base64 text
+        """
+        super().__init__(*args, **kwargs)
+        self.binary = binary
+
+    def blob(self, data):
+        if not data:
+            return None
+        if isinstance(data, Media):
+            return str(data)
+        return bytes(data) if self.binary else encode_blob(data)
+
     def default(self, o):
+        if isinstance(o, Media):
+            return str(o)
         if isinstance(o, Waypoint):
-            return {
+            document = {
                 '_type': 'Waypoint',
+                '_v': CODEC_VERSION,
                 '_key': o.id.hex,
                 'title': o.title,
                 'description': o.description,
@@ -33,45 +133,60 @@ class MarugotoEncoder(JSONEncoder):
                 'money_limit': o.money_limit,
                 'budget_modification': o.budget_modification,
                 'timer_visible': o.timer_visible,
-                'level': json.dumps(o.level, cls=MarugotoEncoder),
+                'level': o.level,
                 'tasks': [t.id.hex for t in o.tasks],
-                'items': [json.dumps(i) for i in o.items] if o.items else None,
+                'items': o.items if o.items else None,
                 'interactions': [i.id.hex for i in o.interactions]
             }
+            if isinstance(o, Video):
+                # only the reference and its metadata, the fragment itself is streamed from the media store
+                media = o.fragment if isinstance(o.fragment, Media) else None
+                document.update({
+                    '_type': 'Video',
+                    'fragment': self.blob(o.fragment),
+                    'size': media.size if media else None,
+                    'content_type': media.content_type if media else None,
+                    'duration': o.duration,
+                    'caption': o.caption
+                })
+            return document
         if isinstance(o, Level):
-            icon = base64.encodebytes(o.icon) if o.icon else None
             return {
                 '_type': 'Level',
+                '_v': CODEC_VERSION,
                 'title': o.title,
-                'icon': icon
+                'icon': self.blob(o.icon)
             }
         if isinstance(o, Task):
-            media = json.dumps(base64.encodebytes(o.media)) if o.media else None
             return {
                 '_type': 'Task',
+                '_v': CODEC_VERSION,
                 '_key': o.id.hex,
                 'destination': o.destination.id.hex if o.destination else None,
                 'description': o.description,
                 'text': o.text,
                 'solution': o.solution,
-                'media': media,
-                'items': [json.dumps(i) for i in o.items] if o.items else None,
+                'media': self.blob(o.media),
+                'items': o.items if o.items else None,
                 'time_limit': o.time_limit,
                 'money_limit': o.money_limit,
                 'budget_modification': o.budget_modification,
                 'ratio': o.ratio,
                 'days': o.days,
-                'offset': o.offset
+                'offset': o.offset,
+                'alternatives': o.alternatives if o.alternatives else None
             }
         if isinstance(o, Dialog):
             return {
                 '_type': 'Dialog',
+                '_v': CODEC_VERSION,
                 '_key': o.id.hex,
-                'start': o.start.id.hex
+                'start': reference(o.start)
             }
         if isinstance(o, Mail):
             return {
                 '_type': 'Mail',
+                '_v': CODEC_VERSION,
                 '_key': o.id.hex,
                 'destination': o.destination.id.hex if o.destination else None,
                 'description': o.description,
@@ -80,13 +195,14 @@ class MarugotoEncoder(JSONEncoder):
                 'budget_modification': o.budget_modification,
                 'waypoints': [w.id.hex for w in o.waypoints],
                 'task': o.task.id.hex if o.task else None,
-                'items': [json.dumps(i) for i in o.items] if o.items else None,
+                'items': o.items if o.items else None,
                 'subject': o.subject,
                 'body': o.body
             }
         if isinstance(o, Speech):
             return {
                 '_type': 'Speech',
+                '_v': CODEC_VERSION,
                 '_key': o.id.hex,
                 'destination': o.destination.id.hex if o.destination else None,
                 'description': o.description,
@@ -95,91 +211,99 @@ class MarugotoEncoder(JSONEncoder):
                 'budget_modification': o.budget_modification,
                 'waypoints': [w.id.hex for w in o.waypoints],
                 'task': o.task.id.hex if o.task else None,
-                'items': [json.dumps(i) for i in o.items] if o.items else None,
+                'items': o.items if o.items else None,
                 'content': o.content
             }
         if isinstance(o, Game):
             return {
                 '_type': 'Game',
+                '_v': CODEC_VERSION,
                 'title': o.title,
-                'image': base64.encodebytes(o.image) if o.image else None,
-                'start': o.start.id.hex,
+                'image': self.blob(o.image),
+                'start': reference(o.start),
                 'energy': o.energy
             }
         if isinstance(o, GameInstance):
             return {
                 '_type': 'GameInstance',
+                '_v': CODEC_VERSION,
                 '_key': o.id.hex,
                 'name': o.name,
-                'game': json.dumps(o.game, cls=MarugotoEncoder),
-                'game_master': json.dumps(o.game_master, cls=MarugotoEncoder),
-                'created_at': o.created_at.strftime('%Y-%m-%d %H-%M-%S-%f'),
-                'starts_at': o.starts_at.strftime('%Y-%m-%d %H-%M-%S-%f') if o.starts_at else None,
-                'ends_at': o.ends_at.strftime('%Y-%m-%d %H-%M-%S-%f') if o.ends_at else None,
-                'players': [json.dumps(p, cls=MarugotoEncoder) for p in o.player_states] if o.player_states else None,
-                'npcs': [json.dumps(n, cls=MarugotoEncoder) for n in o.npc_states] if o.npc_states else None
+                'game': o.game,
+                'game_master': o.game_master,
+                'created_at': encode_stamp(o.created_at),
+                'starts_at': encode_stamp(o.starts_at),
+                'ends_at': encode_stamp(o.ends_at),
+                'players': o.player_states if o.player_states else None,
+                'npcs': o.npc_states if o.npc_states else None
             }
         if isinstance(o, Player):
             return {
                 '_type': 'Player',
+                '_v': CODEC_VERSION,
                 '_key': o.id.hex,
                 'mail': o.email,
                 'password': o.password
             }
         if isinstance(o, PlayerState):
-            dialogs = {}
-            for npc, interactions in o.dialogs:
-                dialogs[f'{npc.first_name} {npc.last_name}'] = [{'stamp': d.strftime('%Y-%m-%d %H-%M-%S-%f'),
-                                                                 'interaction': json.dumps(i, cls=MarugotoEncoder),
-                                                                 'response': r
-                                                                 } for d, i, r in interactions]
-            inventory = {}
-            for stamp, kvs in o.inventory.items():
-                inventory[stamp.strftime('%Y-%m-%d %H-%M-%S-%f')] = [{
-                    'key': val[0].id.hex,
-                    'value': json.dumps(val[1])
-                } for val in kvs]
+            # waypoints, interactions and inventory holders are stored as references into the game
             return {
                 '_type': 'PlayerState',
+                '_v': CODEC_VERSION,
                 '_key': f'{o.player.email}-{o.game_instance.id.hex}',
-                'player': json.dumps(o.player, cls=MarugotoEncoder),
+                'player': o.player,
                 'game': o.game_instance.id.hex,
                 'first': o.first_name,
                 'last': o.last_name,
                 'energy': o.energy,
                 'budget': o.budget,
-                'path': [json.dumps(w, cls=MarugotoEncoder) for w in o.path],
-                'dialogs': dialogs,
-                'inventory': inventory,
+                'path': [{'stamp': encode_stamp(d), 'waypoint': reference(w)} for d, w in o.path],
+                'dialogs': {str(npc): [{'stamp': encode_stamp(d),
+                                        'interaction': reference(i),
+                                        'response': r} for d, i, r in interactions]
+                            for npc, interactions in o.dialogs.items()},
+                'inventory': {encode_stamp(stamp): [{'key': reference(k), 'value': v} for k, v in kvs]
+                              for stamp, kvs in o.inventory.items()}
             }
         if isinstance(o, NonPlayableCharacterState):
-            paths = {}
-            for player, interactions in o.paths.items():
-                paths[json.dumps(player, cls=MarugotoEncoder)] = [{'stamp': d.strftime('%Y-%m-%d %H-%M-%S-%f'),
-                                                                   'interaction': json.dumps(i, cls=MarugotoEncoder)
-                                                                   } for d, i in interactions]
             return {
                 '_type': 'NonPlayableCharacterState',
+                '_v': CODEC_VERSION,
                 '_key': f'{o.first_name} {o.last_name}',
                 'game': o.game_instance.id.hex,
                 'first': o.first_name,
                 'last': o.last_name,
-                'dialog': json.dumps(o.dialog, cls=MarugotoEncoder),
+                'dialog': o.dialog,
+                'salutation': o.salutation,
+                'mail': o.mail,
+                'image': self.blob(o.image),
+                'paths': [{'player': reference(p.player if isinstance(p, PlayerState) else p),
+                           'interactions': [{'stamp': encode_stamp(d), 'interaction': reference(i)}
+                                            for d, i in interactions]}
+                          for p, interactions in o.paths.items()]
+            }
+        if isinstance(o, NonPlayableCharacter):
+            return {
+                '_type': 'NonPlayableCharacter',
+                '_v': CODEC_VERSION,
+                'first': o.first_name,
+                'last': o.last_name,
+                'dialog': o.dialog,
                 'salutation': o.salutation,
                 'mail': o.mail,
-                'image': base64.encodebytes(o.image) if o.image else None,
-                'paths': paths
+                'image': self.blob(o.image)
             }
         if isinstance(o, UUID):
             return {'_type': 'UUID', 'value': o.hex}
         if isinstance(o, datetime):
-            return {'_type': 'STAMP', 'value': o.strftime('%Y-%m-%d %H-%M-%S-%f')}
+            return {'_type': 'STAMP', 'value': encode_stamp(o)}
         return JSONEncoder.default(self, o)
 
 
 class MarugotoDecoder(JSONDecoder):
     """
     Our custom deserializer for receiving our objects from the database and from the API
+    objects are decoded inside out, so nested objects have been decoded by the time their parent is
     """
     def __init__(self, *args, **kwargs):
         json.JSONDecoder.__init__(self, object_hook=self.object_hook, *args, **kwargs)
@@ -188,42 +312,47 @@ class MarugotoDecoder(JSONDecoder):
     def object_hook(obj):
         if '_type' not in obj:
             return obj
-        if obj['_type'] == 'Waypoint':
-            waypoint = Waypoint(nx.DiGraph(),
-                                obj['title'],
-                                obj['description'],
-                                obj['time_limit'],
-                                obj['money_limit'],
-                                obj['budget_modification'],
-                                [json.loads(i, cls=MarugotoDecoder) for i in obj['items']] if 'items' in obj and obj['items'] else None,
-                                obj['timer_visible'],
-                                json.loads(obj['level'], cls=MarugotoDecoder))
+        if obj['_type'] in ('Waypoint', 'Video'):
+            fields = (obj['description'],
+                      obj['time_limit'],
+                      obj['money_limit'],
+                      obj['budget_modification'],
+                      items(obj),
+                      obj['timer_visible'],
+                      nested(obj, 'level'))
+            if obj['_type'] == 'Video':
+                fragment = decode_blob(obj['fragment'])
+                if isinstance(fragment, Media):
+                    fragment.size = obj.get('size')
+                    fragment.content_type = obj.get('content_type')
+                description, time_limit, money_limit, budget_modification, waypoint_items, timer_visible, level = fields
+                waypoint = Video(nx.DiGraph(), obj['title'], fragment, obj.get('caption'), description, time_limit,
+                                 money_limit, timer_visible, level, budget_modification=budget_modification,
+                                 items=waypoint_items, duration=obj.get('duration'))
+            else:
+                waypoint = Waypoint(nx.DiGraph(), obj['title'], *fields)
             waypoint.id = UUID(obj['_key'])
-            if 'items' in obj and obj['items']:
-                for i in obj['items']:
-                    waypoint.items.append(json.loads(i, cls=MarugotoDecoder))
             for t in obj['tasks']:
                 waypoint.tasks.append(UUID(t))
             for i in obj['interactions']:
                 waypoint.interactions.append(UUID(i))
             return waypoint
         if obj['_type'] == 'Level':
-            icon = base64.decodebytes(obj['icon']) if obj['icon'] else None
-            return Level(obj['title'], icon)
+            return Level(obj['title'], decode_blob(obj['icon']))
         if obj['_type'] == 'Task':
-            media = base64.decodebytes(obj['media']) if obj['media'] else None
             task = Task(None,
                         obj['description'],
                         obj['text'],
                         obj['solution'],
-                        media,
-                        [json.loads(i, cls=MarugotoDecoder) for i in obj['items']] if 'items' in obj and obj['items'] else None,
+                        decode_blob(obj['media']),
+                        items(obj),
                         obj['time_limit'],
                         obj['money_limit'],
                         obj['budget_modification'],
                         obj['ratio'],
                         obj['days'],
-                        obj['offset'])
+                        obj['offset'],
+                        obj.get('alternatives'))
             task.id = UUID(obj['_key'])
             if obj['destination']:
                 task.destination = UUID(obj['destination'])
@@ -241,7 +370,7 @@ class MarugotoDecoder(JSONDecoder):
                         obj['time_limit'],
                         obj['money_limit'],
                         obj['budget_modification'],
-                        [json.loads(i, cls=MarugotoDecoder) for i in obj['items']] if 'items' in obj and obj['items'] else None)
+                        items(obj))
             mail.id = UUID(obj['_key'])
             if obj['destination']:
                 mail.destination = UUID(obj['destination'])
@@ -257,7 +386,7 @@ class MarugotoDecoder(JSONDecoder):
                             obj['time_limit'],
                             obj['money_limit'],
                             obj['budget_modification'],
-                            [json.loads(i, cls=MarugotoDecoder) for i in obj['items']] if 'items' in obj and obj['items'] else None)
+                            items(obj))
             speech.id = UUID(obj['_key'])
             if obj['destination']:
                 speech.destination = UUID(obj['destination'])
@@ -268,64 +397,187 @@ class MarugotoDecoder(JSONDecoder):
             return speech
         if obj['_type'] == 'Game':
             game = Game(obj['title'])
-            game.image = base64.decodebytes(obj['image']) if obj['image'] else None
+            game.image = decode_blob(obj['image'])
             game.energy = obj['energy']
             game.start = UUID(obj['start'])
             return game
         if obj['_type'] == 'GameInstance':
-            game_instance = GameInstance(json.loads(obj['game'], cls=MarugotoDecoder),
+            game_instance = GameInstance(nested(obj, 'game'),
                                          obj['name'],
-                                         json.loads(obj['game_master'], cls=MarugotoDecoder),
-                                         strptime(obj['starts_at'], '%Y-%m-%d %H-%M-%S-%f') if obj['starts_at'] else None,
-                                         strptime(obj['ends_at'], '%Y-%m-%d %H-%M-%S-%f') if obj['ends_at'] else None)
-            game_instance.created_at = strptime(obj['created_at'], '%Y-%m-%d %H-%M-%S-%f')
+                                         nested(obj, 'game_master'),
+                                         decode_stamp(obj['starts_at']),
+                                         decode_stamp(obj['ends_at']))
+            game_instance.created_at = decode_stamp(obj['created_at'])
             game_instance.id = UUID(obj['_key'])
             if obj['players']:
                 for player in obj['players']:
-                    game_instance.player_states.append(json.loads(player, cls=MarugotoDecoder))
+                    game_instance.player_states.append(json.loads(player, cls=MarugotoDecoder)
+                                                       if isinstance(player, str) else player)
             if obj['npcs']:
                 for npc in obj['npcs']:
-                    game_instance.npc_states.append(json.loads(npc, cls=MarugotoDecoder))
+                    game_instance.npc_states.append(json.loads(npc, cls=MarugotoDecoder)
+                                                    if isinstance(npc, str) else npc)
             return game_instance
         if obj['_type'] == 'Player':
             player = Player(obj['mail'], obj['password'])
             player.id = UUID(obj['_key'])
             return player
         if obj['_type'] == 'PlayerState':
-            player_state = PlayerState(json.loads(obj['player'], cls=MarugotoDecoder),
+            player_state = PlayerState(nested(obj, 'player'),
                                        obj['first'],
                                        obj['last'],
                                        None,
                                        obj['budget'])
             player_state.energy = obj['energy']
-            for waypoint in obj['path']:
-                player_state.path.append(json.loads(waypoint, cls=MarugotoDecoder))
-
+            if legacy(obj):
+                # version 1 embeds (stamp, waypoint) pairs and interactions as json strings
+                for step in obj['path']:
+                    stamp, waypoint = json.loads(step, cls=MarugotoDecoder)
+                    player_state.path.append((stamp, waypoint))
+                for npc, interactions in obj['dialogs'].items():
+                    player_state.dialogs[npc] = [(decode_stamp(i['stamp']),
+                                                  json.loads(i['interaction'], cls=MarugotoDecoder),
+                                                  i['response']) for i in interactions]
+                for stamp, kvs in obj['inventory'].items():
+                    player_state.inventory[decode_stamp(stamp)] = [(UUID(kv['key']), json.loads(kv['value']))
+                                                                   for kv in kvs]
+                return player_state
+            for step in obj['path']:
+                player_state.path.append((decode_stamp(step['stamp']), UUID(step['waypoint'])))
             for npc, interactions in obj['dialogs'].items():
-                player_state.dialogs[npc] = [(strptime(i['stamp'], '%Y-%m-%d %H-%M-%S-%f'),
-                                              json.loads(i['interaction'], cls=MarugotoDecoder),
-                                              i['response']) for i in interactions]
-            for stamp, kvs in obj['inventory']:
-                player_state.inventory[strptime(stamp, '%Y-%m-%d %H-%M-%S-%f')] = [(k['key'],
-                                                                                    json.loads(v['value'])
-                                                                                    ) for k, v in kvs]
+                player_state.dialogs[npc] = [(decode_stamp(i['stamp']), UUID(i['interaction']), i['response'])
+                                             for i in interactions]
+            for stamp, kvs in obj['inventory'].items():
+                player_state.inventory[decode_stamp(stamp)] = [(UUID(kv['key']), kv['value']) for kv in kvs]
             return player_state
         if obj['_type'] == 'NonPlayableCharacterState':
             npc = NonPlayableCharacterState(obj['first'],
                                             obj['last'],
                                             None,
-                                            json.loads(obj['dialog'], cls=MarugotoDecoder),
+                                            nested(obj, 'dialog'),
                                             obj['salutation'],
                                             obj['mail'],
-                                            base64.decodebytes(obj['image']) if obj['image'] else None)
-
-            for player, interactions in obj['paths'].items():
-                npc.paths[json.loads(player, cls=MarugotoDecoder)] = [(strptime(i['stamp'], '%Y-%m-%d %H-%M-%S-%f'),
-                                                                       json.loads(i['interaction'], cls=MarugotoDecoder)
-                                                                       ) for i in interactions]
+                                            decode_blob(obj['image']))
+            if legacy(obj):
+                # version 1 keys the paths by the json of the complete player state
+                for player, interactions in obj['paths'].items():
+                    npc.paths[json.loads(player, cls=MarugotoDecoder).player.id] = [
+                        (decode_stamp(i['stamp']), json.loads(i['interaction'], cls=MarugotoDecoder))
+                        for i in interactions]
+                return npc
+            for path in obj['paths']:
+                npc.paths[UUID(path['player'])] = [(decode_stamp(i['stamp']), UUID(i['interaction']))
+                                                   for i in path['interactions']]
             return npc
+        if obj['_type'] == 'NonPlayableCharacter':
+            return NonPlayableCharacter(obj['first'],
+                                        obj['last'],
+                                        nested(obj, 'dialog'),
+                                        obj['salutation'],
+                                        obj['mail'],
+                                        decode_blob(obj['image']))
         if obj['_type'] == 'UUID':
             return UUID(obj['value'])
         if obj['_type'] == 'STAMP':
-            return strptime(obj['value'], '%Y-%m-%d %H-%M-%S-%f')
+            return decode_stamp(obj['value'])
         return obj
+
+
+encoders = {False: MarugotoEncoder(), True: MarugotoEncoder(binary=True)}
+
+
+def encode(o, binary: bool = False):
+    """
+    encode our objects to a json compatible document in a single pass, without an intermediate json string
+    :param o: object to encode
+    :param binary: keep binary data as bytes (for binary formats) instead of base64 text
+    :return: json compatible value
+    """
+    if o is None or isinstance(o, (str, int, float, bool)):
+        return o
+    if isinstance(o, dict):
+        return {k: encode(v, binary) for k, v in o.items()}
+    if isinstance(o, (list, tuple)):
+        return [encode(v, binary) for v in o]
+    if isinstance(o, (bytes, bytearray)):
+        return encoders[binary].blob(o)
+    return encode(encoders[binary].default(o), binary)
+
+
+def decode(document):
+    """
+    decode a json compatible document (as returned by the database) to our objects in a single pass
+    :param document: json compatible value
+    :return: decoded object
+    """
+    if isinstance(document, dict):
+        return MarugotoDecoder.object_hook({k: decode(v) for k, v in document.items()})
+    if isinstance(document, list):
+        return [decode(v) for v in document]
+    return document
+
+
+class Serializer(ABC):
+    """
+    Serialization backend, all backends share the type tags of the encoder and decoder
+    """
+    name = None
+    content_type = None
+
+    @abstractmethod
+    def dumps(self, o) -> bytes:
+        """
+        serialize our objects
+        :param o: object to serialize
+        :return: serialized data
+        """
+
+    @abstractmethod
+    def loads(self, data: bytes):
+        """
+        deserialize to our objects
+        :param data: serialized data
+        :return: decoded object
+        """
+
+
+class JsonSerializer(Serializer):
+    """
+    JSON text, binary data is base64 encoded
+    """
+    name = 'json'
+    content_type = 'application/json'
+
+    def dumps(self, o) -> bytes:
+        return json.dumps(encode(o)).encode('utf-8')
+
+    def loads(self, data: bytes):
+        return decode(json.loads(data))
+
+
+class MsgpackSerializer(Serializer):
+    """
+    MessagePack, binary data is carried as is
+    """
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+
+    def dumps(self, o) -> bytes:
+        return msgpack.packb(encode(o, binary=True), use_bin_type=True)
+
+    def loads(self, data: bytes):
+        return decode(msgpack.unpackb(data, raw=False))
+
+
+SERIALIZERS = {s.name: s for s in [JsonSerializer(), MsgpackSerializer()]}
+
+
+def serializer(name: str) -> Serializer:
+    """
+    get a serialization backend by name
+    :param name: json or msgpack
+    :return: serializer
+    """
+    if name not in SERIALIZERS:
+        raise ValueError(f'unknown serialization format {name}, expected one of {", ".join(SERIALIZERS)}')
+    return SERIALIZERS[name]
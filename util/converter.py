@@ -1,13 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-#
-import base64
 import json
 import logging
 from uuid import UUID
 
 from model.dialog import Mail, Dialog
 from model.game import Game
-from util.coder import MarugotoEncoder, MarugotoDecoder
+from util.coder import MarugotoDecoder, encode, decode
 
 logger = logging.getLogger('util.converter')
 
@@ -16,13 +15,22 @@ class ConverterException(Exception):
     pass
 
 
+def parse(value):
+    """
+    decode an api object, older clients send nested objects as json strings
+    :param value: dict or json string
+    :return: decoded object
+    """
+    return json.loads(value, cls=MarugotoDecoder) if isinstance(value, str) else decode(value)
+
+
 def convert_api_game(game) -> Game:
     title = game['title']
     logger.debug(f"converting api game {title}")
     logger.debug('constructing tasks')
-    tasks = [json.loads(t, cls=MarugotoDecoder) for t in game['tasks']]
+    tasks = [parse(t) for t in game['tasks']]
     logger.debug('constructing waypoints')
-    waypoints = [json.loads(w, cls=MarugotoDecoder) for w in game['waypoints']]
+    waypoints = [parse(w) for w in game['waypoints']]
 
     logger.debug('constructing dialogs')
     dialogs = []
@@ -49,10 +57,10 @@ def convert_api_game(game) -> Game:
             interactions.append(o)
 
         for m in d['mails']:
-            mail = json.loads(m, cls=MarugotoDecoder)
+            mail = parse(m)
             concretize(mail)
         for s in d['speeches']:
-            speech = json.loads(s, cls=MarugotoDecoder)
+            speech = parse(s)
             concretize(speech)
 
         for vertex in d['graph'].items():
@@ -70,7 +78,7 @@ def convert_api_game(game) -> Game:
     logger.debug('constructing NPCs')
     npcs = []
     for n in game['npcs']:
-        npc = json.loads(n, cls=MarugotoDecoder)
+        npc = parse(n)
         npc.dialog = next(iter([d for d in dialogs if d.id == npc.dialog.id]), None)
         npcs.append(npc)
 
@@ -118,35 +126,41 @@ def convert_api_game(game) -> Game:
     return result
 
 
-def generate_api_game(game: Game):
+def generate_api_game(game: Game, binary: bool = False):
+    """
+    convert a game to its API representation
+    :param game: target
+    :param binary: keep binary data as bytes for binary formats, instead of base64 text
+    :return: dict
+    """
     logger.debug(f'converting {game.title}')
     return {
         'title': game.title,
-        'image': base64.encodebytes(game.image) if game.image else None,
+        'image': encode(game.image, binary),
         'energy': game.energy,
         'graph': generate_vertices(game),
         'start': game.start.id.hex,
-        'waypoints': [json.dumps(w, cls=MarugotoEncoder) for w in game.start.all_path_nodes()],
-        'tasks': generate_tasks(game),
-        'npcs': [json.dumps(npc, cls=MarugotoEncoder) for npc in game.npcs],
-        'dialogs': generate_dialogs(game)
+        'waypoints': [encode(w, binary) for w in game.start.all_path_nodes()],
+        'tasks': generate_tasks(game, binary),
+        'npcs': [encode(npc, binary) for npc in game.npcs],
+        'dialogs': generate_dialogs(game, binary)
     }
 
 
-def generate_dialogs(game: Game):
+def generate_dialogs(game: Game, binary: bool = False):
     result = []
 
     for npc in game.npcs:
         vertices = []
         npc_visited = {}
 
-        dialog = json.dumps(npc.dialog, cls=MarugotoEncoder)
+        dialog = encode(npc.dialog, binary)
         if isinstance(npc.dialog.start, Mail):
-            dialog['mails'] = [json.dumps(npc.dialog.start, cls=MarugotoEncoder)]
+            dialog['mails'] = [encode(npc.dialog.start, binary)]
             dialog['speeches'] = []
         else:
             dialog['mails'] = []
-            dialog['speeches'] = [json.dumps(npc.dialog.start, cls=MarugotoEncoder)]
+            dialog['speeches'] = [encode(npc.dialog.start, binary)]
 
         def dialog_traversal(s, i):
             for successor in npc.dialog.graph.successors(s):
@@ -154,9 +168,9 @@ def generate_dialogs(game: Game):
                     i[s] = []
                 if successor not in i[s]:
                     if isinstance(successor, Mail):
-                        dialog['mails'].append(json.dumps(successor, cls=MarugotoEncoder))
+                        dialog['mails'].append(encode(successor, binary))
                     else:
-                        dialog['speeched'].append(json.dumps(successor, cls=MarugotoEncoder))
+                        dialog['speeches'].append(encode(successor, binary))
                     vertices.append({
                         'from': s.id.hex,
                         'to': successor.id.hex
@@ -171,7 +185,7 @@ def generate_dialogs(game: Game):
     return result
 
 
-def generate_tasks(game: Game):
+def generate_tasks(game: Game, binary: bool = False):
     result = []
 
     wp_visited = {}
@@ -182,7 +196,7 @@ def generate_tasks(game: Game):
                 i[s] = []
             if successor not in i[s]:
                 for task in successor.tasks:
-                    result.append(json.dumps(task, cls=MarugotoEncoder))
+                    result.append(encode(task, binary))
                 wp_visited[s].append(successor)
                 game_traversal(successor, i)
 
@@ -197,7 +211,7 @@ def generate_tasks(game: Game):
                     i[s] = []
                 if successor not in i[s]:
                     if successor.task:
-                        result.append(json.dumps(successor.task, cls=MarugotoEncoder))
+                        result.append(encode(successor.task, binary))
                     npc_visited[s].append(successor)
                     dialog_traversal(successor, i)
 
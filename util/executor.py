@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-#
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, RLock
+from time import perf_counter
+
+logger = logging.getLogger('util.executor')
+
+
+class ExecutorBusyException(Exception):
+    """Raised when the executor queue is full and stays full"""
+    pass
+
+
+def create_pool(workers: int):
+    """
+    create a pool of native threads, when running under a monkey patched gevent the gevent thread pool is used
+    so waiting for a result yields to other greenlets instead of blocking the worker
+    :param workers: number of threads
+    :return: executor
+    """
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+            return GeventThreadPoolExecutor(workers)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(workers)
+
+
+class BoundedExecutor(object):
+    """
+    Thread pool for CPU bound work (that releases the GIL) with a bounded queue
+    when the queue is full callers wait up to a timeout for a slot, after which the work is refused
+    """
+    def __init__(self, workers: int = 4, queue_limit: int = 32, timeout: float = 5.0):
+        """
+        the pool is created on first use
+        :param workers: number of worker threads
+        :param queue_limit: number of submissions that can wait for a worker
+        :param timeout: seconds to wait for a free slot when the queue is full
+        """
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.completed = 0
+        self.rejected = 0
+        self.busy_time = 0.0
+        self._lock = RLock()
+        self._slots = BoundedSemaphore(workers + queue_limit)
+        self._pending = 0
+        self._pool = None
+
+    def run(self, fn, *args, **kwargs):
+        """
+        run a function on the pool and wait for its result
+        :param fn: function to run
+        :return: result of the function
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            logger.warning(f'executor queue full, rejecting {fn.__name__}')
+            raise ExecutorBusyException(f'too many pending requests for {fn.__name__}')
+        started = perf_counter()
+        try:
+            with self._lock:
+                self._pending += 1
+                if not self._pool:
+                    logger.info(f'starting executor with {self.workers} workers and a queue of {self.queue_limit}')
+                    self._pool = create_pool(self.workers)
+            return self._pool.submit(fn, *args, **kwargs).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.completed += 1
+                self.busy_time += perf_counter() - started
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """
+        executor statistics
+        :return: dict with pending, completed and rejected counts and total busy time in seconds
+        """
+        with self._lock:
+            return {'workers': self.workers, 'queue_limit': self.queue_limit, 'pending': self._pending,
+                    'completed': self.completed, 'rejected': self.rejected, 'busy_time': self.busy_time}
+
+    def shutdown(self):
+        """
+        stop the worker threads, a next run will start a new pool
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown()